@@ -0,0 +1,572 @@
+"""
+Benchmark module for AfsanehBayebot
+Drives the real Application wiring against a local stand-in for the Telegram Bot API
+
+Usage:
+    python benchmark.py --files 2000 --rate 500 --latency-ms 40 --flood-rate 0.01
+
+The stand-in serves synthetic audio updates through getUpdates, or pushes
+them to a local webhook with --webhook, and answers forward calls with
+configurable latency and injected 429 flood waits. --shared-store keeps
+dedup state in an in-process Redis protocol stand-in instead of SQLite.
+--processes runs the bot as a supervisor with worker processes instead of
+in-process, and --chats spreads the audio over several source chats.
+The report gives
+throughput, end-to-end latency (update created until its forward is
+answered) and API calls per forwarded file. Use
+--min-throughput and --max-p99-ms to fail the run on a regression.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger('afsaneh_bot')
+
+BENCH_TOKEN = "123456:BENCHMARK"
+BENCH_GROUP_ID = -1001000000001
+BENCH_CHANNEL_ID = -1001000000002
+BENCH_USER_ID = 424242
+BENCH_WEBHOOK_SECRET = "benchmark-secret"
+
+# Calls made once at startup or for polling, left out of the per-file call count
+OVERHEAD_METHODS = ("getUpdates", "getMe", "deleteWebhook", "setWebhook", "getWebhookInfo")
+
+def _percentile(ordered, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+class FakeBotApi:
+    """
+    Minimal Bot API server on localhost
+
+    Speaks just enough HTTP/1.1 (keep-alive, Content-Length bodies) for the
+    httpx client python-telegram-bot uses, and just enough of the Bot API
+    for the bot's polling and forwarding paths.
+    """
+
+    def __init__(self, latency=0.0, flood_rate=0.0, flood_wait=1, host="127.0.0.1", port=0):
+        """
+        Initialize the server (nothing listens until start())
+
+        Args:
+            latency: Seconds each non-polling call takes to answer
+            flood_rate: Fraction of forward calls answered with a 429
+            flood_wait: retry_after sent with injected 429s, in seconds
+            host: Interface to bind
+            port: TCP port to bind; 0 picks a free one
+        """
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.flood_wait = flood_wait
+        self.host = host
+        self.port = port
+        self.server = None
+        self.writers = set()
+
+        self.updates = []
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.next_channel_message_id = 1
+        self.update_ready = asyncio.Event()
+
+        self.calls = Counter()
+        self.floods = 0
+        self.replies = 0
+        self.injected_at = {}
+        self.forwarded_at = {}
+        self.last_forwarded = {}
+        self.out_of_order = 0
+        self.source_chats = set()
+        self.all_forwarded = asyncio.Event()
+        self.expected = 0
+        self.pushed = None
+
+    @property
+    def base_url(self):
+        """Bot API prefix to hand to build_application"""
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self):
+        """Start listening"""
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop listening and drop open connections"""
+        self.update_ready.set()
+        if self.server:
+            self.server.close()
+            for writer in list(self.writers):
+                writer.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    # ------------------------------------------------------------------
+    # Workload
+
+    def _chat(self, chat_id=BENCH_GROUP_ID):
+        return {"id": chat_id, "type": "supergroup", "title": "Benchmark group"}
+
+    def inject_audio(self, media_group_id=None, chat_id=BENCH_GROUP_ID):
+        """
+        Make one synthetic audio message available through getUpdates
+
+        Args:
+            media_group_id: Album the message belongs to, if any
+            chat_id: Source chat of the message
+        """
+        message_id = self.next_message_id
+        self.next_message_id += 1
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": self._chat(chat_id),
+            "from": {"id": BENCH_USER_ID, "is_bot": False, "first_name": "Bench"},
+            "audio": {
+                "file_id": f"bench-file-{message_id}",
+                "file_unique_id": f"bench-unique-{message_id}",
+                "duration": 180 + message_id % 120,
+                "performer": "Benchmark",
+                "title": f"Track {message_id}",
+                "file_name": f"track_{message_id}.mp3",
+                "file_size": 4000000 + message_id,
+            },
+        }
+        if media_group_id:
+            message["media_group_id"] = media_group_id
+
+        update = {"update_id": self.next_update_id, "message": message}
+        self.next_update_id += 1
+        self.injected_at[(chat_id, message_id)] = time.perf_counter()
+        self.source_chats.add(chat_id)
+        if self.pushed is not None:
+            self.pushed.put_nowait(update)
+        else:
+            self.updates.append(update)
+            self.update_ready.set()
+
+    async def push_updates(self, sender):
+        """
+        Deliver injected updates to a webhook instead of serving them to getUpdates
+
+        Args:
+            sender: webhook.FakeSender pointed at the bot's webhook
+        """
+        self.pushed = asyncio.Queue()
+        while True:
+            update = await self.pushed.get()
+            status = await sender.send(update)
+            if status != 200:
+                logger.warning(f"Webhook answered {status} for update {update['update_id']}")
+
+    def _record_forward(self, from_chat_id, message_ids):
+        now = time.perf_counter()
+        for message_id in message_ids:
+            # Message IDs grow with injection order, so a smaller one means a chat was reordered
+            if message_id < self.last_forwarded.get(from_chat_id, 0):
+                self.out_of_order += 1
+            self.last_forwarded[from_chat_id] = max(message_id, self.last_forwarded.get(from_chat_id, 0))
+            self.forwarded_at.setdefault((from_chat_id, message_id), now)
+        if self.expected and len(self.forwarded_at) >= self.expected:
+            self.all_forwarded.set()
+
+    # ------------------------------------------------------------------
+    # Bot API methods
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+
+        # Confirmed updates are gone for good, as on Telegram
+        if offset:
+            self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates and timeout > 0:
+            self.update_ready.clear()
+            try:
+                await asyncio.wait_for(self.update_ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:limit]
+
+    def _flood(self):
+        """Return an injected 429 response, or None to answer normally"""
+        if self.flood_rate and random.random() < self.flood_rate:
+            self.floods += 1
+            return {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.flood_wait}",
+                "parameters": {"retry_after": self.flood_wait},
+            }
+        return None
+
+    def _channel_message(self, chat_id, **fields):
+        message_id = self.next_channel_message_id
+        self.next_channel_message_id += 1
+        chat = {"id": int(chat_id), "type": "channel", "title": "Benchmark channel"}
+        return dict({"message_id": message_id, "date": int(time.time()), "chat": chat}, **fields)
+
+    async def _dispatch(self, method, params):
+        """Answer one Bot API call and return the response object"""
+        self.calls[method] += 1
+
+        if method == "getUpdates":
+            return {"ok": True, "result": await self._get_updates(params)}
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "getMe":
+            result = {"id": 123456, "is_bot": True, "first_name": "Benchmark", "username": "bench_bot"}
+        elif method == "forwardMessages":
+            flood = self._flood()
+            if flood:
+                return flood
+            message_ids = sorted(params.get("message_ids") or [])
+            result = [self._channel_message(params["chat_id"]) for _ in message_ids]
+            result = [{"message_id": message["message_id"]} for message in result]
+            self._record_forward(int(params["from_chat_id"]), message_ids)
+        elif method == "copyMessages":
+            # Fan-out fallback re-sends from a destination channel; not a source forward
+            message_ids = params.get("message_ids") or []
+            result = [{"message_id": self._channel_message(params["chat_id"])["message_id"]} for _ in message_ids]
+        elif method == "forwardMessage":
+            flood = self._flood()
+            if flood:
+                return flood
+            result = self._channel_message(params["chat_id"])
+            self._record_forward(int(params["from_chat_id"]), [int(params["message_id"])])
+        elif method == "sendMessage":
+            self.replies += 1
+            chat_id = int(params["chat_id"])
+            chat = self._chat(chat_id) if chat_id in self.source_chats else {"id": chat_id, "type": "private"}
+            result = {
+                "message_id": self.next_message_id + 1000000000,
+                "date": int(time.time()),
+                "chat": chat,
+                "text": str(params.get("text", "")),
+            }
+        elif method == "getChatAdministrators":
+            result = []
+        else:
+            result = True
+        return {"ok": True, "result": result}
+
+    # ------------------------------------------------------------------
+    # HTTP
+
+    @staticmethod
+    def _parse_params(body, content_type):
+        if not body:
+            return {}
+        if content_type.startswith("application/json"):
+            return json.loads(body)
+
+        params = {}
+        for key, value in parse_qsl(body.decode("utf-8"), keep_blank_values=True):
+            # Non-string parameters arrive JSON encoded, strings arrive raw
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    async def _handle_connection(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                path = request_line.decode("latin-1").split()[1]
+                method = path.rstrip("/").rsplit("/", 1)[-1]
+                response = await self._dispatch(method, self._parse_params(body, headers.get("content-type", "")))
+
+                payload = json.dumps(response).encode("utf-8")
+                status = "200 OK" if response["ok"] else f"{response['error_code']} Error"
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode("latin-1") + payload
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # Client went away, or the server is shutting down mid-request
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+def configure_environment(args, data_dir):
+    """
+    Point the bot's configuration at the benchmark before its modules load
+
+    config.py reads the environment at import time, so this must run before
+    anything imports bot, services or database.
+    """
+    os.environ["BOT_TOKEN"] = BENCH_TOKEN
+    os.environ["GROUP_CHAT_ID"] = str(BENCH_GROUP_ID)
+    os.environ["CHANNEL_CHAT_ID"] = str(BENCH_CHANNEL_ID)
+    os.environ["GOD_USER_ID"] = "0"
+    os.environ["DATABASE_PATH"] = os.path.join(data_dir, "benchmark.db")
+    os.environ["METRICS_PORT"] = "0"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if args.workers:
+        os.environ["FORWARD_WORKERS"] = str(args.workers)
+    if args.processes:
+        # Worker processes only share dedup state through the redis backend
+        args.shared_store = True
+    if args.shared_store:
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            args.store_port = probe.getsockname()[1]
+        os.environ["STORAGE_BACKEND"] = "redis"
+        os.environ["REDIS_URL"] = f"redis://127.0.0.1:{args.store_port}/0"
+    if not args.real_limits:
+        # Measure the bot itself rather than Telegram's published limits. The
+        # per-chat limit stays on the source groups in-process (see
+        # run_benchmark), so slow acknowledgement replies show up in the run.
+        names = ["RATE_GLOBAL_PER_SECOND", "RATE_GLOBAL_BURST"]
+        if args.processes:
+            names += ["RATE_CHAT_PER_MINUTE", "RATE_CHAT_BURST"]
+        for name in names:
+            os.environ[name] = "1000000"
+
+def bench_chats(count):
+    """Source chat IDs of the benchmark, starting with the configured group"""
+    return [BENCH_GROUP_ID - index for index in range(max(1, count))]
+
+def add_bench_routes(args):
+    """Route every extra benchmark chat to the benchmark channel"""
+    from database import db
+    from routing import route_table
+
+    # Create the default route first, as the bot would on start
+    route_table.seed(db)
+    for chat_id in bench_chats(args.chats)[1:]:
+        db.add_route(chat_id, BENCH_CHANNEL_ID)
+    db.flush()
+    route_table.load(db.get_routes())
+
+def start_supervisor(args, api):
+    """
+    Start bot.py as a supervisor with worker processes against the fake API
+
+    Returns:
+        subprocess.Popen: The supervisor process
+    """
+    env = dict(os.environ, BOT_API_URL=api.base_url)
+    bot_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+    return subprocess.Popen([sys.executable, bot_path, "--workers", str(args.processes)], env=env)
+
+async def stop_supervisor(process, timeout=30):
+    """Stop the supervisor gracefully, killing it if it does not exit in time"""
+    if process.poll() is not None:
+        return
+    process.send_signal(signal.SIGTERM)
+    loop = asyncio.get_running_loop()
+    try:
+        await asyncio.wait_for(loop.run_in_executor(None, process.wait), timeout)
+    except asyncio.TimeoutError:
+        logger.warning("Supervisor did not stop in time, killing it")
+        process.kill()
+        process.wait()
+
+async def run_benchmark(args):
+    """
+    Run one benchmark and return its report
+
+    Args:
+        args: Parsed command line options
+
+    Returns:
+        dict: Throughput, latency and call counts
+    """
+    # Imported here so configure_environment has already taken effect
+    from bot import build_application, shutdown, ALLOWED_UPDATES
+    from webhook import WebhookServer, FakeSender
+    from services import forward_pipeline
+    from storage import RespServer
+    from ratelimit import scheduler
+
+    if not args.real_limits:
+        scheduler.set_chat_limit(BENCH_CHANNEL_ID, 1000000, 1000000)
+
+    store_server = None
+    if args.shared_store:
+        store_server = RespServer(port=args.store_port)
+        await store_server.start()
+
+    api = FakeBotApi(
+        latency=args.latency_ms / 1000,
+        flood_rate=args.flood_rate,
+        flood_wait=args.flood_wait,
+    )
+    api.expected = args.files
+    await api.start()
+    add_bench_routes(args)
+
+    app = supervisor = None
+    webhook_server = pusher = sender = None
+    if args.processes:
+        supervisor = start_supervisor(args, api)
+        # Start the clock once the supervisor polls, after every worker is up
+        while not api.calls["getUpdates"]:
+            if supervisor.poll() is not None:
+                raise RuntimeError(f"Supervisor exited with code {supervisor.returncode}")
+            await asyncio.sleep(0.1)
+    else:
+        app = build_application(BENCH_TOKEN, api.base_url)
+        await app.initialize()
+        await app.start()
+        forward_pipeline.start(app.bot)
+        if args.webhook:
+            webhook_server = WebhookServer(app, listen="127.0.0.1", port=0, path="/telegram",
+                                           secret=BENCH_WEBHOOK_SECRET, url=None)
+            await webhook_server.start()
+            sender = FakeSender(f"http://127.0.0.1:{webhook_server.port}/telegram", BENCH_WEBHOOK_SECRET)
+            pusher = asyncio.create_task(api.push_updates(sender))
+            await asyncio.sleep(0)
+        else:
+            await app.updater.start_polling(allowed_updates=ALLOWED_UPDATES, poll_interval=0, timeout=10)
+
+    started = time.perf_counter()
+    try:
+        interval = 1 / args.rate if args.rate else 0
+        chats = bench_chats(args.chats)
+        for index in range(args.files):
+            album = None
+            group = index // max(1, args.album_size)
+            if args.album_size > 1:
+                album = f"bench-album-{group}"
+            # Albums stay in one chat
+            api.inject_audio(media_group_id=album, chat_id=chats[group % len(chats)])
+            if interval:
+                await asyncio.sleep(interval)
+            elif index % 100 == 99:
+                await asyncio.sleep(0)
+
+        try:
+            await asyncio.wait_for(api.all_forwarded.wait(), args.timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Timed out with {len(api.forwarded_at)}/{args.files} files forwarded")
+        finished = time.perf_counter()
+    finally:
+        if webhook_server:
+            pusher.cancel()
+            await asyncio.gather(pusher, return_exceptions=True)
+            await sender.close()
+        if supervisor:
+            await stop_supervisor(supervisor)
+        else:
+            await shutdown(app, webhook_server, timeout=5)
+        await api.stop()
+        if store_server:
+            await store_server.stop()
+
+    latencies = sorted(
+        api.forwarded_at[key] - api.injected_at[key]
+        for key in api.forwarded_at if key in api.injected_at
+    )
+    forwarded = len(latencies)
+    elapsed = (max(api.forwarded_at.values()) - started) if forwarded else finished - started
+    api_calls = sum(count for method, count in api.calls.items() if method not in OVERHEAD_METHODS)
+    forward_calls = api.calls["forwardMessages"] + api.calls["forwardMessage"]
+
+    return {
+        "files": args.files,
+        "forwarded": forwarded,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(forwarded / elapsed, 1) if elapsed > 0 else 0.0,
+        "latency_p50_ms": round(_percentile(latencies, 0.50) * 1000, 1),
+        "latency_p99_ms": round(_percentile(latencies, 0.99) * 1000, 1),
+        "api_calls_per_file": round(api_calls / forwarded, 3) if forwarded else 0.0,
+        "forward_calls_per_file": round(forward_calls / forwarded, 3) if forwarded else 0.0,
+        "injected_429s": api.floods,
+        "out_of_order": api.out_of_order,
+        "replies": api.replies,
+        "calls": dict(api.calls),
+    }
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Load benchmark against a local fake Bot API server")
+    parser.add_argument("--files", type=int, default=1000, help="audio messages to inject")
+    parser.add_argument("--rate", type=float, default=0, help="messages injected per second (0 = all at once)")
+    parser.add_argument("--album-size", type=int, default=1, help="group messages into albums of this size")
+    parser.add_argument("--latency-ms", type=float, default=30, help="latency of every non-polling API call")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="fraction of forward calls answered with 429")
+    parser.add_argument("--flood-wait", type=int, default=1, help="retry_after of injected 429s, in seconds")
+    parser.add_argument("--workers", type=int, default=0, help="override FORWARD_WORKERS")
+    parser.add_argument("--processes", type=int, default=0,
+                        help="run bot.py as a supervisor with this many worker processes (implies --shared-store)")
+    parser.add_argument("--chats", type=int, default=1, help="spread the audio over this many source chats")
+    parser.add_argument("--webhook", action="store_true", help="push updates to a local webhook instead of polling")
+    parser.add_argument("--shared-store", action="store_true", help="use the redis storage backend on a local stand-in")
+    parser.add_argument("--real-limits", action="store_true", help="keep the configured rate limits")
+    parser.add_argument("--timeout", type=float, default=120, help="give up after this many seconds")
+    parser.add_argument("--min-throughput", type=float, default=0, help="fail below this many files per second")
+    parser.add_argument("--max-p99-ms", type=float, default=0, help="fail above this p99 latency")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """Run the benchmark and return a process exit code"""
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    with tempfile.TemporaryDirectory(prefix="afsaneh-bench-") as data_dir:
+        configure_environment(args, data_dir)
+        report = asyncio.run(run_benchmark(args))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"Forwarded:            {report['forwarded']}/{report['files']} in {report['elapsed_s']}s")
+        print(f"Throughput:           {report['throughput_per_s']} files/s")
+        print(f"Latency p50 / p99:    {report['latency_p50_ms']} / {report['latency_p99_ms']} ms")
+        print(f"API calls per file:   {report['api_calls_per_file']} "
+              f"({report['forward_calls_per_file']} forward calls)")
+        print(f"Injected 429s:        {report['injected_429s']}")
+        print(f"Out of order:         {report['out_of_order']}")
+
+    failures = []
+    if report["forwarded"] < report["files"]:
+        failures.append(f"only {report['forwarded']} of {report['files']} files forwarded")
+    if report["out_of_order"]:
+        failures.append(f"{report['out_of_order']} files forwarded out of order within their chat")
+    if args.min_throughput and report["throughput_per_s"] < args.min_throughput:
+        failures.append(f"throughput {report['throughput_per_s']} < {args.min_throughput} files/s")
+    if args.max_p99_ms and report["latency_p99_ms"] > args.max_p99_ms:
+        failures.append(f"p99 latency {report['latency_p99_ms']} > {args.max_p99_ms} ms")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
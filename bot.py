@@ -1,90 +1,464 @@
 """
 Main bot module for AfsanehBayebot
 Sets up the bot and starts polling for updates
+
+Instances sharing storage elect one forwarder through the lease module; the
+others stay started and take over when the forwarder goes away.
+
+With --workers N (or PROCESS_WORKERS) the process becomes a supervisor that
+only receives updates and hands each one to the worker process owning its
+source chat (see the sharding module).
 """
 
+import argparse
 import asyncio
+import signal
 import time
 import logging
 import traceback
+from telegram import Update
 from telegram.ext import (
     Application, 
     CommandHandler, 
     MessageHandler, 
+    ChatMemberHandler,
+    TypeHandler,
     filters
 )
 
-from config import BOT_TOKEN, GROUP_CHAT_ID, GOD_USER_ID, WATCHDOG_INTERVAL, setup_logging
-from handlers import CommandHandlers, MessageHandlers, ErrorHandlers, JobHandlers
+from config import (
+    BOT_TOKEN, BOT_API_URL, GOD_USER_ID, WATCHDOG_INTERVAL, UPDATE_MODE, SHUTDOWN_TIMEOUT,
+    STORAGE_BACKEND, PROCESS_WORKERS, setup_logging
+)
+from handlers import CommandHandlers, MessageHandlers, ChatMemberHandlers, ControlHandlers, UpdateHandlers, ErrorHandlers, JobHandlers
 from localization import get_text
+from storage import store
+from services import ForwardService, forward_pipeline, media_groups
+from metrics import metrics_server
+from webhook import WebhookServer
+from routing import route_table, routed_chats
+from database import db
+from lease import forwarder_lease
+from sharding import UpdateDistributor, UpdateReceiver, local_shard
 
 # Set up logger
 logger = setup_logging()
 
+async def resume_update_offset(bot):
+    """
+    Acknowledge updates processed before the last shutdown
+    
+    Telegram keeps unconfirmed updates for 24 hours. Confirming everything up
+    to the stored offset makes polling resume right after the last update
+    the bot handled, so the downtime backlog is delivered once and flows
+    through the normal rate-limited forwarding path.
+    
+    Args:
+        bot: Telegram bot instance
+    """
+    offset = await store.get_update_offset()
+    if not offset:
+        return
+    
+    try:
+        await bot.get_updates(offset=offset + 1, limit=1, timeout=0)
+        UpdateHandlers.last_update_id = offset
+        logger.info(f"Resuming polling after update {offset}")
+    except Exception as e:
+        logger.error(f"Failed to resume from update offset {offset}: {e}")
+
+# Update types the bot polls for
+ALLOWED_UPDATES = ["message", "edited_message", "channel_post", "chat_member", "my_chat_member"]
+
+def build_application(token=BOT_TOKEN, base_url=BOT_API_URL, worker=False):
+    """
+    Create the Application with every handler and job registered
+    
+    Args:
+        token: Bot token
+        base_url: Bot API endpoint prefix (token is appended); None uses Telegram
+        worker: True in a worker process, where the supervisor tracks the
+            update offset and triggers the initial sync
+        
+    Returns:
+        Application: Ready to initialize and start
+    """
+    builder = Application.builder().token(token)
+    if base_url:
+        builder = builder.base_url(base_url)
+    app = builder.build()
+    
+    # Load the routes, creating the default route on first start
+    route_table.seed(db)
+    
+    # Register error handler
+    app.add_error_handler(ErrorHandlers.error_handler)
+    
+    # Register command handlers
+    app.add_handler(CommandHandler("start", CommandHandlers.start_command))
+    app.add_handler(CommandHandler("help", CommandHandlers.help_command))
+    app.add_handler(CommandHandler("status", CommandHandlers.status_command))
+    app.add_handler(CommandHandler("stats", CommandHandlers.stats_command))
+    app.add_handler(CommandHandler("pause", CommandHandlers.pause_command))
+    app.add_handler(CommandHandler("resume", CommandHandlers.resume_command))
+    app.add_handler(CommandHandler("language", CommandHandlers.language_command))
+    app.add_handler(CommandHandler("forward", CommandHandlers.forward_command))
+    app.add_handler(CommandHandler("healthcheck", CommandHandlers.health_check_command))
+    app.add_handler(CommandHandler("perf", CommandHandlers.perf_command))
+    app.add_handler(CommandHandler("routes", CommandHandlers.routes_command))
+    app.add_handler(CommandHandler("reloadroutes", CommandHandlers.reload_routes_command))
+    
+    # Register message handlers
+    audio_filter = filters.AUDIO & routed_chats
+    app.add_handler(MessageHandler(audio_filter, MessageHandlers.audio_message_handler))
+    
+    # Keep cached admin rosters current
+    app.add_handler(ChatMemberHandler(ChatMemberHandlers.chat_member_handler, ChatMemberHandler.ANY_CHAT_MEMBER))
+    
+    # Record the update offset once the handlers above have run
+    if not worker:
+        app.add_handler(TypeHandler(Update, UpdateHandlers.track_offset), group=1)
+    
+    # Set up watchdog and initial sync jobs
+    app.job_queue.run_repeating(
+        JobHandlers.watchdog_job,
+        interval=WATCHDOG_INTERVAL,
+        first=10.0
+    )
+    
+    if not worker:
+        app.job_queue.run_once(
+            JobHandlers.initial_sync_job,
+            when=5.0
+        )
+    
+    return app
+
+def build_ingest_application(distributor, token=BOT_TOKEN, base_url=BOT_API_URL):
+    """
+    Create the supervisor's Application, which only hands updates to the workers
+    
+    Updates are processed one at a time, so each worker receives the
+    updates of its chats in the order Telegram sent them.
+    
+    Args:
+        distributor: Started UpdateDistributor
+        token: Bot token
+        base_url: Bot API endpoint prefix (token is appended); None uses Telegram
+        
+    Returns:
+        Application: Ready to initialize and start
+    """
+    builder = Application.builder().token(token)
+    if base_url:
+        builder = builder.base_url(base_url)
+    app = builder.build()
+    
+    async def dispatch(update, context):
+        await distributor.dispatch(update)
+    
+    app.add_error_handler(ErrorHandlers.error_handler)
+    app.add_handler(TypeHandler(Update, dispatch))
+    return app
+
+async def start_ingestion(app):
+    """
+    Start receiving updates in the configured mode
+    
+    Args:
+        app: Started Application
+        
+    Returns:
+        WebhookServer: The running server in webhook mode, None when polling
+    """
+    if UPDATE_MODE == 'webhook':
+        webhook_server = WebhookServer(app)
+        await webhook_server.start(allowed_updates=ALLOWED_UPDATES)
+        return webhook_server
+    
+    await resume_update_offset(app.bot)
+    await app.updater.start_polling(allowed_updates=ALLOWED_UPDATES, drop_pending_updates=False)
+    return None
+
+async def stop_intake(app, webhook_server=None):
+    """
+    Stop receiving updates
+    
+    Args:
+        app: Application whose updater may be polling
+        webhook_server: Running WebhookServer in webhook mode
+    """
+    try:
+        if webhook_server:
+            await webhook_server.stop()
+        elif app and app.updater and app.updater.running:
+            await app.updater.stop()
+    except Exception as e:
+        logger.error(f"Error stopping update intake: {e}")
+
+async def forward_while_leader(app, shutdown_event):
+    """
+    Forward while this instance holds the forwarder lease
+    
+    Stands by until the lease is acquired, then starts intake and the
+    forwarding pipeline. If the lease is lost (this process stalled and
+    another instance took over) forwarding stops and the instance stands by
+    again.
+    
+    Args:
+        app: Started Application
+        shutdown_event: asyncio.Event set on SIGINT or SIGTERM
+        
+    Returns:
+        WebhookServer: The running server when shutdown was requested in
+        webhook mode, None otherwise
+    """
+    led_before = False
+    while await forwarder_lease.wait(shutdown_event, while_waiting=store.refresh):
+        # Load what the previous leader forwarded since the last refresh
+        await store.refresh()
+        forward_pipeline.start(app.bot)
+        webhook_server = await start_ingestion(app)
+        if led_before or JobHandlers.sync_deferred:
+            # Took over from another instance: pick up what it left unfinished
+            app.job_queue.run_once(JobHandlers.initial_sync_job, when=0)
+        if GOD_USER_ID and not led_before:
+            try:
+                await app.bot.send_message(chat_id=GOD_USER_ID, text=get_text('bot_running'))
+            except Exception as e:
+                logger.error(f"Failed to notify the god user: {e}")
+        led_before = True
+        
+        if not await forwarder_lease.hold(shutdown_event):
+            return webhook_server
+        
+        logger.warning("Standing by after losing the forwarder lease")
+        await stop_intake(app, webhook_server)
+        await forward_pipeline.stop()
+    return None
+
+def install_signal_handlers(shutdown_event):
+    """
+    Set the shutdown event on SIGINT and SIGTERM
+    
+    Args:
+        shutdown_event: asyncio.Event that main() waits on
+    """
+    loop = asyncio.get_running_loop()
+    
+    def request_shutdown(sig):
+        if shutdown_event.is_set():
+            logger.warning(f"Received {sig.name} again, already shutting down")
+            return
+        logger.info(f"Received {sig.name}, shutting down")
+        shutdown_event.set()
+    
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, request_shutdown, sig)
+        except (NotImplementedError, RuntimeError):
+            # Not available on Windows; Ctrl+C still raises KeyboardInterrupt there
+            pass
+
+async def shutdown(app, webhook_server=None, timeout=SHUTDOWN_TIMEOUT):
+    """
+    Stop the bot without losing work
+    
+    Intake stops first, then the updates already received run through the
+    handlers and the queued forwards are drained. Whatever is still queued
+    when the timeout runs out keeps its outbox intent and is resumed on the
+    next start. The forwarder lease is renewed while draining, however long
+    the timeout, and released once draining ends, so a standby takes over
+    right away. Database buffers are flushed last.
+    
+    Args:
+        app: Application to stop, or None if it was never built
+        webhook_server: Running WebhookServer in webhook mode
+        timeout: Seconds allowed for draining
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    
+    # Stop intake
+    await stop_intake(app, webhook_server)
+    
+    # Let the handlers finish the updates already received
+    try:
+        if app and app.running:
+            await app.stop()
+    except Exception as e:
+        logger.error(f"Error stopping application: {e}")
+    
+    # Forward what is queued, up to the deadline
+    async def drain():
+        await media_groups.flush()
+        return await forward_pipeline.drain(deadline - loop.time())
+    
+    try:
+        left = await forwarder_lease.keep_while(drain())
+        if left:
+            logger.warning(f"Shutdown timeout reached with {left} forwards queued; they resume on the next start")
+    except Exception as e:
+        logger.error(f"Error draining forward pipeline: {e}")
+    await forward_pipeline.stop()
+    await forwarder_lease.release()
+    await metrics_server.stop()
+    
+    # Flush buffered writes before the connections close
+    try:
+        await store.flush()
+    except Exception as e:
+        logger.error(f"Error flushing database: {e}")
+    if app:
+        await app.shutdown()
+    await store.close()
+    logger.info(f"Shutdown finished in {timeout - (deadline - loop.time()):.1f}s")
+
 async def main():
-    """Set up and run the bot"""
+    """Set up and run the bot until a shutdown signal arrives"""
     app = None
+    webhook_server = None
+    shutdown_event = asyncio.Event()
+    install_signal_handlers(shutdown_event)
     try:
         logger.info("Starting AfsanehBayebot...")
         
         # Create application
-        app = Application.builder().token(BOT_TOKEN).build()
-        
-        # Register error handler
-        app.add_error_handler(ErrorHandlers.error_handler)
-        
-        # Register command handlers
-        app.add_handler(CommandHandler("start", CommandHandlers.start_command))
-        app.add_handler(CommandHandler("help", CommandHandlers.help_command))
-        app.add_handler(CommandHandler("status", CommandHandlers.status_command))
-        app.add_handler(CommandHandler("stats", CommandHandlers.stats_command))
-        app.add_handler(CommandHandler("pause", CommandHandlers.pause_command))
-        app.add_handler(CommandHandler("resume", CommandHandlers.resume_command))
-        app.add_handler(CommandHandler("language", CommandHandlers.language_command))
-        app.add_handler(CommandHandler("forward", CommandHandlers.forward_command))
-        app.add_handler(CommandHandler("healthcheck", CommandHandlers.health_check_command))
-        
-        # Register message handlers
-        audio_filter = filters.AUDIO & filters.Chat(chat_id=GROUP_CHAT_ID)
-        app.add_handler(MessageHandler(audio_filter, MessageHandlers.audio_message_handler))
-        
-        # Set up watchdog and initial sync jobs
-        app.job_queue.run_repeating(
-            JobHandlers.watchdog_job,
-            interval=WATCHDOG_INTERVAL,
-            first=10.0
-        )
+        app = build_application()
         
-        app.job_queue.run_once(
-            JobHandlers.initial_sync_job,
-            when=5.0
-        )
+        # Copy local history into an empty shared store
+        await store.prepare()
         
         # Start the bot
         logger.info("✅ Bot is running...")
         
-        # Start the bot without using run_polling
+        # Start the bot without using run_polling or run_webhook
         await app.initialize()
         await app.start()
-        await app.updater.start_polling(allowed_updates=["message", "edited_message", "channel_post"], drop_pending_updates=True)
-        
-        # Send a test message to the god user
-        if GOD_USER_ID:
-            await app.bot.send_message(chat_id=GOD_USER_ID, text=get_text('bot_running'))
+        await metrics_server.start()
         
-        # Keep the bot running
-        while True:
-            await asyncio.sleep(1)
+        # Forward (or stand by) until SIGINT or SIGTERM
+        webhook_server = await forward_while_leader(app, shutdown_event)
         
     except Exception as e:
         logger.critical(f"Critical error in main function: {e}")
         logger.critical(traceback.format_exc())
         return 1  # Error
     finally:
-        # Ensure proper cleanup
+        await shutdown(app, webhook_server)
+
+async def supervise(workers):
+    """
+    Receive updates and distribute them over worker processes by source chat
+    
+    The supervisor holds the forwarder lease and owns intake; each worker
+    runs the handlers and forwarding pipeline for its share of the chats.
+    
+    Args:
+        workers: Number of worker processes
+        
+    Returns:
+        int: Exit code
+    """
+    if workers > 1 and STORAGE_BACKEND != 'redis':
+        # Workers are separate processes: dedup and claims must be shared
+        logger.critical("Running more than one worker requires STORAGE_BACKEND=redis")
+        return 1
+    
+    app = None
+    distributor = UpdateDistributor(workers, store)
+    webhook_server = None
+    shutdown_event = asyncio.Event()
+    install_signal_handlers(shutdown_event)
+    try:
+        logger.info(f"Starting AfsanehBayebot supervisor with {workers} workers...")
+        # Copy local history into an empty shared store before the workers use it
+        await store.prepare()
+        await distributor.start()
+        app = build_ingest_application(distributor)
+        await app.initialize()
+        await app.start()
+        await metrics_server.start()
+        
+        led_before = False
+        while await forwarder_lease.wait(shutdown_event, while_waiting=store.refresh):
+            # Each worker finishes the outbox and journal sync of its own chats
+            # before it handles any update received from here on
+            await distributor.sync()
+            webhook_server = await start_ingestion(app)
+            if GOD_USER_ID and not led_before:
+                try:
+                    await app.bot.send_message(chat_id=GOD_USER_ID, text=get_text('bot_running'))
+                except Exception as e:
+                    logger.error(f"Failed to notify the god user: {e}")
+            led_before = True
+            
+            if not await forwarder_lease.hold(shutdown_event):
+                break
+            
+            logger.warning("Standing by after losing the forwarder lease")
+            await stop_intake(app, webhook_server)
+            webhook_server = None
+        
+    except Exception as e:
+        logger.critical(f"Critical error in supervisor: {e}")
+        logger.critical(traceback.format_exc())
+        return 1  # Error
+    finally:
+        await stop_intake(app, webhook_server)
+        try:
+            if app and app.running:
+                await app.stop()
+        except Exception as e:
+            logger.error(f"Error stopping application: {e}")
+        
+        # Let the workers finish the updates already handed to them
+        left = await forwarder_lease.keep_while(distributor.drain(SHUTDOWN_TIMEOUT))
+        if left:
+            logger.warning(f"{left} updates still unacknowledged; polling resumes before them on the next start")
+        await distributor.stop()
+        await forwarder_lease.release()
+        await metrics_server.stop()
         if app:
-            await app.stop()
             await app.shutdown()
+        await store.close()
+        logger.info("Supervisor shut down")
+    return 0
+
+async def run_worker(index, workers, port):
+    """
+    Run one worker process of a supervisor
+    
+    Args:
+        index: Shard index of this worker
+        workers: Number of worker processes
+        port: Supervisor's IPC port
+    """
+    local_shard.configure(index, workers)
+    app = None
+    shutdown_event = asyncio.Event()
+    install_signal_handlers(shutdown_event)
+    try:
+        logger.info(f"Starting worker {index + 1}/{workers}...")
+        app = build_application(worker=True)
+        await app.initialize()
+        await app.start()
+        await metrics_server.start()
+        forward_pipeline.start(app.bot)
+        
+        async def initial_sync():
+            await ForwardService.resume_outbox(app.bot)
+            await ForwardService.sync_with_channel(app.bot)
+        
+        await UpdateReceiver(app, index, port, on_sync=initial_sync,
+                             on_control=ControlHandlers.apply_control).run(shutdown_event)
+        
+    except Exception as e:
+        logger.critical(f"Critical error in worker {index}: {e}")
+        logger.critical(traceback.format_exc())
+        return 1  # Error
+    finally:
+        await shutdown(app)
 
 def run_with_retry():
     """Run the main program with automatic retries on failure"""
@@ -115,5 +489,21 @@ def run_with_retry():
             logger.warning(f"Restarting bot in {wait_time} seconds (attempt {retry_count}/{max_retries})...")
             time.sleep(wait_time)
 
+def parse_args():
+    """Parse the command line"""
+    parser = argparse.ArgumentParser(description="AfsanehBayebot")
+    parser.add_argument("--workers", type=int, default=PROCESS_WORKERS,
+                        help="run as a supervisor with this many worker processes (0 runs in one process)")
+    parser.add_argument("--worker-index", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--ipc-port", type=int, default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
 if __name__ == '__main__':
-    run_with_retry() 
\ No newline at end of file
+    args = parse_args()
+    if args.worker_index is not None:
+        # Started by a supervisor, which restarts it if it exits
+        asyncio.run(run_worker(args.worker_index, args.workers, args.ipc_port))
+    elif args.workers > 0:
+        raise SystemExit(asyncio.run(supervise(args.workers)))
+    else:
+        run_with_retry()
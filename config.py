@@ -16,9 +16,42 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 GROUP_CHAT_ID = int(os.getenv('GROUP_CHAT_ID', 0))
 CHANNEL_CHAT_ID = int(os.getenv('CHANNEL_CHAT_ID', 0))
 GOD_USER_ID = int(os.getenv('GOD_USER_ID', 0))  # اضافه کردن شناسه کاربر گاد
+BOT_API_URL = os.getenv('BOT_API_URL')  # Bot API endpoint prefix, e.g. a local Bot API server; unset uses Telegram
+
+# Update Ingestion Configuration
+UPDATE_MODE = os.getenv('UPDATE_MODE', 'polling')  # 'polling' or 'webhook'
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # public HTTPS URL registered with Telegram
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # sent by Telegram in X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))  # parallel deliveries Telegram may open
 
 # Database Configuration
 DATABASE_PATH = os.getenv('DATABASE_PATH', os.path.join('data', 'forwarded_files.db'))
+DB_PATH = DATABASE_PATH
+DB_TIMEOUT = float(os.getenv('DB_TIMEOUT', 10))  # seconds to wait on a locked database
+DB_READ_POOL_SIZE = int(os.getenv('DB_READ_POOL_SIZE', 4))  # reader connections kept open
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', 8192))  # page cache per connection
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', 64 * 1024 * 1024))  # bytes memory-mapped per connection
+# 'buffered' groups writes into one transaction per batch, 'sync' commits and fsyncs every write
+DB_DURABILITY = os.getenv('DB_DURABILITY', 'buffered')
+DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', 100))  # rows per group commit
+DB_BATCH_INTERVAL_MS = int(os.getenv('DB_BATCH_INTERVAL_MS', 200))  # max delay before a group commit
+
+# Dedup Index Configuration
+DEDUP_BLOOM_CAPACITY = int(os.getenv('DEDUP_BLOOM_CAPACITY', 4000000))  # keys before false positives rise
+DEDUP_FALSE_POSITIVE_RATE = float(os.getenv('DEDUP_FALSE_POSITIVE_RATE', 0.001))
+DEDUP_CACHE_SIZE = int(os.getenv('DEDUP_CACHE_SIZE', 100000))  # recent positives kept in memory
+# Also treat files with the same duration, size, performer and title as duplicates (opt-in)
+DEDUP_MATCH_SIGNATURE = os.getenv('DEDUP_MATCH_SIGNATURE', 'false').lower() in ('1', 'true', 'yes')
+
+# Shared Storage Configuration
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite')  # 'sqlite' (one instance) or 'redis' (shared by instances)
+REDIS_URL = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0')
+REDIS_TIMEOUT = float(os.getenv('REDIS_TIMEOUT', 5))  # seconds to wait for a reply
+STORAGE_PREFIX = os.getenv('STORAGE_PREFIX', 'afsaneh:')  # key prefix, so deployments can share a server
+STORAGE_CLAIM_TTL = int(os.getenv('STORAGE_CLAIM_TTL', 300))  # seconds a claim on a file being forwarded lasts
 
 # Default Language
 DEFAULT_LANGUAGE = os.getenv('DEFAULT_LANGUAGE', 'en')
@@ -26,9 +59,59 @@ DEFAULT_LANGUAGE = os.getenv('DEFAULT_LANGUAGE', 'en')
 # Retry Configuration
 MAX_RETRIES = int(os.getenv('MAX_RETRIES', 3))
 RETRY_DELAY = int(os.getenv('RETRY_DELAY', 5))
+RETRY_MAX_DELAY = int(os.getenv('RETRY_MAX_DELAY', 60))  # cap for backoff between retries
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5))  # consecutive failures that open a circuit
+CIRCUIT_RESET_TIMEOUT = int(os.getenv('CIRCUIT_RESET_TIMEOUT', 30))  # seconds before an open circuit is retried
+
+# Message Journal Configuration
+JOURNAL_SYNC_DAYS = int(os.getenv('JOURNAL_SYNC_DAYS', 3))  # how far back the startup sync looks
+JOURNAL_RETENTION_DAYS = int(os.getenv('JOURNAL_RETENTION_DAYS', 30))  # journal entries older than this are pruned
+
+# Forward Outbox Configuration
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 5))  # failed intents are retried on startup up to this many times
+OUTBOX_RETENTION_HOURS = int(os.getenv('OUTBOX_RETENTION_HOURS', 24))  # completed intents are kept this long
+
+# Rate Limit Configuration (Telegram allows ~30 messages/s overall and 20/min per group or channel)
+RATE_GLOBAL_PER_SECOND = float(os.getenv('RATE_GLOBAL_PER_SECOND', 30))
+RATE_GLOBAL_BURST = int(os.getenv('RATE_GLOBAL_BURST', 30))
+RATE_CHAT_PER_MINUTE = float(os.getenv('RATE_CHAT_PER_MINUTE', 20))
+RATE_CHAT_BURST = int(os.getenv('RATE_CHAT_BURST', 3))
+
+# Forwarding Pipeline Configuration
+FORWARD_WORKERS = int(os.getenv('FORWARD_WORKERS', 4))  # concurrent forwarding workers
+FORWARD_QUEUE_SIZE = int(os.getenv('FORWARD_QUEUE_SIZE', 1000))  # queued forwards before handlers wait
+FORWARD_BATCH_MAX = min(100, int(os.getenv('FORWARD_BATCH_MAX', 100)))  # forwardMessages accepts at most 100
+FORWARD_BATCH_WINDOW_MS = int(os.getenv('FORWARD_BATCH_WINDOW_MS', 300))  # wait for more messages from the same chat
+MEDIA_GROUP_WINDOW_MS = int(os.getenv('MEDIA_GROUP_WINDOW_MS', 1000))  # quiet period before an album is forwarded
+# How a file that failed for one destination is sent on from another that received it: 'copy', 'forward' or 'off'
+FANOUT_REUSE = os.getenv('FANOUT_REUSE', 'copy')
+
+# Admin Cache Configuration
+ADMIN_CACHE_TTL = int(os.getenv('ADMIN_CACHE_TTL', 600))  # seconds a chat's admin list is trusted
+
+# Metrics Configuration
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 9108))  # 0 disables the /metrics endpoint
+LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', 0.5))  # seconds between event loop lag samples
+
+# Performance Timing Configuration
+PERF_ENABLED = os.getenv('PERF_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+PERF_WINDOW = int(os.getenv('PERF_WINDOW', 1024))  # samples kept per span for /perf percentiles
+
+# Forwarder Lease Configuration (instances sharing storage elect one forwarder)
+LEASE_TTL = float(os.getenv('LEASE_TTL', 10))  # seconds a lease outlives its last heartbeat
+LEASE_HEARTBEAT = float(os.getenv('LEASE_HEARTBEAT', 3))  # seconds between renewals and standby attempts
+
+# Process Configuration
+PROCESS_WORKERS = int(os.getenv('PROCESS_WORKERS', 0))  # worker processes in supervisor mode; 0 runs in one process
+
+# Shutdown Configuration
+# Seconds to drain in-flight forwards on stop; the forwarder lease is renewed meanwhile, so this may exceed LEASE_TTL
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', 20))
 
 # Watchdog Configuration
 WATCHDOG_INTERVAL = int(os.getenv('WATCHDOG_INTERVAL', 300))  # 5 minutes
+ACTIVITY_TIMEOUT = int(os.getenv('ACTIVITY_TIMEOUT', 600))  # seconds of inactivity before resetting connection
 
 # Logging Configuration
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
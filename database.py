@@ -3,148 +3,1262 @@ Database module for AfsanehBayebot
 Handles database operations for tracking forwarded files
 """
 
+import asyncio
+import functools
+import json
+import queue
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 import logging
-from config import DB_PATH, DB_TIMEOUT
+from config import (
+    DB_PATH, DB_TIMEOUT, DB_READ_POOL_SIZE, DB_CACHE_SIZE_KB, DB_MMAP_SIZE,
+    DB_DURABILITY, DB_BATCH_SIZE, DB_BATCH_INTERVAL_MS
+)
+from dedup import DedupIndex, dedup_keys, metadata_signature, scoped_keys, ANY_DESTINATION
+from metrics import DB_LATENCY
+from perf import perf
 
 logger = logging.getLogger('afsaneh_bot')
 
-class Database:
-    """Database manager class for the bot"""
-    
-    def __init__(self):
-        """Initialize the database connection and tables"""
-        self.initialize_db()
-    
-    def get_connection(self):
+# Schema migrations, applied in order and tracked with PRAGMA user_version.
+# Each step adds tables, columns or indexes, or rebuilds a small table, in one
+# transaction, so it runs online against a live database.
+MIGRATIONS = [
+    [
+        "ALTER TABLE forwarded_files ADD COLUMN file_unique_id TEXT",
+        "ALTER TABLE forwarded_files ADD COLUMN source_chat_id INTEGER",
+        "ALTER TABLE forwarded_files ADD COLUMN source_message_id INTEGER",
+        "ALTER TABLE forwarded_files ADD COLUMN duration INTEGER",
+        "ALTER TABLE forwarded_files ADD COLUMN file_size INTEGER",
+        "ALTER TABLE forwarded_files ADD COLUMN signature TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_forwarded_unique_id ON forwarded_files (file_unique_id)",
+        "CREATE INDEX IF NOT EXISTS idx_forwarded_source ON forwarded_files (source_chat_id, source_message_id)",
+        "CREATE INDEX IF NOT EXISTS idx_forwarded_signature ON forwarded_files (signature)",
+    ],
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS group_messages (
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            file_id TEXT,
+            file_unique_id TEXT,
+            file_name TEXT,
+            performer TEXT,
+            title TEXT,
+            duration INTEGER,
+            file_size INTEGER,
+            received_date TIMESTAMP,
+            PRIMARY KEY (chat_id, message_id)
+        ) WITHOUT ROWID
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_group_messages_received ON group_messages (received_date)",
+    ],
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS forward_outbox (
+            source_chat_id INTEGER NOT NULL,
+            source_message_id INTEGER NOT NULL,
+            dest_chat_id INTEGER NOT NULL,
+            payload TEXT NOT NULL,
+            state TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (source_chat_id, source_message_id, dest_chat_id)
+        ) WITHOUT ROWID
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_outbox_state ON forward_outbox (state, updated_at)",
+    ],
+    [
+        "CREATE TABLE IF NOT EXISTS bot_state (key TEXT PRIMARY KEY, value TEXT)",
+    ],
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS forward_stats (
+            scope TEXT PRIMARY KEY,
+            forwarded_count INTEGER NOT NULL DEFAULT 0,
+            last_forward_date TIMESTAMP
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_forwarded_date ON forwarded_files (forward_date)",
+    ],
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS routes (
+            source_chat_id INTEGER NOT NULL,
+            dest_chat_id INTEGER NOT NULL,
+            filters TEXT,
+            enabled INTEGER NOT NULL DEFAULT 1,
+            created_at TIMESTAMP,
+            PRIMARY KEY (source_chat_id, dest_chat_id)
+        ) WITHOUT ROWID
+        ''',
+    ],
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS forward_destinations (
+            file_id TEXT NOT NULL,
+            dest_chat_id INTEGER NOT NULL,
+            message_id INTEGER,
+            forward_date TIMESTAMP,
+            PRIMARY KEY (file_id, dest_chat_id)
+        ) WITHOUT ROWID
+        ''',
+    ],
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+        ''',
+    ],
+    [
+        # Key deliveries on the stable file_unique_id (file_id for older rows):
+        # a file saved again under a new file_id replaces its forwarded_files
+        # row, which left deliveries keyed on the old file_id behind
+        '''
+        CREATE TABLE forward_deliveries (
+            file_key TEXT NOT NULL,
+            dest_chat_id INTEGER NOT NULL,
+            message_id INTEGER,
+            forward_date TIMESTAMP,
+            PRIMARY KEY (file_key, dest_chat_id)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        INSERT OR REPLACE INTO forward_deliveries (file_key, dest_chat_id, message_id, forward_date)
+        SELECT COALESCE(f.file_unique_id, d.file_id), d.dest_chat_id, d.message_id, d.forward_date
+        FROM forward_destinations d LEFT JOIN forwarded_files f ON f.file_id = d.file_id
+        ORDER BY d.forward_date
+        ''',
+        "DROP TABLE forward_destinations",
+        "ALTER TABLE forward_deliveries RENAME TO forward_destinations",
+    ],
+]
+
+# Key of a forwarded_files row in forward_destinations
+FILE_KEY = "COALESCE(f.file_unique_id, f.file_id)"
+
+# Forward outbox states
+OUTBOX_PENDING = 'pending'
+OUTBOX_IN_FLIGHT = 'in_flight'
+OUTBOX_DONE = 'done'
+OUTBOX_FAILED = 'failed'
+
+# Row of forward_stats covering every forwarded file
+STATS_SCOPE = 'all'
+
+# SQL condition matching a forwarded row for each dedup key kind
+KEY_CONDITIONS = {
+    'u': "file_unique_id = ?",
+    'm': "(source_chat_id = ? AND source_message_id = ?)",
+    's': "signature = ?",
+    'f': "file_id = ?",
+}
+
+class ConnectionPool:
+    """
+    Keeps SQLite connections open for the lifetime of the bot
+
+    A single writer connection serializes all writes, while a small pool of
+    read-only connections serves lookups. The database runs in WAL mode so
+    readers never block on the writer and vice versa.
+    """
+
+    def __init__(self, path=DB_PATH, readers=DB_READ_POOL_SIZE, timeout=DB_TIMEOUT, synchronous="NORMAL"):
         """
-        Get a database connection with proper settings
-        
+        Initialize the pool (connections are opened lazily)
+
+        Args:
+            path: Path to the SQLite database file
+            readers: Maximum number of reader connections kept open
+            timeout: Seconds to wait for a lock or a free reader
+            synchronous: SQLite synchronous level for the writer
+        """
+        self.path = path
+        self.timeout = timeout
+        self.synchronous = synchronous
+        self.max_readers = max(1, readers)
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._reader_lock = threading.Lock()
+
+    def _connect(self, read_only=False):
+        """
+        Open a connection with the tuned pragmas applied
+
+        Args:
+            read_only: Open the connection in query-only mode
+
         Returns:
             sqlite3.Connection: Database connection object
         """
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            isolation_level=None,  # Auto-commit, transactions are explicit
+            check_same_thread=False
+        )
+        conn.execute(f"PRAGMA busy_timeout = {int(self.timeout * 1000)}")
+        if not read_only:
+            # WAL is persistent in the database file, setting it once is enough
+            conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+        if read_only:
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """
+        Borrow the writer connection (exclusive while held)
+
+        Yields:
+            sqlite3.Connection: The writer connection
+        """
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            yield self._writer
+
+    @contextmanager
+    def reader(self):
+        """
+        Borrow a reader connection from the pool
+
+        Yields:
+            sqlite3.Connection: A read-only connection
+        """
+        conn = self._acquire_reader()
+        broken = False
         try:
-            conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
-            conn.isolation_level = None  # Auto-commit
-            return conn
-        except sqlite3.Error as e:
-            logger.error(f"Database connection error: {e}")
+            yield conn
+        except sqlite3.DatabaseError:
+            broken = True
             raise
-    
+        finally:
+            if broken:
+                self._discard_reader(conn)
+            else:
+                self._readers.put(conn)
+
+    def _acquire_reader(self):
+        """Take an idle reader, open a new one, or wait for one to be returned"""
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._reader_lock:
+            if self._reader_count < self.max_readers:
+                self._reader_count += 1
+                try:
+                    return self._connect(read_only=True)
+                except sqlite3.Error:
+                    self._reader_count -= 1
+                    raise
+
+        try:
+            return self._readers.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError("Timed out waiting for a reader connection")
+
+    def _discard_reader(self, conn):
+        """Close a reader that raised a database error so it is reopened next time"""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._reader_lock:
+            self._reader_count -= 1
+
+    def close(self):
+        """Close every open connection"""
+        with self._writer_lock:
+            if self._writer is not None:
+                try:
+                    self._writer.close()
+                except sqlite3.Error as e:
+                    logger.error(f"Error closing writer connection: {e}")
+                self._writer = None
+
+        while True:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                break
+            self._discard_reader(conn)
+
+class WriteBehindBuffer:
+    """
+    Groups writes into one transaction per batch
+
+    Statements are queued and committed together once max_rows are pending
+    or the oldest has waited max_delay_ms, so a burst of N saves costs one
+    fsync instead of N. A background thread performs the commits.
+    """
+
+    def __init__(self, pool, max_rows=DB_BATCH_SIZE, max_delay_ms=DB_BATCH_INTERVAL_MS):
+        """
+        Initialize the buffer and start its flusher thread
+
+        Args:
+            pool: ConnectionPool whose writer receives the batches
+            max_rows: Pending statements that trigger an immediate commit
+            max_delay_ms: Longest a statement may wait before being committed
+        """
+        self.pool = pool
+        self.max_rows = max(1, max_rows)
+        self.max_delay = max_delay_ms / 1000
+        self._pending = []
+        self._oldest = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='db-write-behind', daemon=True)
+        self._thread.start()
+
+    def put(self, statements):
+        """
+        Queue statements for the next group commit
+
+        Statements queued together always land in the same transaction.
+
+        Args:
+            statements: List of (sql, params) tuples
+        """
+        with self._cond:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Write-behind buffer is closed")
+            first = not self._pending
+            if first:
+                self._oldest = time.monotonic()
+            self._pending.extend(statements)
+            # Wake the flusher to start the age timer, or to commit a full batch
+            if first or len(self._pending) >= self.max_rows:
+                self._cond.notify()
+
+    def pending(self):
+        """Return the number of statements waiting to be committed"""
+        with self._cond:
+            return len(self._pending)
+
+    def _run(self):
+        """Flusher thread: commit whenever the size or age threshold is reached"""
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if len(self._pending) >= self.max_rows:
+                        break
+                    if self._pending:
+                        remaining = self._oldest + self.max_delay - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                if self._closed and not self._pending:
+                    return
+            self.flush()
+
+    def flush(self):
+        """
+        Commit every pending statement in a single transaction
+
+        Returns:
+            int: Number of statements committed
+        """
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+                self._oldest = None
+            if not batch:
+                return 0
+
+            try:
+                with self.pool.writer() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    try:
+                        for sql, params in batch:
+                            conn.execute(sql, params)
+                        conn.execute("COMMIT")
+                    except sqlite3.Error:
+                        conn.execute("ROLLBACK")
+                        raise
+                logger.debug(f"Group commit of {len(batch)} statements")
+                return len(batch)
+            except sqlite3.Error as e:
+                logger.error(f"Group commit failed, will retry {len(batch)} statements: {e}")
+                with self._cond:
+                    self._pending = batch + self._pending
+                    self._oldest = time.monotonic()
+                return 0
+
+    def close(self):
+        """Stop the flusher thread after committing everything still pending"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=self.pool.timeout)
+        self.flush()
+
+@perf.instrument
+class Database:
+    """Database manager class for the bot"""
+
+    def __init__(self, path=DB_PATH, durability=DB_DURABILITY):
+        """
+        Initialize the connection pool, tables and dedup index
+
+        Args:
+            path: Path to the SQLite database file
+            durability: 'buffered' for group commits, 'sync' to fsync every write
+        """
+        self.durability = durability
+        if durability == "sync":
+            self.pool = ConnectionPool(path, synchronous="FULL")
+            self.writes = None
+        else:
+            self.pool = ConnectionPool(path)
+            self.writes = WriteBehindBuffer(self.pool)
+        self.dedup = DedupIndex()
+        self.dedup_rowid = 0
+        self.stats = {'count': 0, 'last_date': None}
+        self._stats_lock = threading.Lock()
+        self.initialize_db()
+        self.warm_dedup_index()
+        self.rebuild_stats()
+
     def initialize_db(self):
         """Initialize the database tables if they don't exist"""
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS forwarded_files (
-                file_id TEXT PRIMARY KEY,
-                file_name TEXT,
-                performer TEXT,
-                title TEXT,
-                forward_date TIMESTAMP,
-                message_id INTEGER
-            )
-            ''')
-            conn.commit()
+            with self.pool.writer() as conn:
+                conn.execute('''
+                CREATE TABLE IF NOT EXISTS forwarded_files (
+                    file_id TEXT PRIMARY KEY,
+                    file_name TEXT,
+                    performer TEXT,
+                    title TEXT,
+                    forward_date TIMESTAMP,
+                    message_id INTEGER
+                )
+                ''')
+                self.migrate(conn)
             logger.info("Database initialized successfully")
         except sqlite3.Error as e:
             logger.error(f"Database initialization error: {e}")
-        finally:
-            if 'conn' in locals() and conn:
-                conn.close()
-    
-    def save_forwarded_file(self, file_id, file_name="", performer="", title="", message_id=0):
+
+    def migrate(self, conn):
+        """
+        Apply schema migrations newer than the database's user_version
+
+        Args:
+            conn: The writer connection
+        """
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql in statements:
+                    conn.execute(sql)
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+            logger.info(f"Database migrated to schema version {number}")
+
+    @staticmethod
+    def _file_keys(cursor):
+        """Yield the dedup keys of (file, destination) rows from the warm-up query"""
+        last_file_id = None
+        for file_id, file_unique_id, source_chat_id, source_message_id, signature, dest_chat_id in cursor:
+            file_keys = dedup_keys(file_id, file_unique_id, source_chat_id, source_message_id, signature)
+            if file_id != last_file_id:
+                yield from file_keys
+                last_file_id = file_id
+            yield from scoped_keys(file_keys, ANY_DESTINATION if dest_chat_id is None else dest_chat_id)
+
+    def _file_rows(self, conn, after_rowid=0):
+        """Query forwarded files saved after a rowid, one row per destination"""
+        return conn.execute(
+            "SELECT f.file_id, f.file_unique_id, f.source_chat_id, f.source_message_id, f.signature, "
+            "d.dest_chat_id FROM forwarded_files f "
+            f"LEFT JOIN forward_destinations d ON d.file_key = {FILE_KEY} WHERE f.rowid > ? ORDER BY f.rowid",
+            (after_rowid,)
+        )
+
+    def warm_dedup_index(self):
+        """
+        Load the identity keys of every forwarded file into the in-memory dedup index
+
+        Each file contributes its plain keys plus one scoped copy per
+        destination it reached (ANY_DESTINATION for files saved before
+        destinations were recorded).
+        """
+        try:
+            with self.pool.reader() as conn:
+                total, rowid = conn.execute(
+                    "SELECT (SELECT COUNT(*) FROM forwarded_files) + (SELECT COUNT(*) FROM forward_destinations), "
+                    "(SELECT IFNULL(MAX(rowid), 0) FROM forwarded_files)"
+                ).fetchone()
+                self.dedup.warm(self._file_keys(self._file_rows(conn)), total * 2 * len(KEY_CONDITIONS))
+                self.dedup_rowid = rowid
+        except sqlite3.Error as e:
+            logger.error(f"Error warming dedup index: {e}")
+
+    def catch_up(self):
+        """
+        Pick up forwards committed by other processes sharing the database file
+
+        Adds the keys of files saved since the index was last loaded (a file
+        saved again, e.g. for another destination, gets a new rowid) and
+        reloads the stats row, which every process keeps exact.
+
+        Returns:
+            int: Number of new file rows loaded
+        """
+        self.flush()
+        try:
+            with self.pool.reader() as conn:
+                rowid = conn.execute("SELECT IFNULL(MAX(rowid), 0) FROM forwarded_files").fetchone()[0]
+                cursor = self._file_rows(conn, self.dedup_rowid)
+                count = 0
+                for key in self._file_keys(cursor):
+                    self.dedup.add(key)
+                    count += 1
+                stats = conn.execute(
+                    "SELECT forwarded_count, last_forward_date FROM forward_stats WHERE scope = ?", (STATS_SCOPE,)
+                ).fetchone()
+            self.dedup_rowid = max(self.dedup_rowid, rowid)
+            if stats:
+                with self._stats_lock:
+                    self.stats = {'count': stats[0], 'last_date': stats[1]}
+            if count:
+                logger.debug(f"Loaded {count} dedup keys written by other processes")
+            return count
+        except sqlite3.Error as e:
+            logger.error(f"Error catching up with the database: {e}")
+            return 0
+
+    def rebuild_stats(self):
+        """
+        Recompute the forward stats from forwarded_files and store them
+
+        Runs once at startup so the counters are exact even after a crash
+        lost buffered writes or rows were changed outside the bot. From
+        then on they are maintained incrementally by save_forwarded_files.
+        """
+        try:
+            with self.pool.reader() as conn:
+                count, last_date = conn.execute(
+                    "SELECT COUNT(*), MAX(forward_date) FROM forwarded_files"
+                ).fetchone()
+            self._write([(
+                "INSERT OR REPLACE INTO forward_stats (scope, forwarded_count, last_forward_date) VALUES (?, ?, ?)",
+                (STATS_SCOPE, count, last_date)
+            )], immediate=True)
+            with self._stats_lock:
+                self.stats = {'count': count, 'last_date': last_date}
+        except sqlite3.Error as e:
+            logger.error(f"Error rebuilding forward stats: {e}")
+
+    def _write(self, statements, immediate=False):
+        """
+        Execute writes atomically, or queue them for the next group commit
+
+        Args:
+            statements: List of (sql, params) tuples
+            immediate: Commit now even in buffered mode
+        """
+        if self.writes is not None and not immediate:
+            self.writes.put(statements)
+            return
+        with self.pool.writer() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    conn.execute(sql, params)
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+
+    def flush(self):
+        """Commit any buffered writes now"""
+        if self.writes is not None:
+            self.writes.flush()
+
+    def save_forwarded_file(self, file_id, file_name="", performer="", title="", message_id=0,
+                            file_unique_id=None, source_chat_id=None, source_message_id=None,
+                            duration=None, file_size=None):
         """
         Save a forwarded file to the database
-        
+
+        In buffered mode the row is committed with the next batch, while the
+        dedup index sees it immediately.
+
         Args:
-            file_id: Unique identifier for the audio file
+            file_id: Telegram file ID of the audio
             file_name: Name of the file
             performer: Performer of the audio
             title: Title of the audio
             message_id: Message ID in the channel
+            file_unique_id: Stable identifier of the file content
+            source_chat_id: Chat the audio was posted in
+            source_message_id: Message ID in the source chat
+            duration: Duration in seconds
+            file_size: Size in bytes
+        """
+        self.save_forwarded_files([{
+            'file_id': file_id, 'file_name': file_name, 'performer': performer, 'title': title,
+            'message_id': message_id, 'file_unique_id': file_unique_id, 'source_chat_id': source_chat_id,
+            'source_message_id': source_message_id, 'duration': duration, 'file_size': file_size,
+        }])
+
+    def save_forwarded_files(self, records, dest_chat_id=None):
+        """
+        Save several forwarded files in one transaction
+
+        Args:
+            records: List of dicts with the arguments of save_forwarded_file
+            dest_chat_id: If given, the delivery to this destination is
+                recorded and the matching outbox intents are marked done in
+                the same transaction, committed immediately like the intents
+                so a crash cannot lose the completion and forward again
         """
+        statements = []
+        record_keys = []
+        now = datetime.now()
+        for record in records:
+            performer = record.get('performer', "")
+            title = record.get('title', "")
+            signature = metadata_signature(record.get('duration'), record.get('file_size'), performer, title)
+            record_keys.append(dedup_keys(signature=signature, **record))
+            # Count the row only if it does not replace one already stored
+            statements.append((
+                "UPDATE forward_stats SET forwarded_count = forwarded_count + NOT EXISTS ("
+                "SELECT 1 FROM forwarded_files WHERE file_id = ? OR file_unique_id = ?), "
+                "last_forward_date = ? WHERE scope = ?",
+                (record['file_id'], record.get('file_unique_id'), now, STATS_SCOPE)
+            ))
+            statements.append((
+                "INSERT OR REPLACE INTO forwarded_files (file_id, file_name, performer, title, forward_date, "
+                "message_id, file_unique_id, source_chat_id, source_message_id, duration, file_size, signature) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (record['file_id'], record.get('file_name', ""), performer, title, now,
+                 record.get('message_id', 0), record.get('file_unique_id'), record.get('source_chat_id'),
+                 record.get('source_message_id'), record.get('duration'), record.get('file_size'), signature)
+            ))
+            if record.get('file_unique_id'):
+                # Deliveries of a row saved before file_unique_id was known follow it to the new key
+                statements.append((
+                    "UPDATE OR REPLACE forward_destinations SET file_key = ? WHERE file_key = ?",
+                    (record['file_unique_id'], record['file_id'])
+                ))
+            if dest_chat_id is not None:
+                statements.append((
+                    "INSERT OR REPLACE INTO forward_destinations (file_key, dest_chat_id, message_id, forward_date) "
+                    "VALUES (?, ?, ?, ?)",
+                    (record.get('file_unique_id') or record['file_id'], dest_chat_id, record.get('message_id', 0), now)
+                ))
+        if dest_chat_id is not None:
+            statements.extend(self._outbox_updates(records, dest_chat_id, OUTBOX_DONE))
+
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT OR REPLACE INTO forwarded_files VALUES (?, ?, ?, ?, ?, ?)",
-                (file_id, file_name, performer, title, datetime.now(), message_id)
-            )
-            conn.commit()
-            logger.debug(f"File saved to database: {file_id}")
+            self._write(statements, immediate=dest_chat_id is not None)
+            # Under the lock so a file saved for several destinations at once is counted once
+            with self._stats_lock:
+                new_files = 0
+                for keys in record_keys:
+                    if not self.dedup.lookup_any(keys)[0]:
+                        new_files += 1
+                    keys = keys + scoped_keys(keys, ANY_DESTINATION if dest_chat_id is None else dest_chat_id)
+                    for key in keys:
+                        self.dedup.add(key)
+                self.stats = {'count': self.stats['count'] + new_files, 'last_date': str(now)}
+            logger.debug(f"Saved {len(records)} forwarded files to database")
         except sqlite3.Error as e:
-            logger.error(f"Error saving forwarded file: {e}")
-        finally:
-            if 'conn' in locals() and conn:
-                conn.close()
-    
-    def is_file_forwarded(self, file_id):
+            logger.error(f"Error saving forwarded files: {e}")
+
+    def lookup_forwarded(self, file_id=None, file_unique_id=None, source_chat_id=None, source_message_id=None,
+                         duration=None, file_size=None, performer="", title="", dest_chat_id=None, **_):
+        """
+        Answer a duplicate check from the in-memory index alone
+
+        Returns:
+            tuple: (True, []) if known forwarded, otherwise (False, keys
+            that only the database can rule out)
+        """
+        signature = metadata_signature(duration, file_size, performer, title)
+        keys = dedup_keys(file_id, file_unique_id, source_chat_id, source_message_id, signature)
+        if dest_chat_id is not None:
+            # Files never forwarded anywhere need no per-destination check
+            known, unknown = self.dedup.lookup_any(keys)
+            if not known and not unknown:
+                return False, []
+            keys = scoped_keys(keys, dest_chat_id) + scoped_keys(keys, ANY_DESTINATION)
+        return self.dedup.lookup_any(keys)
+
+    def is_file_forwarded(self, file_id=None, **identity):
         """
         Check if a file has been forwarded before
-        
+
+        The file matches if its file_unique_id, source chat and message, or
+        metadata signature match a forwarded row, or (for rows saved before
+        file_unique_id was stored) its file_id does. With dest_chat_id the
+        match must also have reached that destination; files saved before
+        destinations were recorded count as delivered everywhere.
+
         Args:
             file_id: The file ID to check
-            
+            **identity: Optional file_unique_id, source_chat_id,
+                source_message_id, duration, file_size, performer, title
+                and dest_chat_id
+
         Returns:
             bool: True if file was forwarded, False otherwise
         """
+        known, unknown = self.lookup_forwarded(file_id, **identity)
+        if known or not unknown:
+            return known
+        return self._query_forwarded(unknown)
+
+    def _query_forwarded(self, keys):
+        """Check dedup keys the index could not rule out against forwarded_files"""
+        conditions = []
+        params = []
+        for key in keys:
+            scope, _, key = key.rpartition('|')
+            kind, value = key.split(':', 1)
+            condition = KEY_CONDITIONS[kind]
+            if kind == 'm':
+                chat_id, message_id = value.split(':')
+                key_params = [int(chat_id), int(message_id)]
+            else:
+                key_params = [value]
+
+            if scope == ANY_DESTINATION:
+                condition += f" AND NOT EXISTS (SELECT 1 FROM forward_destinations d WHERE d.file_key = {FILE_KEY})"
+            elif scope:
+                condition += (" AND EXISTS (SELECT 1 FROM forward_destinations d "
+                              f"WHERE d.file_key = {FILE_KEY} AND d.dest_chat_id = ?)")
+                key_params.append(int(scope))
+            conditions.append(f"({condition})")
+            params.extend(key_params)
+
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1 FROM forwarded_files WHERE file_id = ?", (file_id,))
-            result = cursor.fetchone() is not None
-            return result
+            with self.pool.reader() as conn:
+                cursor = conn.execute(
+                    f"SELECT 1 FROM forwarded_files f WHERE {' OR '.join(conditions)} LIMIT 1", params
+                )
+                found = cursor.fetchone() is not None
+            if found:
+                for key in keys:
+                    self.dedup.add(key)
+            return found
         except sqlite3.Error as e:
             logger.error(f"Error checking forwarded file: {e}")
             return False  # Assume not forwarded on error
-        finally:
-            if 'conn' in locals() and conn:
-                conn.close()
-    
-    def get_forwarded_count(self):
+
+    def get_forwarded_files(self, after_rowid=0, limit=1000):
         """
-        Get the count of forwarded files
-        
+        List forwarded files with their deliveries in rowid order, for copying to another backend
+
+        Args:
+            after_rowid: Only files stored after this rowid
+            limit: Most files returned (all deliveries of each are included)
+
         Returns:
-            int: Number of forwarded files
+            list: (rowid, record, dest_chat_id) tuples; record carries the
+            message_id in that destination, and dest_chat_id is None for
+            files saved before destinations were recorded
         """
+        self.flush()
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(*) FROM forwarded_files")
-            count = cursor.fetchone()[0]
-            return count
+            with self.pool.reader() as conn:
+                cursor = conn.execute(
+                    "SELECT f.rowid, f.file_id, f.file_name, f.performer, f.title, f.file_unique_id, "
+                    "f.source_chat_id, f.source_message_id, f.duration, f.file_size, "
+                    "COALESCE(d.message_id, f.message_id), d.dest_chat_id FROM forwarded_files f "
+                    f"LEFT JOIN forward_destinations d ON d.file_key = {FILE_KEY} "
+                    "WHERE f.rowid IN (SELECT rowid FROM forwarded_files WHERE rowid > ? ORDER BY rowid LIMIT ?) "
+                    "ORDER BY f.rowid",
+                    (after_rowid, limit)
+                )
+                return [(row[0], {
+                    'file_id': row[1], 'file_name': row[2], 'performer': row[3], 'title': row[4],
+                    'file_unique_id': row[5], 'source_chat_id': row[6], 'source_message_id': row[7],
+                    'duration': row[8], 'file_size': row[9], 'message_id': row[10],
+                }, row[11]) for row in cursor]
         except sqlite3.Error as e:
-            logger.error(f"Error getting forwarded count: {e}")
-            return 0
-        finally:
-            if 'conn' in locals() and conn:
-                conn.close()
-    
-    def get_last_forwarded_date(self):
+            logger.error(f"Error listing forwarded files: {e}")
+            return []
+
+    def record_group_messages(self, records):
+        """
+        Journal audio messages seen in a source chat
+
+        Args:
+            records: List of audio records (see dedup.audio_record)
+        """
+        now = datetime.now()
+        try:
+            self._write([(
+                "INSERT OR IGNORE INTO group_messages (chat_id, message_id, file_id, file_unique_id, "
+                "file_name, performer, title, duration, file_size, received_date) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (record['source_chat_id'], record['source_message_id'], record['file_id'],
+                 record.get('file_unique_id'), record.get('file_name', ""), record.get('performer', ""),
+                 record.get('title', ""), record.get('duration'), record.get('file_size'), now)
+            ) for record in records])
+        except sqlite3.Error as e:
+            logger.error(f"Error journaling group messages: {e}")
+
+    def get_unforwarded_messages(self, since):
         """
-        Get the date of the last forwarded file
-        
+        List journaled messages that have no matching forwarded file
+
+        Args:
+            since: Only consider messages received after this datetime
+
         Returns:
-            str: Date of last forwarded file or "N/A" if none
+            list: Audio records ordered by chat and message ID
         """
+        self.flush()
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT forward_date FROM forwarded_files ORDER BY forward_date DESC LIMIT 1")
-            result = cursor.fetchone()
-            if result:
-                return result[0]
-            return "N/A"
+            with self.pool.reader() as conn:
+                cursor = conn.execute('''
+                SELECT g.chat_id, g.message_id, g.file_id, g.file_unique_id, g.file_name,
+                       g.performer, g.title, g.duration, g.file_size
+                FROM group_messages g
+                WHERE g.received_date >= ?
+                AND NOT EXISTS (
+                    SELECT 1 FROM forwarded_files f
+                    WHERE f.source_chat_id = g.chat_id AND f.source_message_id = g.message_id
+                )
+                AND NOT EXISTS (
+                    SELECT 1 FROM forwarded_files f WHERE f.file_unique_id = g.file_unique_id
+                )
+                ORDER BY g.chat_id, g.message_id
+                ''', (since,))
+                return [{
+                    'source_chat_id': row[0], 'source_message_id': row[1], 'file_id': row[2],
+                    'file_unique_id': row[3], 'file_name': row[4] or "", 'performer': row[5] or "",
+                    'title': row[6] or "", 'duration': row[7], 'file_size': row[8],
+                } for row in cursor]
         except sqlite3.Error as e:
-            logger.error(f"Error getting last forwarded date: {e}")
-            return "N/A"
-        finally:
-            if 'conn' in locals() and conn:
-                conn.close()
+            logger.error(f"Error reading message journal: {e}")
+            return []
+
+    def prune_group_messages(self, before):
+        """
+        Delete journal entries received before a cutoff
+
+        Args:
+            before: Datetime; older entries are removed
+        """
+        try:
+            self._write([("DELETE FROM group_messages WHERE received_date < ?", (before,))])
+        except sqlite3.Error as e:
+            logger.error(f"Error pruning message journal: {e}")
+
+    def add_outbox_intents(self, records, dest_chat_id):
+        """
+        Durably record the intent to forward messages before they are queued
+
+        Intents are committed immediately, bypassing the write-behind buffer,
+        so a crash right after queueing cannot lose them. An intent that
+        already exists is reset to pending unless it is done.
+
+        Args:
+            records: List of audio records (see dedup.audio_record)
+            dest_chat_id: Chat the messages will be forwarded to
+        """
+        now = datetime.now()
+        try:
+            self._write([(
+                "INSERT INTO forward_outbox (source_chat_id, source_message_id, dest_chat_id, payload, "
+                "state, attempts, created_at, updated_at) VALUES (?, ?, ?, ?, ?, 0, ?, ?) "
+                "ON CONFLICT (source_chat_id, source_message_id, dest_chat_id) DO UPDATE SET "
+                "state = excluded.state, updated_at = excluded.updated_at WHERE state != ?",
+                (record['source_chat_id'], record['source_message_id'], dest_chat_id, json.dumps(record),
+                 OUTBOX_PENDING, now, now, OUTBOX_DONE)
+            ) for record in records], immediate=True)
+        except sqlite3.Error as e:
+            logger.error(f"Error recording forward intents: {e}")
+
+    def _outbox_updates(self, records, dest_chat_id, state):
+        """Build the statements moving intents to a new state (done is final)"""
+        attempts = 1 if state == OUTBOX_IN_FLIGHT else 0
+        now = datetime.now()
+        return [(
+            "UPDATE forward_outbox SET state = ?, attempts = attempts + ?, updated_at = ? "
+            "WHERE source_chat_id = ? AND source_message_id = ? AND dest_chat_id = ? AND state != ?",
+            (state, attempts, now, record['source_chat_id'], record['source_message_id'], dest_chat_id, OUTBOX_DONE)
+        ) for record in records]
+
+    def mark_outbox(self, records, dest_chat_id, state):
+        """
+        Move forward intents to a new state
+
+        Marking is idempotent and never leaves the done state, so replaying
+        a completion after a crash is harmless. Done is committed
+        immediately; other states may wait for the next group commit.
+
+        Args:
+            records: List of audio records (see dedup.audio_record)
+            dest_chat_id: Chat the messages are forwarded to
+            state: One of OUTBOX_IN_FLIGHT, OUTBOX_DONE or OUTBOX_FAILED
+        """
+        try:
+            self._write(self._outbox_updates(records, dest_chat_id, state), immediate=state == OUTBOX_DONE)
+        except sqlite3.Error as e:
+            logger.error(f"Error updating forward intents: {e}")
+
+    def get_outbox_intents(self, max_attempts):
+        """
+        List intents left unfinished by a previous run
+
+        Pending and in-flight intents are returned, as are failed ones that
+        have been attempted fewer than max_attempts times.
+
+        Args:
+            max_attempts: Attempts after which a failed intent is given up
+
+        Returns:
+            list: (dest_chat_id, audio record) tuples ordered by source chat and message
+        """
+        self.flush()
+        try:
+            with self.pool.reader() as conn:
+                cursor = conn.execute(
+                    "SELECT dest_chat_id, payload FROM forward_outbox "
+                    "WHERE state IN (?, ?) OR (state = ? AND attempts < ?) "
+                    "ORDER BY source_chat_id, source_message_id",
+                    (OUTBOX_PENDING, OUTBOX_IN_FLIGHT, OUTBOX_FAILED, max_attempts)
+                )
+                return [(dest_chat_id, json.loads(payload)) for dest_chat_id, payload in cursor]
+        except sqlite3.Error as e:
+            logger.error(f"Error reading forward outbox: {e}")
+            return []
+
+    def prune_outbox(self, before):
+        """
+        Delete completed intents last updated before a cutoff
+
+        Args:
+            before: Datetime; older done intents are removed
+        """
+        try:
+            self._write([("DELETE FROM forward_outbox WHERE state = ? AND updated_at < ?", (OUTBOX_DONE, before))])
+        except sqlite3.Error as e:
+            logger.error(f"Error pruning forward outbox: {e}")
+
+    def get_state(self, key, default=None):
+        """
+        Read a value from the bot_state key-value table
+
+        Args:
+            key: Name of the value
+            default: Returned if the key is missing
+
+        Returns:
+            str: Stored value or default
+        """
+        self.flush()
+        try:
+            with self.pool.reader() as conn:
+                row = conn.execute("SELECT value FROM bot_state WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else default
+        except sqlite3.Error as e:
+            logger.error(f"Error reading bot state {key}: {e}")
+            return default
+
+    def set_state(self, key, value):
+        """
+        Store a value in the bot_state key-value table
+
+        Args:
+            key: Name of the value
+            value: Value to store (converted to text)
+        """
+        try:
+            self._write([("INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)", (key, str(value)))])
+        except sqlite3.Error as e:
+            logger.error(f"Error saving bot state {key}: {e}")
+
+    def get_routes(self):
+        """
+        Get every enabled forwarding route
+
+        Returns:
+            list: (source_chat_id, dest_chat_id, filters dict) tuples
+        """
+        try:
+            with self.pool.reader() as conn:
+                rows = conn.execute(
+                    "SELECT source_chat_id, dest_chat_id, filters FROM routes WHERE enabled = 1 "
+                    "ORDER BY source_chat_id, created_at"
+                ).fetchall()
+            return [(source, dest, json.loads(filters) if filters else {}) for source, dest, filters in rows]
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f"Error reading routes: {e}")
+            return []
+
+    def add_route(self, source_chat_id, dest_chat_id, filters=None):
+        """
+        Add a route, or replace the filters of an existing one and enable it
+
+        Args:
+            source_chat_id: Chat audio is taken from
+            dest_chat_id: Chat audio is forwarded to
+            filters: Optional dict of route filters (see routing.Route)
+        """
+        try:
+            self._write([(
+                "INSERT INTO routes (source_chat_id, dest_chat_id, filters, enabled, created_at) "
+                "VALUES (?, ?, ?, 1, ?) ON CONFLICT (source_chat_id, dest_chat_id) DO UPDATE SET "
+                "filters = excluded.filters, enabled = 1",
+                (source_chat_id, dest_chat_id, json.dumps(filters) if filters else None, datetime.now())
+            )], immediate=True)
+        except sqlite3.Error as e:
+            logger.error(f"Error adding route {source_chat_id} -> {dest_chat_id}: {e}")
+
+    def remove_route(self, source_chat_id, dest_chat_id):
+        """
+        Delete a route
+
+        Args:
+            source_chat_id: Chat audio is taken from
+            dest_chat_id: Chat audio is forwarded to
+        """
+        try:
+            self._write([(
+                "DELETE FROM routes WHERE source_chat_id = ? AND dest_chat_id = ?",
+                (source_chat_id, dest_chat_id)
+            )], immediate=True)
+        except sqlite3.Error as e:
+            logger.error(f"Error removing route {source_chat_id} -> {dest_chat_id}: {e}")
+
+    def get_update_offset(self):
+        """
+        Get the ID of the last fully processed update
+
+        Returns:
+            int: Update ID, or 0 if none was recorded
+        """
+        return int(self.get_state('update_offset', 0))
+
+    def save_update_offset(self, update_id):
+        """
+        Record the ID of the last fully processed update
+
+        Args:
+            update_id: Telegram update ID
+        """
+        self.set_state('update_offset', update_id)
+
+    def acquire_lease(self, name, owner, ttl):
+        """
+        Take or renew a named lease
+
+        The lease goes to owner if it is free, expired or already held by
+        owner. Check and update run in one immediate transaction, so of
+        several processes sharing the database file only one can win.
+
+        Args:
+            name: Lease name
+            owner: Unique ID of the caller
+            ttl: Seconds the lease is held from now
+
+        Returns:
+            bool: True if owner holds the lease
+        """
+        now = time.time()
+        try:
+            with self.pool.writer() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    conn.execute(
+                        "INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?) "
+                        "ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                        "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+                        (name, owner, now + ttl, now)
+                    )
+                    holder = conn.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()[0]
+                    conn.execute("COMMIT")
+                except sqlite3.Error:
+                    conn.execute("ROLLBACK")
+                    raise
+            return holder == owner
+        except sqlite3.Error as e:
+            logger.error(f"Error acquiring lease {name}: {e}")
+            return False
+
+    def release_lease(self, name, owner):
+        """
+        Give up a lease held by owner so another process can take it at once
+
+        Args:
+            name: Lease name
+            owner: Unique ID the lease was acquired with
+        """
+        try:
+            self._write([("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))], immediate=True)
+        except sqlite3.Error as e:
+            logger.error(f"Error releasing lease {name}: {e}")
+
+    def get_forwarded_count(self):
+        """
+        Get the count of forwarded files from the maintained stats
+
+        Returns:
+            int: Number of forwarded files
+        """
+        return self.stats['count']
+
+    def get_last_forwarded_date(self):
+        """
+        Get the date of the last forwarded file from the maintained stats
+
+        Returns:
+            str: Date of last forwarded file or "N/A" if none
+        """
+        return self.stats['last_date'] or "N/A"
+
+    def close(self):
+        """Flush buffered writes and close all pooled connections"""
+        if self.writes is not None:
+            self.writes.close()
+        self.pool.close()
+
+class AsyncDatabase:
+    """
+    Awaitable facade over Database for use from coroutines
+
+    Every call runs on a dedicated thread pool so a slow disk or a lock wait
+    never blocks the event loop.
+    """
+
+    def __init__(self, database, workers=DB_READ_POOL_SIZE + 1):
+        """
+        Initialize the facade
+
+        Args:
+            database: The Database instance to wrap
+            workers: Number of threads running database calls
+        """
+        self.db = database
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='db')
+
+    async def _run(self, method, *args, **kwargs):
+        """Run a blocking Database method on the executor and await its result"""
+        loop = asyncio.get_running_loop()
+        with DB_LATENCY.time(method=method.__name__):
+            return await loop.run_in_executor(self._executor, functools.partial(method, *args, **kwargs))
+
+    async def save_forwarded_file(self, file_id, file_name="", performer="", title="", message_id=0, **identity):
+        """Awaitable version of Database.save_forwarded_file"""
+        return await self._run(
+            self.db.save_forwarded_file, file_id, file_name, performer, title, message_id, **identity
+        )
+
+    async def save_forwarded_files(self, records, dest_chat_id=None):
+        """Awaitable version of Database.save_forwarded_files"""
+        return await self._run(self.db.save_forwarded_files, records, dest_chat_id)
+
+    async def is_file_forwarded(self, file_id=None, **identity):
+        """Awaitable version of Database.is_file_forwarded, answered inline when the dedup index can"""
+        known, unknown = self.db.lookup_forwarded(file_id, **identity)
+        if known or not unknown:
+            return known
+        return await self._run(self.db._query_forwarded, unknown)
+
+    async def get_forwarded_files(self, after_rowid=0, limit=1000):
+        """Awaitable version of Database.get_forwarded_files"""
+        return await self._run(self.db.get_forwarded_files, after_rowid, limit)
+
+    async def record_group_messages(self, records):
+        """Awaitable version of Database.record_group_messages"""
+        return await self._run(self.db.record_group_messages, records)
+
+    async def get_unforwarded_messages(self, since):
+        """Awaitable version of Database.get_unforwarded_messages"""
+        return await self._run(self.db.get_unforwarded_messages, since)
+
+    async def prune_group_messages(self, before):
+        """Awaitable version of Database.prune_group_messages"""
+        return await self._run(self.db.prune_group_messages, before)
+
+    async def add_outbox_intents(self, records, dest_chat_id):
+        """Awaitable version of Database.add_outbox_intents"""
+        return await self._run(self.db.add_outbox_intents, records, dest_chat_id)
+
+    async def mark_outbox(self, records, dest_chat_id, state):
+        """Awaitable version of Database.mark_outbox"""
+        return await self._run(self.db.mark_outbox, records, dest_chat_id, state)
+
+    async def get_outbox_intents(self, max_attempts):
+        """Awaitable version of Database.get_outbox_intents"""
+        return await self._run(self.db.get_outbox_intents, max_attempts)
+
+    async def prune_outbox(self, before):
+        """Awaitable version of Database.prune_outbox"""
+        return await self._run(self.db.prune_outbox, before)
+
+    async def get_routes(self):
+        """Awaitable version of Database.get_routes"""
+        return await self._run(self.db.get_routes)
+
+    async def get_update_offset(self):
+        """Awaitable version of Database.get_update_offset"""
+        return await self._run(self.db.get_update_offset)
+
+    async def save_update_offset(self, update_id):
+        """Awaitable version of Database.save_update_offset"""
+        return await self._run(self.db.save_update_offset, update_id)
+
+    async def catch_up(self):
+        """Awaitable version of Database.catch_up"""
+        return await self._run(self.db.catch_up)
+
+    async def acquire_lease(self, name, owner, ttl):
+        """Awaitable version of Database.acquire_lease"""
+        return await self._run(self.db.acquire_lease, name, owner, ttl)
+
+    async def release_lease(self, name, owner):
+        """Awaitable version of Database.release_lease"""
+        return await self._run(self.db.release_lease, name, owner)
+
+    async def get_forwarded_count(self):
+        """Awaitable version of Database.get_forwarded_count (answered from memory)"""
+        return self.db.get_forwarded_count()
+
+    async def get_last_forwarded_date(self):
+        """Awaitable version of Database.get_last_forwarded_date (answered from memory)"""
+        return self.db.get_last_forwarded_date()
+
+    async def flush(self):
+        """Awaitable version of Database.flush"""
+        return await self._run(self.db.flush)
+
+    def close(self):
+        """Wait for pending calls to finish, then flush and close the database"""
+        self._executor.shutdown(wait=True)
+        self.db.close()
 
-# Create a singleton instance for use throughout the app
-db = Database() 
\ No newline at end of file
+# Create singleton instances for use throughout the app
+db = Database()
+async_db = AsyncDatabase(db)
@@ -0,0 +1,246 @@
+"""
+Dedup module for AfsanehBayebot
+In-memory index answering "was this file forwarded?" without touching disk
+"""
+
+import hashlib
+import logging
+import math
+import threading
+from collections import OrderedDict
+
+from config import DEDUP_BLOOM_CAPACITY, DEDUP_FALSE_POSITIVE_RATE, DEDUP_CACHE_SIZE, DEDUP_MATCH_SIGNATURE
+
+logger = logging.getLogger('afsaneh_bot')
+
+def _seconds(value):
+    """Normalize a duration that may be an int or a timedelta to whole seconds"""
+    if value is None:
+        return None
+    if hasattr(value, 'total_seconds'):
+        return int(value.total_seconds())
+    return int(value)
+
+def metadata_signature(duration, file_size, performer, title):
+    """
+    Build a signature identifying the same track uploaded as a different file
+
+    Args:
+        duration: Duration in seconds
+        file_size: Size in bytes
+        performer: Performer of the audio
+        title: Title of the audio
+
+    Returns:
+        str: Hex digest, or None if duration or size is unknown or the
+        file has neither performer nor title (untagged uploads of the
+        same length and size are not necessarily the same track)
+    """
+    if not duration or not file_size:
+        return None
+    if not (performer or '').strip() and not (title or '').strip():
+        return None
+    raw = f"{duration}|{file_size}|{(performer or '').strip().lower()}|{(title or '').strip().lower()}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def audio_record(message):
+    """
+    Extract the fields stored for a forwarded audio message
+
+    Args:
+        message: Message object containing audio
+
+    Returns:
+        dict: Keyword arguments for Database.save_forwarded_file
+    """
+    audio = message.audio
+    return {
+        'file_id': audio.file_id,
+        'file_name': audio.file_name or "",
+        'performer': audio.performer or "",
+        'title': audio.title or "",
+        'file_unique_id': audio.file_unique_id,
+        'source_chat_id': message.chat_id,
+        'source_message_id': message.message_id,
+        'duration': _seconds(audio.duration),
+        'file_size': audio.file_size,
+    }
+
+def dedup_keys(file_id=None, file_unique_id=None, source_chat_id=None, source_message_id=None,
+               signature=None, **_):
+    """
+    List the index keys that identify a file
+
+    Keys are prefixed by kind: u (file_unique_id), m (source chat and
+    message), s (metadata signature) and f (file_id, for rows saved before
+    file_unique_id was recorded).
+
+    Returns:
+        list: Index keys, strongest identity first
+    """
+    keys = []
+    if file_unique_id:
+        keys.append(f"u:{file_unique_id}")
+    if source_chat_id and source_message_id:
+        keys.append(f"m:{source_chat_id}:{source_message_id}")
+    if signature and DEDUP_MATCH_SIGNATURE:
+        keys.append(f"s:{signature}")
+    if file_id:
+        keys.append(f"f:{file_id}")
+    return keys
+
+# Scope of destination keys for files saved before destinations were recorded;
+# such files count as delivered to every destination
+ANY_DESTINATION = '*'
+
+def scoped_keys(keys, dest_chat_id):
+    """
+    Prefix identity keys with a destination, for per-destination dedup
+
+    Args:
+        keys: Keys from dedup_keys
+        dest_chat_id: Destination chat, or ANY_DESTINATION
+
+    Returns:
+        list: Keys of the form "<dest>|<key>"
+    """
+    return [f"{dest_chat_id}|{key}" for key in keys]
+
+class BloomFilter:
+    """Fixed-size Bloom filter over string keys"""
+
+    def __init__(self, capacity, error_rate):
+        """
+        Size the filter for the expected number of keys
+
+        Args:
+            capacity: Number of keys the filter is sized for
+            error_rate: Target false positive rate at capacity
+        """
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        """Derive the bit positions for a key using double hashing"""
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        """Add a key to the filter"""
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        """Return False if the key was definitely never added"""
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+class DedupIndex:
+    """
+    Bloom filter for fast negatives plus an LRU set of known positives
+
+    The filter holds every forwarded key so a miss is answered without a
+    query. Keys recently saved or confirmed by the database are kept in the
+    LRU so repeated hits are answered from memory as well. Only filter hits
+    that fell out of the LRU (or are false positives) reach SQLite.
+    """
+
+    def __init__(self, capacity=DEDUP_BLOOM_CAPACITY, error_rate=DEDUP_FALSE_POSITIVE_RATE,
+                 cache_size=DEDUP_CACHE_SIZE):
+        """
+        Initialize an empty index
+
+        Args:
+            capacity: Number of keys the Bloom filter is sized for
+            error_rate: Target false positive rate of the Bloom filter
+            cache_size: Maximum number of positives kept in the LRU
+        """
+        self.error_rate = error_rate
+        self.cache_size = cache_size
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.recent = OrderedDict()
+        self._lock = threading.Lock()
+
+    def warm(self, keys, total=0):
+        """
+        Rebuild the index from keys already stored in the database
+
+        Args:
+            keys: Iterable of keys, oldest first
+            total: Number of keys expected, used to size the filter
+        """
+        with self._lock:
+            self.bloom = BloomFilter(max(self.bloom.capacity, total * 2), self.error_rate)
+            self.recent.clear()
+            for key in keys:
+                self._add(key)
+        logger.info(f"Dedup index warmed with {self.bloom.count} keys")
+
+    def _add(self, key):
+        """Add a key to the filter and mark it as a recent positive (lock held)"""
+        self.bloom.add(key)
+        self._remember(key)
+        if self.bloom.count == self.bloom.capacity + 1:
+            logger.warning("Dedup Bloom filter is over capacity, false positives will increase until restart")
+
+    def _remember(self, key):
+        """Insert a key into the LRU, evicting the oldest entry if full (lock held)"""
+        self.recent[key] = True
+        self.recent.move_to_end(key)
+        if len(self.recent) > self.cache_size:
+            self.recent.popitem(last=False)
+
+    def add(self, key):
+        """Record a newly forwarded key"""
+        with self._lock:
+            self._add(key)
+
+    def remember(self, key):
+        """Record a positive confirmed by the database"""
+        with self._lock:
+            self._remember(key)
+
+    def lookup(self, key):
+        """
+        Answer a dedup check from memory if possible
+
+        Args:
+            key: The key to check
+
+        Returns:
+            bool or None: False if definitely new, True if known forwarded,
+            None if the database must be consulted
+        """
+        with self._lock:
+            if key not in self.bloom:
+                return False
+            if key in self.recent:
+                self.recent.move_to_end(key)
+                return True
+        return None
+
+    def lookup_any(self, keys):
+        """
+        Answer a dedup check over several identity keys from memory
+
+        Args:
+            keys: Keys identifying one file
+
+        Returns:
+            tuple: (True, []) if any key is known forwarded, otherwise
+            (False, keys the database must still check)
+        """
+        unknown = []
+        for key in keys:
+            known = self.lookup(key)
+            if known:
+                return True, []
+            if known is None:
+                unknown.append(key)
+        return False, unknown
@@ -10,14 +10,24 @@ from datetime import datetime
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from config import runtime, GROUP_CHAT_ID
+from config import runtime
 from localization import get_text, set_language, get_supported_languages
-from utils import update_last_activity, retry_telegram_operation, check_admin_and_group, reply_to_message
-from database import db
-from services import ForwardService, HealthService
+from utils import update_last_activity, retry_telegram_operation, check_admin_and_group, reply_to_message, admin_cache
+from storage import store
+from dedup import audio_record
+from services import ForwardService, HealthService, forward_pipeline, media_groups
+from perf import perf
+from routing import route_table
+from lease import forwarder_lease
+from sharding import local_shard
 
 logger = logging.getLogger('afsaneh_bot')
 
+# Spans listed by /perf, slowest first; keeps the reply under Telegram's message limit
+PERF_REPORT_ROWS = 40
+ROUTES_REPORT_ROWS = 50
+
+@perf.instrument
 class CommandHandlers:
     """Handlers for bot commands"""
     
@@ -40,12 +50,13 @@ class CommandHandlers:
         
         status = "⏸ Paused" if runtime['bot_paused'] else "▶️ Active"
         uptime = datetime.now() - runtime['start_time']
-        count = db.get_forwarded_count()
+        count = await store.get_forwarded_count()
         
         text = get_text("status", 
             status=status, 
             uptime=str(uptime).split('.')[0],
-            count=count
+            count=count,
+            queue=forward_pipeline.depth()
         )
         
         await reply_to_message(update, text)
@@ -55,8 +66,8 @@ class CommandHandlers:
         """Handler for /stats command"""
         update_last_activity()
         
-        count = db.get_forwarded_count()
-        last_date = db.get_last_forwarded_date()
+        count = await store.get_forwarded_count()
+        last_date = await store.get_last_forwarded_date()
         
         if isinstance(last_date, str) and last_date != "N/A":
             try:
@@ -77,6 +88,7 @@ class CommandHandlers:
             return
         
         runtime['bot_paused'] = True
+        await local_shard.announce("pause")
         await reply_to_message(update, get_text("paused"))
     
     @staticmethod
@@ -88,6 +100,7 @@ class CommandHandlers:
             return
         
         runtime['bot_paused'] = False
+        await local_shard.announce("resume")
         await reply_to_message(update, get_text("resumed"))
     
     @staticmethod
@@ -102,6 +115,7 @@ class CommandHandlers:
         
         lang = context.args[0] if context.args else None
         if lang and set_language(lang):
+            await local_shard.announce("language", lang)
             await reply_to_message(update, get_text("language_set"))
         else:
             langs = ", ".join(get_supported_languages())
@@ -139,7 +153,60 @@ class CommandHandlers:
         else:
             await reply_to_message(update, get_text("health_bad"))
             await HealthService.reset_connection(context.bot)
+    
+    @staticmethod
+    async def routes_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handler for /routes command"""
+        update_last_activity()
+        
+        if not await check_admin_and_group(update, context):
+            return
+        
+        routes = route_table.all_routes()
+        if not routes:
+            await reply_to_message(update, get_text("routes_empty"))
+            return
+        
+        lines = [get_text("routes_header", count=len(routes))]
+        lines.extend(route.describe() for route in routes[:ROUTES_REPORT_ROWS])
+        await reply_to_message(update, "\n".join(lines))
+    
+    @staticmethod
+    async def reload_routes_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handler for /reloadroutes command"""
+        update_last_activity()
+        
+        if not await check_admin_and_group(update, context):
+            return
+        
+        count = await route_table.reload()
+        await local_shard.announce("reload_routes")
+        await reply_to_message(update, get_text("routes_reloaded", count=count))
+    
+    @staticmethod
+    async def perf_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handler for /perf command"""
+        update_last_activity()
+        
+        if not await check_admin_and_group(update, context):
+            return
+        
+        if not perf.enabled:
+            await reply_to_message(update, get_text("perf_disabled"))
+            return
+        
+        match = context.args[0] if context.args else None
+        rows = perf.summary(match)[:PERF_REPORT_ROWS]
+        if not rows:
+            await reply_to_message(update, get_text("perf_empty"))
+            return
+        
+        lines = [get_text("perf_header")]
+        for name, calls, p50, p95, p99 in rows:
+            lines.append(f"{name}: {p50 * 1000:.1f} / {p95 * 1000:.1f} / {p99 * 1000:.1f} ({calls})")
+        await reply_to_message(update, "\n".join(lines))
 
+@perf.instrument
 class MessageHandlers:
     """Handlers for various message types"""
     
@@ -152,16 +219,83 @@ class MessageHandlers:
         if runtime['bot_paused']:
             return
         
-        # Skip if not in target group
-        if str(update.effective_chat.id) != str(GROUP_CHAT_ID):
+        # Skip if the chat has no routes
+        if not route_table.is_source(update.effective_chat.id):
             return
         
-        success, message_key = await ForwardService.forward_audio_message(
-            update.message, context.bot
-        )
+        async def acknowledge(results):
+            forwarded = sum(1 for success, _ in results if success)
+            if forwarded and len(results) > 1:
+                await reply_to_message(update, get_text("success_forward_album", count=forwarded))
+            elif forwarded:
+                await reply_to_message(update, get_text("success_forward"))
+            elif any(message_key == "failed_forward" for _, message_key in results):
+                await reply_to_message(update, get_text("failed_forward"))
+        
+        # Journal the message so a restart can replay it if the forward never lands
+        if update.message.audio:
+            await store.record_group_messages([audio_record(update.message)])
+        
+        if update.message.media_group_id:
+            media_groups.add(update.message, acknowledge)
+        else:
+            await forward_pipeline.submit([update.message], acknowledge)
+
+class ControlHandlers:
+    """Handlers for control changes announced by other worker processes"""
+    
+    @staticmethod
+    async def apply_control(control):
+        """
+        Apply a pause, resume, route reload or language change made in another worker
         
-        if message_key != "not_audio" and message_key != "already_forwarded":
-            await reply_to_message(update, get_text(message_key))
+        Args:
+            control: Control frame from LocalShard.announce
+        """
+        action = control.get("action")
+        if action == "pause":
+            runtime['bot_paused'] = True
+        elif action == "resume":
+            runtime['bot_paused'] = False
+        elif action == "reload_routes":
+            await route_table.reload()
+        elif action == "language":
+            set_language(control.get("value"))
+        else:
+            logger.warning(f"Ignoring unknown control action {action}")
+
+class UpdateHandlers:
+    """Handlers that see every update after the regular handlers ran"""
+    
+    last_update_id = 0
+    # Oldest update whose handler raised; the saved offset stays below it until restart
+    failed_update_id = None
+    
+    @staticmethod
+    async def track_offset(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Persist the ID of the latest processed update so polling can resume from it
+        
+        Runs after the regular handlers, so a forward has its outbox intent
+        written and is queued by then. Once a handler has raised, the offset
+        is no longer advanced, so a restart delivers the failed update again
+        (and the ones after it, which dedup keeps from being forwarded twice).
+        """
+        if update.update_id > UpdateHandlers.last_update_id:
+            UpdateHandlers.last_update_id = update.update_id
+            if UpdateHandlers.failed_update_id is None:
+                await store.save_update_offset(update.update_id)
+
+class ChatMemberHandlers:
+    """Handlers for chat member changes"""
+    
+    @staticmethod
+    async def chat_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Keep the cached admin rosters in sync with promotions and demotions"""
+        if update.chat_member:
+            admin_cache.apply_member_update(update.chat_member)
+        elif update.my_chat_member:
+            admin_cache.apply_member_update(update.my_chat_member)
 
 class ErrorHandlers:
     """Handlers for errors and exceptions"""
@@ -172,6 +306,10 @@ class ErrorHandlers:
         logger.error(f"Update {update} caused error: {context.error}")
         logger.error(traceback.format_exc())
         
+        if isinstance(update, Update) and UpdateHandlers.failed_update_id is None:
+            UpdateHandlers.failed_update_id = update.update_id
+            logger.warning(f"Update offset held before update {update.update_id} until restart")
+        
         try:
             update_last_activity()
             
@@ -187,6 +325,9 @@ class ErrorHandlers:
 class JobHandlers:
     """Handlers for scheduled jobs"""
     
+    # Set when a standby skipped the startup sync, so it runs on takeover
+    sync_deferred = False
+    
     @staticmethod
     async def watchdog_job(context: ContextTypes.DEFAULT_TYPE):
         """Watchdog job to monitor bot health"""
@@ -198,8 +339,14 @@ class JobHandlers:
     
     @staticmethod
     async def initial_sync_job(context: ContextTypes.DEFAULT_TYPE):
-        """Initial sync job to forward old messages"""
+        """Initial sync job to finish interrupted forwards and forward old messages"""
+        if forwarder_lease.standing_by:
+            # The leader syncs; this instance runs the job when it takes over
+            JobHandlers.sync_deferred = True
+            return
+        JobHandlers.sync_deferred = False
         try:
+            await ForwardService.resume_outbox(context.bot)
             await ForwardService.sync_with_channel(context.bot)
         except Exception as e:
             logger.error(f"Error in initial sync job: {e}")
@@ -0,0 +1,178 @@
+"""
+Lease module for AfsanehBayebot
+Elects a single forwarder among instances sharing the same storage
+
+Every instance starts up fully (database warmed, routes loaded, metrics
+served) but only the one holding the forwarder lease polls Telegram and
+forwards. The others retry the lease every LEASE_HEARTBEAT seconds and take
+over within LEASE_TTL of the leader going away, or at once when it shuts
+down cleanly and releases the lease.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+
+from config import LEASE_TTL, LEASE_HEARTBEAT
+from metrics import IS_LEADER
+from storage import store
+
+logger = logging.getLogger('afsaneh_bot')
+
+class Lease:
+    """
+    A named lease in the storage backend, held by renewing it on a heartbeat
+
+    The holder only trusts the lease until the TTL measured from the start
+    of its last successful renewal, so a stalled process stops acting as
+    leader before another one can take over.
+    """
+
+    def __init__(self, backend, name="forwarder", ttl=LEASE_TTL, heartbeat=LEASE_HEARTBEAT):
+        """
+        Initialize the lease (nothing is acquired until wait())
+
+        Args:
+            backend: StorageBackend holding the lease
+            name: Lease name shared by the competing instances
+            ttl: Seconds the lease outlives its last renewal
+            heartbeat: Seconds between renewals, and between attempts while standing by
+        """
+        if heartbeat * 2 >= ttl:
+            raise ValueError("LEASE_HEARTBEAT must be less than half of LEASE_TTL")
+        self.backend = backend
+        self.name = name
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.valid_until = 0
+        self.standing_by = False
+        self.contending = False
+
+    @property
+    def held(self):
+        """True while this instance can act as the holder"""
+        return time.monotonic() < self.valid_until
+
+    @property
+    def permits_forwarding(self):
+        """
+        True if this process may send forwards now
+
+        A process that competes for the lease may only send while holding
+        it; one that never competes (a benchmark, or a worker of the
+        supervisor holding it) always may.
+        """
+        return not self.contending or self.held
+
+    async def _renew(self):
+        """Acquire or renew the lease; return True if held"""
+        started = time.monotonic()
+        try:
+            acquired = await self.backend.acquire_lease(self.name, self.owner, self.ttl)
+        except Exception as e:
+            logger.error(f"Lease {self.name} heartbeat failed: {e}")
+            acquired = False
+        self.valid_until = started + self.ttl if acquired else 0
+        IS_LEADER.set(1 if acquired else 0)
+        return acquired
+
+    async def wait(self, stop_event, while_waiting=None):
+        """
+        Stand by until the lease is acquired
+
+        Args:
+            stop_event: asyncio.Event that ends the wait
+            while_waiting: Optional coroutine function run after every
+                failed attempt, to keep the standby warm
+
+        Returns:
+            bool: True once the lease is held, False if stop_event was set first
+        """
+        announced = False
+        self.contending = True
+        while not stop_event.is_set():
+            if await self._renew():
+                self.standing_by = False
+                logger.info(f"Holding the {self.name} lease as {self.owner}")
+                return True
+            if not announced:
+                logger.info(f"Another instance holds the {self.name} lease, standing by")
+                announced = True
+            self.standing_by = True
+            if while_waiting:
+                try:
+                    await while_waiting()
+                except Exception as e:
+                    logger.error(f"Standby refresh failed: {e}")
+            try:
+                await asyncio.wait_for(stop_event.wait(), self.heartbeat)
+            except asyncio.TimeoutError:
+                pass
+        self.standing_by = False
+        return False
+
+    async def hold(self, stop_event):
+        """
+        Keep renewing the lease until stop_event is set or the lease is lost
+
+        Args:
+            stop_event: asyncio.Event that ends holding
+
+        Returns:
+            bool: True if the lease was lost, False if stop_event was set
+        """
+        while True:
+            try:
+                await asyncio.wait_for(stop_event.wait(), self.heartbeat)
+                return False
+            except asyncio.TimeoutError:
+                pass
+            if not await self._renew():
+                logger.warning(f"Lost the {self.name} lease")
+                return True
+
+    async def keep_while(self, awaitable):
+        """
+        Await something while still renewing a held lease on the heartbeat
+
+        Used once hold() has returned for shutdown, so forwards drained after
+        that stay permitted for as long as the drain takes. A renewal that
+        fails ends the renewing, and forwarding stops once the lease lapses.
+
+        Args:
+            awaitable: Work to wait for
+
+        Returns:
+            The result of awaitable
+        """
+        task = asyncio.ensure_future(awaitable)
+        try:
+            while self.valid_until:
+                done, _ = await asyncio.wait({task}, timeout=self.heartbeat)
+                if done:
+                    break
+                if not await self._renew():
+                    logger.warning(f"Lost the {self.name} lease while draining")
+            return await task
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+
+    async def release(self):
+        """Give up the lease so a standby can take over without waiting for it to expire"""
+        if not self.valid_until:
+            return
+        self.valid_until = 0
+        IS_LEADER.set(0)
+        try:
+            await self.backend.release_lease(self.name, self.owner)
+            logger.info(f"Released the {self.name} lease")
+        except Exception as e:
+            logger.error(f"Error releasing lease {self.name}: {e}")
+
+# Create singleton instance for use throughout the app
+forwarder_lease = Lease(store)
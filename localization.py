@@ -9,7 +9,7 @@ from config import runtime
 translations = {
     "en": {
         "welcome": "✅ Bot activated!\nI forward audio messages to the channel.",
-        "status": "🔄 Status: {status}\n⏳ Uptime: {uptime}\n📊 Files forwarded: {count}",
+        "status": "🔄 Status: {status}\n⏳ Uptime: {uptime}\n📊 Files forwarded: {count}\n📥 Queued: {queue}",
         "paused": "⏸ Bot paused!",
         "resumed": "▶️ Bot resumed!",
         "admin_only": "🚫 Admin only!",
@@ -23,10 +23,14 @@ translations = {
             "/forward - Forward specific message\n"
             "/language - Change language\n"
             "/stats - View forwarding stats\n"
-            "/healthcheck - Check bot health"
+            "/healthcheck - Check bot health\n"
+            "/perf - Timing breakdown (admin)\n"
+            "/routes - List forwarding routes (admin)\n"
+            "/reloadroutes - Reload routes from the database (admin)"
         ),
         "language_set": "🌐 Language set to English",
         "success_forward": "✅ Forwarded!",
+        "success_forward_album": "✅ Forwarded {count} files!",
         "failed_forward": "❌ Failed!",
         "reply": "↩️ Reply to a message!",
         "stats": "📊 Total files forwarded: {count}\n📅 Last forwarded: {last_date}",
@@ -34,11 +38,18 @@ translations = {
         "health_good": "✅ Bot is working correctly!\n⏱️ Last activity: {time} ago",
         "health_bad": "⚠️ Bot might be experiencing issues. Restarting connection...",
         "not_audio": "❌ This message is not an audio file!",
-        "bot_running": "Bot is now running!"
+        "bot_running": "Bot is now running!",
+        "perf_header": "⏱ Timings in ms (p50 / p95 / p99, calls):",
+        "perf_empty": "⏱ No timings recorded yet.",
+        "perf_disabled": "⏱ Timing is disabled (PERF_ENABLED=false).",
+        "routes_header": "🔀 {count} routes:",
+        "routes_empty": "🔀 No routes configured.",
+        "routes_reloaded": "🔀 Reloaded {count} routes.",
+        "no_route": "⚠️ No route for this chat!"
     },
     "fa": {
         "welcome": "✅ ربات فعال شد!\nپیامهای صوتی به کانال فوروارد میشوند.",
-        "status": "🔄 وضعیت: {status}\n⏳ مدت فعالیت: {uptime}\n📊 فایل‌های ارسال شده: {count}",
+        "status": "🔄 وضعیت: {status}\n⏳ مدت فعالیت: {uptime}\n📊 فایل‌های ارسال شده: {count}\n📥 در صف: {queue}",
         "paused": "⏸ ربات متوقف شد!",
         "resumed": "▶️ ربات فعال شد!",
         "admin_only": "🚫 فقط ادمین!",
@@ -52,10 +63,14 @@ translations = {
             "/forward - فوروارد پیام خاص\n"
             "/language - تغییر زبان\n"
             "/stats - آمار ارسال‌ها\n"
-            "/healthcheck - بررسی سلامت ربات"
+            "/healthcheck - بررسی سلامت ربات\n"
+            "/perf - زمان‌بندی عملیات (ادمین)\n"
+            "/routes - فهرست مسیرهای ارسال (ادمین)\n"
+            "/reloadroutes - بارگذاری دوباره مسیرها (ادمین)"
         ),
         "language_set": "🌐 زبان تنظیم شد به فارسی",
         "success_forward": "✅ ارسال شد!",
+        "success_forward_album": "✅ {count} فایل ارسال شد!",
         "failed_forward": "❌ خطا!",
         "reply": "↩️ روی پیام ریپلای کنید!",
         "stats": "📊 کل فایل‌های ارسال شده: {count}\n📅 آخرین ارسال: {last_date}",
@@ -63,7 +78,14 @@ translations = {
         "health_good": "✅ ربات به درستی کار می‌کند!\n⏱️ آخرین فعالیت: {time} پیش",
         "health_bad": "⚠️ ممکن است ربات با مشکل مواجه شده باشد. در حال راه‌اندازی مجدد اتصال...",
         "not_audio": "❌ این پیام آهنگ نیست!",
-        "bot_running": "ربات اکنون در حال اجراست!"
+        "bot_running": "ربات اکنون در حال اجراست!",
+        "perf_header": "⏱ زمان‌ها به میلی‌ثانیه (p50 / p95 / p99، تعداد):",
+        "perf_empty": "⏱ هنوز زمانی ثبت نشده است.",
+        "perf_disabled": "⏱ زمان‌سنجی غیرفعال است (PERF_ENABLED=false).",
+        "routes_header": "🔀 {count} مسیر:",
+        "routes_empty": "🔀 هیچ مسیری تعریف نشده است.",
+        "routes_reloaded": "🔀 {count} مسیر دوباره بارگذاری شد.",
+        "no_route": "⚠️ برای این گروه مسیری تعریف نشده است!"
     }
 }
 
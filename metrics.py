@@ -0,0 +1,246 @@
+"""
+Metrics module for AfsanehBayebot
+Counters and histograms exposed in the Prometheus text format over a local HTTP endpoint
+"""
+
+import asyncio
+import logging
+import threading
+import time
+
+from config import METRICS_HOST, METRICS_PORT, LOOP_LAG_INTERVAL
+
+logger = logging.getLogger('afsaneh_bot')
+
+# Latency buckets in seconds, from sub-millisecond database calls to slow API calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+def _escape(value):
+    """Escape a label value for the text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, values, extra=()):
+    """Render a label set as {name="value",...}"""
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+class Metric:
+    """Base class holding one value per label combination"""
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        Create and register a metric
+
+        Args:
+            name: Metric name
+            documentation: HELP text
+            labelnames: Names of the labels the metric is split by
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels):
+        """Return the label values in labelnames order"""
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self):
+        """Return the metric in the Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self.values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        """Add to the counter for a label combination"""
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """Value that can go up and down, optionally read from a function at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        """Create and register a gauge"""
+        super().__init__(name, documentation, labelnames)
+        self.function = None
+
+    def set(self, value, **labels):
+        """Set the gauge for a label combination"""
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+    def set_function(self, function):
+        """Read the (unlabelled) value from function() at every scrape"""
+        self.function = function
+
+    def render(self):
+        """Return the gauge in the Prometheus text format"""
+        if self.function is not None:
+            try:
+                self.set(self.function())
+            except Exception as e:
+                logger.error(f"Error reading gauge {self.name}: {e}")
+        return super().render()
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """Create and register a histogram"""
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """Record one observation for a label combination"""
+        key = self._key(labels)
+        with self._lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += 1
+            state[2] += value
+
+    def time(self, **labels):
+        """Context manager observing the duration of its block"""
+        return _Timer(self, labels)
+
+    def render(self):
+        """Return the histogram in the Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self.values.items()]
+        for key, (counts, count, total) in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.labelnames, key, [("le", bound)])
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+        return lines
+
+class _Timer:
+    """Context manager behind Histogram.time"""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+# Every metric created below registers itself here
+registry = []
+
+FORWARDS = Counter("afsaneh_forwards_total", "Audio forwards by outcome", ["outcome"])
+FORWARD_LATENCY = Histogram("afsaneh_forward_latency_seconds", "Duration of forward API calls")
+QUEUE_DEPTH = Gauge("afsaneh_forward_queue_depth", "Jobs waiting in the forwarding pipeline")
+RETRIES = Counter("afsaneh_telegram_retries_total", "Retried Telegram calls", ["endpoint", "error_type"])
+DB_LATENCY = Histogram("afsaneh_db_call_seconds", "Duration of Database calls", ["method"])
+IS_LEADER = Gauge("afsaneh_is_leader", "1 while this instance holds the forwarder lease")
+LOOP_LAG = Histogram("afsaneh_event_loop_lag_seconds", "Delay of scheduled callbacks on the event loop")
+
+def render():
+    """Return every registered metric in the Prometheus text format"""
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+async def _handle_request(reader, writer):
+    """Serve a single HTTP request: GET /metrics or 404"""
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Drain the headers; the request has no body we care about
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", render().encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            status, body, content_type = "404 Not Found", b"Not Found\n", "text/plain"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError) as e:
+        logger.debug(f"Metrics request error: {e}")
+    finally:
+        writer.close()
+
+async def _monitor_loop_lag(interval):
+    """Measure how late a sleep wakes up, which is how long the loop was blocked"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - start - interval))
+
+class MetricsServer:
+    """Local HTTP endpoint serving /metrics, plus the event loop lag monitor"""
+
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT):
+        """
+        Initialize the server (nothing listens until start())
+
+        Args:
+            host: Interface to bind
+            port: TCP port to bind; 0 disables the endpoint
+        """
+        self.host = host
+        self.port = port
+        self.server = None
+        self.lag_task = None
+
+    async def start(self):
+        """Start listening and monitoring if a port is configured"""
+        if not self.port:
+            return
+        self.server = await asyncio.start_server(_handle_request, self.host, self.port)
+        self.lag_task = asyncio.create_task(_monitor_loop_lag(LOOP_LAG_INTERVAL))
+        logger.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        """Stop the endpoint and the lag monitor"""
+        if self.lag_task:
+            self.lag_task.cancel()
+            await asyncio.gather(self.lag_task, return_exceptions=True)
+            self.lag_task = None
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+# Create a singleton instance for use throughout the app
+metrics_server = MetricsServer()
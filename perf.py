@@ -0,0 +1,168 @@
+"""
+Performance module for AfsanehBayebot
+Times hot-path spans and keeps rolling percentiles for the /perf command
+"""
+
+import functools
+import inspect
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+from config import PERF_ENABLED, PERF_WINDOW
+
+logger = logging.getLogger('afsaneh_bot')
+
+class PerfRecorder:
+    """
+    Rolling duration samples per span
+
+    Each span keeps its last window samples, so percentiles follow the
+    current behaviour instead of averaging over the whole uptime.
+    Database methods record from the executor threads, so the samples and
+    counts are only touched under a lock.
+    """
+
+    def __init__(self, enabled=PERF_ENABLED, window=PERF_WINDOW):
+        """
+        Initialize the recorder
+
+        Args:
+            enabled: Whether spans are timed at all
+            window: Samples kept per span
+        """
+        self.enabled = enabled
+        self.window = max(1, window)
+        self.samples = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        """Add one duration sample to a span"""
+        with self._lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen=self.window)
+            samples.append(seconds)
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    @contextmanager
+    def _timed_block(self, name):
+        """Time the enclosed block as one sample of a span"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def span(self, name):
+        """
+        Context manager timing its block, or a no-op when disabled
+
+        Args:
+            name: Span name
+        """
+        if not self.enabled:
+            return nullcontext()
+        return self._timed_block(name)
+
+    def timed(self, name):
+        """
+        Decorator timing every call of a function or coroutine function
+
+        When disabled the function is returned unchanged, so instrumented
+        code pays nothing.
+
+        Args:
+            name: Span name
+        """
+        def decorator(func):
+            if not self.enabled:
+                return func
+
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return await func(*args, **kwargs)
+                    finally:
+                        self.record(name, time.perf_counter() - start)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def instrument(self, cls):
+        """
+        Class decorator timing every public method as ClassName.method
+
+        Plain and static methods are wrapped; properties, class methods and
+        underscore-prefixed helpers are left alone.
+        """
+        if not self.enabled:
+            return cls
+
+        for attr, value in list(vars(cls).items()):
+            if attr.startswith('_'):
+                continue
+            name = f"{cls.__name__}.{attr}"
+            if isinstance(value, staticmethod):
+                setattr(cls, attr, staticmethod(self.timed(name)(value.__func__)))
+            elif inspect.isfunction(value):
+                setattr(cls, attr, self.timed(name)(value))
+        return cls
+
+    @staticmethod
+    def _percentile(ordered, fraction):
+        """Nearest-rank percentile of a sorted list"""
+        index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))
+        return ordered[index]
+
+    def summary(self, match=None):
+        """
+        Return percentiles for every span, slowest p99 first
+
+        Args:
+            match: Only include spans whose name contains this text
+
+        Returns:
+            list: (name, calls, p50, p95, p99) tuples, durations in seconds
+        """
+        with self._lock:
+            spans = [(name, list(samples), self.counts.get(name, len(samples)))
+                     for name, samples in self.samples.items()]
+        rows = []
+        for name, samples, calls in spans:
+            if match and match.lower() not in name.lower():
+                continue
+            ordered = sorted(samples)
+            if not ordered:
+                continue
+            rows.append((
+                name,
+                calls,
+                self._percentile(ordered, 0.50),
+                self._percentile(ordered, 0.95),
+                self._percentile(ordered, 0.99),
+            ))
+        rows.sort(key=lambda row: row[4], reverse=True)
+        return rows
+
+    def reset(self):
+        """Drop every recorded sample"""
+        with self._lock:
+            self.samples.clear()
+            self.counts.clear()
+
+# Create a singleton instance for use throughout the app
+perf = PerfRecorder()
@@ -0,0 +1,155 @@
+"""
+Rate limiting module for AfsanehBayebot
+Paces outgoing messages to stay inside Telegram's flood limits
+"""
+
+import asyncio
+import logging
+import time
+
+from config import RATE_GLOBAL_PER_SECOND, RATE_GLOBAL_BURST, RATE_CHAT_PER_MINUTE, RATE_CHAT_BURST
+
+logger = logging.getLogger('afsaneh_bot')
+
+class TokenBucket:
+    """
+    Token bucket that hands out reservations
+
+    Tokens may be reserved ahead of time, so callers that arrive while the
+    bucket is empty queue up in arrival order instead of polling. A
+    reservation costs at most a full bucket: a batch call larger than the
+    burst waits for the bucket to fill and empties it, instead of driving
+    it into debt that would hold the chat back for minutes.
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        Initialize a full bucket
+
+        Args:
+            rate: Tokens added per second
+            capacity: Maximum tokens held (the allowed burst)
+        """
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _tokens_at(self, when):
+        """Return the tokens available at a given time, ignoring later reservations"""
+        if when <= self.updated:
+            return self.tokens
+        return min(self.capacity, self.tokens + (when - self.updated) * self.rate)
+
+    def ready_at(self, now, cost=1):
+        """
+        Return the earliest time at which cost tokens can be taken
+
+        Args:
+            now: Current monotonic time
+            cost: Number of tokens needed
+        """
+        start = max(now, self.updated)
+        missing = min(cost, self.capacity) - self._tokens_at(start)
+        if missing <= 0:
+            return start
+        return start + missing / self.rate
+
+    def consume(self, when, cost=1):
+        """
+        Take cost tokens at the given (possibly future) time
+
+        Args:
+            when: Time of the reservation, from ready_at
+            cost: Number of tokens taken, capped at the capacity
+        """
+        self.tokens = self._tokens_at(when) - min(cost, self.capacity)
+        self.updated = max(when, self.updated)
+
+class ForwardScheduler:
+    """
+    Central pacing for every message the bot sends
+
+    Each destination chat has its own bucket and all chats share a global
+    bucket. A send waits until both allow it, which keeps throughput at
+    Telegram's published limits without triggering flood control.
+    """
+
+    def __init__(self, global_rate=RATE_GLOBAL_PER_SECOND, global_burst=RATE_GLOBAL_BURST,
+                 chat_rate=RATE_CHAT_PER_MINUTE / 60, chat_burst=RATE_CHAT_BURST):
+        """
+        Initialize the scheduler
+
+        Args:
+            global_rate: Messages per second across all chats
+            global_burst: Burst allowed across all chats
+            chat_rate: Messages per second to a single chat
+            chat_burst: Burst allowed to a single chat
+        """
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = {}
+
+    def _chat_bucket(self, chat_id):
+        """Return the bucket for a chat, creating it on first use"""
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def set_chat_limit(self, chat_id, rate, burst):
+        """
+        Pace one chat differently from the configured per-chat limit
+
+        Args:
+            chat_id: Chat to configure
+            rate: Messages per second to the chat
+            burst: Burst allowed to the chat
+        """
+        self.chat_buckets[chat_id] = TokenBucket(rate, burst)
+
+    def pause(self, chat_id, seconds):
+        """
+        Hold back sends to a chat after Telegram asked for a flood wait
+
+        Args:
+            chat_id: Chat named in the flood wait
+            seconds: Wait requested by Telegram
+        """
+        bucket = self._chat_bucket(chat_id)
+        bucket.tokens = 0.0
+        bucket.updated = max(bucket.updated, time.monotonic() + seconds)
+        logger.warning(f"Flood wait of {seconds}s for chat {chat_id}")
+
+    @staticmethod
+    def _reserve(bucket, cost):
+        """Reserve tokens from one bucket and return the seconds to wait for them"""
+        now = time.monotonic()
+        when = bucket.ready_at(now, cost)
+        bucket.consume(when, cost)
+        return when - now
+
+    async def acquire(self, chat_id, cost=1):
+        """
+        Wait until a message may be sent to a chat
+
+        The chat slot is reserved first and the global slot only once it is
+        reached, so a chat that is far over its limit does not hold up
+        sends to other chats.
+
+        Args:
+            chat_id: Destination chat
+            cost: Number of messages the call will send
+        """
+        delay = self._reserve(self._chat_bucket(chat_id), cost)
+        if delay > 0:
+            logger.debug(f"Pacing send to {chat_id} by {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+        delay = self._reserve(self.global_bucket, cost)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+# Create a singleton instance for use throughout the app
+scheduler = ForwardScheduler()
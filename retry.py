@@ -0,0 +1,219 @@
+"""
+Retry module for AfsanehBayebot
+Classifies Telegram errors, honours flood waits and guards endpoints with circuit breakers
+"""
+
+import asyncio
+import logging
+import random
+import time
+
+from telegram.error import (
+    BadRequest, ChatMigrated, Conflict, EndPointNotFound, Forbidden, InvalidToken,
+    NetworkError, RetryAfter, TimedOut
+)
+
+from config import MAX_RETRIES, RETRY_DELAY, RETRY_MAX_DELAY, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT
+from metrics import RETRIES
+from ratelimit import scheduler
+
+logger = logging.getLogger('afsaneh_bot')
+
+# Error classes
+FLOOD = 'flood'          # Telegram asked us to wait; retry after exactly that long
+TRANSIENT = 'transient'  # Network trouble; retry with backoff
+FATAL = 'fatal'          # Retrying cannot help (bad request, no rights, bad token, bugs)
+
+# Checked in order, so subclasses must come before their parents
+# (BadRequest and TimedOut both derive from NetworkError)
+ERROR_CLASSES = (
+    (RetryAfter, FLOOD),
+    ((BadRequest, Forbidden, InvalidToken, ChatMigrated, Conflict, EndPointNotFound), FATAL),
+    ((TimedOut, NetworkError), TRANSIENT),
+)
+
+# Sends that may have gone through when the request timed out or the connection
+# dropped; retrying them could deliver twice, so network errors are raised to
+# the caller instead
+NON_IDEMPOTENT_ENDPOINTS = frozenset(("forward_messages", "forward_message", "copy_messages", "copy_message"))
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit breaker is open"""
+
+class CircuitBreaker:
+    """
+    Stops calling an endpoint after repeated transient failures
+
+    After threshold consecutive failures the circuit opens and calls fail
+    immediately. Once reset_timeout has passed a single trial call is let
+    through; its outcome closes the circuit or opens it again.
+    """
+
+    def __init__(self, threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        """
+        Initialize a closed breaker
+
+        Args:
+            threshold: Consecutive failures that open the circuit
+            reset_timeout: Seconds before an open circuit allows a trial call
+        """
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def allow(self):
+        """Return True if a call may go through now"""
+        if self.opened_at is None:
+            return True
+        if self.trial_running or time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        self.trial_running = True
+        return True
+
+    def record_success(self):
+        """Close the circuit after a successful call"""
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+    def record_cancelled(self, trial):
+        """
+        Forget a call that was cancelled before it finished
+
+        Args:
+            trial: True if the call was the trial of an open circuit, which
+                then lets the next call make the trial instead
+        """
+        if trial:
+            self.trial_running = False
+
+    def record_failure(self):
+        """
+        Count a transient failure
+
+        Returns:
+            bool: True if this failure opened the circuit
+        """
+        self.failures += 1
+        was_open = self.opened_at is not None
+        if was_open or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+        self.trial_running = False
+        return not was_open and self.opened_at is not None
+
+class RetryPolicy:
+    """Retries Telegram calls according to the class of each error"""
+
+    def __init__(self, max_retries=MAX_RETRIES, base_delay=RETRY_DELAY, max_delay=RETRY_MAX_DELAY):
+        """
+        Initialize the policy
+
+        Args:
+            max_retries: Attempts per call, including the first
+            base_delay: Backoff for the first transient retry, in seconds
+            max_delay: Upper bound for any backoff
+        """
+        self.max_retries = max(1, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breakers = {}
+
+    @staticmethod
+    def classify(error):
+        """
+        Return FLOOD, TRANSIENT or FATAL for an exception
+
+        Args:
+            error: The exception raised by the call
+        """
+        for error_types, error_class in ERROR_CLASSES:
+            if isinstance(error, error_types):
+                return error_class
+        return FATAL
+
+    @staticmethod
+    def _retry_after(error):
+        """Return the flood wait requested by a RetryAfter error in seconds"""
+        retry_after = error.retry_after
+        if hasattr(retry_after, 'total_seconds'):
+            return retry_after.total_seconds()
+        return float(retry_after)
+
+    def _backoff(self, attempt):
+        """Exponential backoff with equal jitter so parallel callers spread out"""
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def breaker(self, endpoint):
+        """Return the circuit breaker for an endpoint, creating it on first use"""
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker()
+        return breaker
+
+    async def run(self, operation, *args, **kwargs):
+        """
+        Call a Telegram API operation, retrying as the error class allows
+
+        Args:
+            operation: The async function to call
+            *args, **kwargs: Arguments to pass to the function
+
+        Returns:
+            The result of the operation, or raises the last exception
+        """
+        endpoint = getattr(operation, '__name__', repr(operation))
+        breaker = self.breaker(endpoint)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuit open for {endpoint}")
+
+            attempt += 1
+            trial = breaker.opened_at is not None
+            try:
+                result = await operation(*args, **kwargs)
+                breaker.record_success()
+                return result
+            except asyncio.CancelledError:
+                breaker.record_cancelled(trial)
+                raise
+            except Exception as e:
+                error_class = self.classify(e)
+                error_type = type(e).__name__
+
+                if error_class == FATAL:
+                    # The endpoint answered, it just refused this request
+                    breaker.record_success()
+                    raise
+
+                if error_class == FLOOD:
+                    breaker.record_success()
+                    wait_time = self._retry_after(e)
+                    chat_id = kwargs.get('chat_id')
+                    if chat_id is not None:
+                        scheduler.pause(chat_id, wait_time)
+                elif breaker.record_failure():
+                    logger.error(f"Circuit opened for {endpoint} after {breaker.failures} failures")
+
+                if error_class == TRANSIENT and endpoint in NON_IDEMPOTENT_ENDPOINTS:
+                    logger.error(f"{endpoint} failed with {error_type} and may have been delivered; not retrying")
+                    raise
+
+                if attempt >= self.max_retries:
+                    logger.error(f"{endpoint} failed after {attempt} attempts: {error_type} - {str(e)}")
+                    raise
+
+                RETRIES.inc(endpoint=endpoint, error_type=error_type)
+                if error_class == TRANSIENT:
+                    wait_time = self._backoff(attempt)
+                logger.warning(
+                    f"Retry {attempt}/{self.max_retries - 1} of {endpoint} after {wait_time:.1f}s "
+                    f"due to {error_type}: {str(e)}"
+                )
+                await asyncio.sleep(wait_time)
+
+# Create a singleton instance for use throughout the app
+retry_policy = RetryPolicy()
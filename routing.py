@@ -0,0 +1,197 @@
+"""
+Routing module for AfsanehBayebot
+Maps source chats to the destination chats their audio is forwarded to
+
+Routes live in the routes table and can be managed from the command line,
+then picked up by a running bot with /reloadroutes:
+    python routing.py list
+    python routing.py add -1001111111111 -1002222222222 --filters '{"min_duration": 60}'
+    python routing.py remove -1001111111111 -1002222222222
+"""
+
+import argparse
+import json
+import logging
+
+from telegram.ext import filters
+
+from config import GROUP_CHAT_ID, CHANNEL_CHAT_ID
+from database import db, async_db
+
+logger = logging.getLogger('afsaneh_bot')
+
+class Route:
+    """
+    One source to destination route with optional filters
+
+    Supported filters (all optional):
+        min_duration / max_duration: Bounds on the audio length in seconds
+        max_file_size: Largest file forwarded, in bytes
+        performers: Only forward these performers (case-insensitive)
+        keywords: Only forward audio whose title, performer or file name
+            contains one of these words (case-insensitive)
+    """
+
+    FILTER_KEYS = ('min_duration', 'max_duration', 'max_file_size', 'performers', 'keywords')
+
+    def __init__(self, source_chat_id, dest_chat_id, route_filters=None):
+        """
+        Initialize a route
+
+        Args:
+            source_chat_id: Chat audio is taken from
+            dest_chat_id: Chat audio is forwarded to
+            route_filters: Dict of filters, see the class docstring
+        """
+        self.source_chat_id = source_chat_id
+        self.dest_chat_id = dest_chat_id
+        self.filters = dict(route_filters or {})
+        unknown = set(self.filters) - set(self.FILTER_KEYS)
+        if unknown:
+            logger.warning(f"Route {source_chat_id} -> {dest_chat_id} ignores unknown filters: {sorted(unknown)}")
+        self.performers = {performer.lower() for performer in self.filters.get('performers') or ()}
+        self.keywords = [keyword.lower() for keyword in self.filters.get('keywords') or ()]
+
+    def matches(self, record):
+        """
+        Check an audio record against the route's filters
+
+        Args:
+            record: Audio record (see dedup.audio_record)
+
+        Returns:
+            bool: True if the audio should take this route
+        """
+        route_filters = self.filters
+        if not route_filters:
+            return True
+
+        duration = record.get('duration') or 0
+        if 'min_duration' in route_filters and duration < route_filters['min_duration']:
+            return False
+        if 'max_duration' in route_filters and duration > route_filters['max_duration']:
+            return False
+        if 'max_file_size' in route_filters and (record.get('file_size') or 0) > route_filters['max_file_size']:
+            return False
+        if self.performers and (record.get('performer') or "").lower() not in self.performers:
+            return False
+        if self.keywords:
+            text = " ".join(record.get(field) or "" for field in ('title', 'performer', 'file_name')).lower()
+            if not any(keyword in text for keyword in self.keywords):
+                return False
+        return True
+
+    def describe(self):
+        """Return a one-line summary of the route"""
+        text = f"{self.source_chat_id} → {self.dest_chat_id}"
+        if self.filters:
+            text += f" {json.dumps(self.filters, ensure_ascii=False)}"
+        return text
+
+class RouteTable:
+    """
+    In-memory routing table keyed by source chat
+
+    Lookups are a single dict access, so checking whether a chat is routed
+    costs the same with one route or hundreds. A reload builds a new dict and
+    swaps it in, so readers never see a half-loaded table.
+    """
+
+    def __init__(self):
+        """Initialize an empty table"""
+        self.routes = {}
+
+    def load(self, rows):
+        """
+        Replace the table with routes from the database
+
+        Args:
+            rows: (source_chat_id, dest_chat_id, filters) tuples
+        """
+        routes = {}
+        for source_chat_id, dest_chat_id, route_filters in rows:
+            routes.setdefault(source_chat_id, []).append(Route(source_chat_id, dest_chat_id, route_filters))
+        self.routes = routes
+        logger.info(f"Loaded {sum(len(chat_routes) for chat_routes in routes.values())} routes "
+                    f"from {len(routes)} source chats")
+
+    def seed(self, database):
+        """
+        Load routes at startup, creating the configured default route once
+
+        A database without routes gets GROUP_CHAT_ID -> CHANNEL_CHAT_ID, so an
+        existing single-group setup keeps working unchanged.
+
+        Args:
+            database: Synchronous Database instance
+        """
+        if GROUP_CHAT_ID and CHANNEL_CHAT_ID and not database.get_state('routes_seeded'):
+            if not database.get_routes():
+                database.add_route(GROUP_CHAT_ID, CHANNEL_CHAT_ID)
+                logger.info(f"Created default route {GROUP_CHAT_ID} -> {CHANNEL_CHAT_ID}")
+            database.set_state('routes_seeded', 1)
+        self.load(database.get_routes())
+
+    async def reload(self):
+        """
+        Reload the routes from the database
+
+        Returns:
+            int: Number of routes loaded
+        """
+        self.load(await async_db.get_routes())
+        return len(self.all_routes())
+
+    def is_source(self, chat_id):
+        """Return True if audio from a chat is routed anywhere"""
+        return chat_id in self.routes
+
+    def destinations(self, source_chat_id, record):
+        """
+        Return the destinations an audio record should be forwarded to
+
+        Args:
+            source_chat_id: Chat the audio was posted in
+            record: Audio record (see dedup.audio_record)
+
+        Returns:
+            list: Destination chat IDs, in route order
+        """
+        return [route.dest_chat_id for route in self.routes.get(source_chat_id, ()) if route.matches(record)]
+
+    def all_routes(self):
+        """Return every route, grouped by source chat"""
+        return [route for chat_routes in self.routes.values() for route in chat_routes]
+
+class RoutedChatFilter(filters.MessageFilter):
+    """Message filter accepting messages from any routed source chat"""
+
+    def filter(self, message):
+        return route_table.is_source(message.chat_id)
+
+# Create singleton instances for use throughout the app
+route_table = RouteTable()
+routed_chats = RoutedChatFilter(name="RoutedChats")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Manage forwarding routes")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="show enabled routes")
+    add_parser = commands.add_parser("add", help="add or update a route")
+    add_parser.add_argument("source_chat_id", type=int)
+    add_parser.add_argument("dest_chat_id", type=int)
+    add_parser.add_argument("--filters", type=json.loads, default=None, help="JSON object of route filters")
+    remove_parser = commands.add_parser("remove", help="delete a route")
+    remove_parser.add_argument("source_chat_id", type=int)
+    remove_parser.add_argument("dest_chat_id", type=int)
+    args = parser.parse_args()
+
+    route_table.seed(db)
+    if args.command == "add":
+        db.add_route(args.source_chat_id, args.dest_chat_id, args.filters)
+    elif args.command == "remove":
+        db.remove_route(args.source_chat_id, args.dest_chat_id)
+    route_table.load(db.get_routes())
+    for route in route_table.all_routes():
+        print(route.describe())
+    async_db.close()
@@ -7,21 +7,36 @@ import asyncio
 import logging
 import traceback
 from datetime import datetime, timedelta
+from itertools import groupby
 from telegram import Bot
 
-from config import GROUP_CHAT_ID, CHANNEL_CHAT_ID, runtime, ACTIVITY_TIMEOUT
+from config import (
+    GROUP_CHAT_ID, runtime, ACTIVITY_TIMEOUT,
+    FORWARD_WORKERS, FORWARD_QUEUE_SIZE, FORWARD_BATCH_MAX, FORWARD_BATCH_WINDOW_MS,
+    MEDIA_GROUP_WINDOW_MS, FANOUT_REUSE, JOURNAL_SYNC_DAYS, JOURNAL_RETENTION_DAYS, OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETENTION_HOURS
+)
 from utils import retry_telegram_operation, update_last_activity
-from database import db
+from database import async_db, OUTBOX_IN_FLIGHT, OUTBOX_DONE, OUTBOX_FAILED
+from dedup import audio_record, dedup_keys, scoped_keys
+from ratelimit import scheduler
+from metrics import FORWARDS, FORWARD_LATENCY, QUEUE_DEPTH
+from perf import perf
+from routing import route_table
+from storage import store
+from sharding import local_shard
+from lease import forwarder_lease
 
 logger = logging.getLogger('afsaneh_bot')
 
+@perf.instrument
 class ForwardService:
-    """Service for forwarding audio files from group to channel"""
+    """Service for forwarding audio files from source chats to their routed destinations"""
     
     @staticmethod
     async def forward_audio_message(message, bot):
         """
-        Forward an audio message to the channel
+        Forward an audio message along the routes of its chat
         
         Args:
             message: Message object containing audio
@@ -34,79 +49,344 @@ class ForwardService:
         if not message.audio:
             return False, "not_audio"
         
-        file_id = message.audio.file_id
+        results = await ForwardService.forward_records(bot, message.chat_id, [audio_record(message)])
+        return results[0]
+    
+    @staticmethod
+    async def forward_records(bot, source_chat_id, records, dest_chat_ids=None):
+        """
+        Forward audio messages from one chat to their destinations in bulk
+        
+        Duplicates are filtered out per destination first, so a file already
+        in one channel still reaches a newly added one. Files another worker
+        or instance is sending to the same destination right now hold a
+        claim in the storage backend and are skipped without closing their
+        outbox intents. The rest
+        go to all destinations concurrently through forwardMessages, 100
+        messages per request, each destination paced by its own rate limiter.
+        The returned message IDs are saved with their files in one
+        transaction per request. Matching outbox intents follow each message
+        through in-flight to done or failed.
+        
+        Records that could not be forwarded from the source but reached
+        another destination are then sent on from that destination (see
+        FANOUT_REUSE).
+        
+        Args:
+            bot: Telegram bot instance
+            source_chat_id: Chat all the messages were posted in
+            records: List of audio records (see dedup.audio_record)
+            dest_chat_ids: Chats to forward every record to; None routes
+                each record through the route table
+            
+        Returns:
+            list: (success, message key) for each record, in order; a
+            record counts as forwarded if any destination received it
+        """
+        results = [None] * len(records)
+        pending = {}
+        targets = {}
+        duplicates = {}
+        claimed = []
         
-        # Check if already forwarded
-        if db.is_file_forwarded(file_id):
-            return False, "already_forwarded"
+        candidates = []
+        for i, record in enumerate(records):
+            record_dests = list(dest_chat_ids) if dest_chat_ids is not None else \
+                route_table.destinations(source_chat_id, record)
+            if not record_dests:
+                results[i] = (False, "no_route")
+            candidates.extend((i, dest_chat_id) for dest_chat_id in record_dests)
         
         try:
-            # Forward to channel
-            forward_result = await retry_telegram_operation(
-                message.forward, CHANNEL_CHAT_ID
-            )
-            
-            if forward_result:
-                # Save to database
-                db.save_forwarded_file(
-                    file_id,
-                    message.audio.file_name or "",
-                    message.audio.performer or "",
-                    message.audio.title or "",
-                    forward_result.message_id
-                )
-                logger.info(f"Successfully forwarded audio: {file_id}")
-                return True, "success_forward"
+            # Claim before checking, so a file is never checked, found missing
+            # and forwarded by two workers at once
+            key_sets = [scoped_keys(dedup_keys(**records[i]), dest_chat_id) for i, dest_chat_id in candidates]
+            granted = await store.claim(key_sets)
+            claimed = [key for keys, ok in zip(key_sets, granted) if ok for key in keys]
+            checks = [(records[i], dest_chat_id) for (i, dest_chat_id), ok in zip(candidates, granted) if ok]
+            forwarded = iter(await store.files_forwarded(checks))
+            for (i, dest_chat_id), ok in zip(candidates, granted):
+                if not ok:
+                    # Someone else is forwarding it right now; the intent stays
+                    # open and the outbox resume re-checks it if that forward fails
+                    continue
+                if next(forwarded):
+                    duplicates.setdefault(dest_chat_id, []).append(records[i])
+                    continue
+                pending.setdefault(dest_chat_id, {})[records[i]['source_message_id']] = i
+                targets.setdefault(i, []).append(dest_chat_id)
             
-            return False, "failed_forward"
+            for dest_chat_id, dest_records in duplicates.items():
+                FORWARDS.inc(len(dest_records), outcome="duplicate")
+                await async_db.mark_outbox(dest_records, dest_chat_id, OUTBOX_DONE)
             
-        except Exception as e:
-            logger.error(f"Forward error: {e}")
-            logger.error(traceback.format_exc())
-            return False, "failed_forward"
+            outcomes = await asyncio.gather(*(
+                ForwardService._forward_pending(bot, source_chat_id, dest_chat_id, records, dest_pending)
+                for dest_chat_id, dest_pending in pending.items()
+            ))
+            delivered = dict(zip(pending, outcomes))
+            if FANOUT_REUSE != 'off' and len(delivered) > 1:
+                await ForwardService._reuse_forwards(bot, records, targets, delivered)
+        finally:
+            await store.release(claimed)
+        
+        for i in range(len(records)):
+            if results[i]:
+                continue
+            reached = [dest_chat_id for dest_chat_id in targets.get(i, ()) if i in delivered[dest_chat_id]]
+            if reached:
+                results[i] = (True, "success_forward")
+            elif i in targets:
+                results[i] = (False, "failed_forward")
+            else:
+                results[i] = (False, "already_forwarded")
+        return results
     
     @staticmethod
-    async def fetch_recent_messages(bot, days=3):
+    async def _forward_pending(bot, source_chat_id, dest_chat_id, records, pending):
         """
-        Fetch recent messages from the group
+        Forward the records that passed dedup in chunks to one destination
+        
+        Returns:
+            dict: Record index to message ID in the destination, for each
+            record forwarded
+        """
+        delivered = {}
+        message_ids = sorted(pending)  # forwardMessages requires increasing IDs
+        for start in range(0, len(message_ids), FORWARD_BATCH_MAX):
+            chunk = message_ids[start:start + FORWARD_BATCH_MAX]
+            chunk_records = [records[pending[message_id]] for message_id in chunk]
+            # Forward once the destination's rate limiter allows it
+            await scheduler.acquire(dest_chat_id, cost=len(chunk))
+            if not forwarder_lease.permits_forwarding:
+                # Lost the lease: leave the intents open for the new forwarder
+                logger.warning(f"Not forwarding {len(chunk)} messages to {dest_chat_id} without the forwarder lease")
+                break
+            await async_db.mark_outbox(chunk_records, dest_chat_id, OUTBOX_IN_FLIGHT)
+            try:
+                with FORWARD_LATENCY.time():
+                    forwarded = await retry_telegram_operation(
+                        bot.forward_messages,
+                        chat_id=dest_chat_id,
+                        from_chat_id=source_chat_id,
+                        message_ids=chunk
+                    )
+            except Exception as e:
+                logger.error(f"Forward error to {dest_chat_id}: {e}")
+                logger.error(traceback.format_exc())
+                FORWARDS.inc(len(chunk), outcome="failed")
+                await async_db.mark_outbox(chunk_records, dest_chat_id, OUTBOX_FAILED)
+                continue
+            
+            if len(forwarded) == len(chunk):
+                channel_ids = {message_id: result.message_id for message_id, result in zip(chunk, forwarded)}
+            else:
+                # Telegram silently skips messages it cannot forward (usually deleted
+                # ones), so which of them landed is unknown
+                logger.warning(f"Forwarded {len(forwarded)} of {len(chunk)} messages from {source_chat_id}")
+                channel_ids = await ForwardService._resend_singly(
+                    bot, bot.forward_message, source_chat_id, dest_chat_id, chunk, forwarded
+                )
+            
+            saved = []
+            for message_id in chunk:
+                index = pending[message_id]
+                if message_id in channel_ids:
+                    saved.append(dict(records[index], message_id=channel_ids[message_id]))
+                    delivered[index] = channel_ids[message_id]
+            missed = [records[pending[message_id]] for message_id in chunk if message_id not in channel_ids]
+            if missed:
+                FORWARDS.inc(len(missed), outcome="failed")
+                await async_db.mark_outbox(missed, dest_chat_id, OUTBOX_FAILED)
+            if not saved:
+                continue
+            await store.save_forwarded_files(saved, dest_chat_id)
+            FORWARDS.inc(len(saved), outcome="success")
+            logger.info(f"Successfully forwarded {len(saved)} audio files from {source_chat_id} to {dest_chat_id}")
+        return delivered
+    
+    @staticmethod
+    async def _resend_singly(bot, send_one, from_chat_id, dest_chat_id, message_ids, partial):
+        """
+        Redo a bulk send that returned fewer messages than requested, one message at a time
+        
+        The messages the bulk call did deliver are deleted first, since
+        there is no telling which they were, so nothing lands twice.
         
         Args:
             bot: Telegram bot instance
-            days: Number of days to look back
+            send_one: bot.forward_message or bot.copy_message
+            from_chat_id: Chat the messages are sent from
+            dest_chat_id: Destination chat
+            message_ids: Message IDs of the bulk call
+            partial: MessageId results the bulk call returned
             
         Returns:
-            list: List of messages with audio files
+            dict: Message ID to its ID in the destination, for each message
+            that landed (empty if the partial send could not be removed)
         """
-        messages = []
-        cutoff = datetime.now() - timedelta(days=days)
+        if partial:
+            try:
+                await retry_telegram_operation(
+                    bot.delete_messages,
+                    chat_id=dest_chat_id,
+                    message_ids=[result.message_id for result in partial]
+                )
+            except Exception as e:
+                logger.error(f"Could not remove a partial forward from {dest_chat_id}: {e}")
+                return {}
+        
+        channel_ids = {}
+        for message_id in message_ids:
+            await scheduler.acquire(dest_chat_id)
+            if not forwarder_lease.permits_forwarding:
+                break
+            try:
+                with FORWARD_LATENCY.time():
+                    result = await retry_telegram_operation(
+                        send_one,
+                        chat_id=dest_chat_id,
+                        from_chat_id=from_chat_id,
+                        message_id=message_id
+                    )
+                channel_ids[message_id] = result.message_id
+            except Exception as e:
+                logger.warning(f"Message {message_id} from {from_chat_id} could not be sent to {dest_chat_id}: {e}")
+        return channel_ids
+    
+    @staticmethod
+    async def _reuse_forwards(bot, records, targets, delivered):
+        """
+        Send records that failed for some destinations on from one that has them
+        
+        A forward from the source fails when the original message is gone or
+        the source chat is unreachable, while the copy in another destination
+        is still there. Those records are copied (or forwarded, per
+        FANOUT_REUSE) from the first destination that received them, in one
+        request per pair of chats.
         
+        Args:
+            bot: Telegram bot instance
+            records: Audio records being forwarded
+            targets: Record index to the destinations it was sent to
+            delivered: Destination to {record index: message ID} of the
+                successful forwards; updated in place
+        """
+        plans = {}
+        for i, dests in targets.items():
+            missing = [dest_chat_id for dest_chat_id in dests if i not in delivered[dest_chat_id]]
+            donor = next((dest_chat_id for dest_chat_id in dests if delivered[dest_chat_id].get(i)), None)
+            if not missing or donor is None:
+                continue
+            for dest_chat_id in missing:
+                plans.setdefault((donor, dest_chat_id), {})[delivered[donor][i]] = i
+        
+        operation = bot.copy_messages if FANOUT_REUSE == 'copy' else bot.forward_messages
+        send_one = bot.copy_message if FANOUT_REUSE == 'copy' else bot.forward_message
+        for (donor, dest_chat_id), donor_pending in plans.items():
+            message_ids = sorted(donor_pending)
+            chunk_records = [records[donor_pending[message_id]] for message_id in message_ids]
+            await scheduler.acquire(dest_chat_id, cost=len(message_ids))
+            if not forwarder_lease.permits_forwarding:
+                break
+            try:
+                with FORWARD_LATENCY.time():
+                    sent = await retry_telegram_operation(
+                        operation,
+                        chat_id=dest_chat_id,
+                        from_chat_id=donor,
+                        message_ids=message_ids
+                    )
+            except Exception as e:
+                logger.error(f"Fan-out from {donor} to {dest_chat_id} failed: {e}")
+                continue
+            
+            if len(sent) == len(message_ids):
+                channel_ids = {message_id: result.message_id for message_id, result in zip(message_ids, sent)}
+            else:
+                logger.warning(f"Sent {len(sent)} of {len(message_ids)} messages on from {donor}")
+                channel_ids = await ForwardService._resend_singly(
+                    bot, send_one, donor, dest_chat_id, message_ids, sent
+                )
+            
+            saved = []
+            for message_id, record in zip(message_ids, chunk_records):
+                if message_id in channel_ids:
+                    saved.append(dict(record, message_id=channel_ids[message_id]))
+                    delivered[dest_chat_id][donor_pending[message_id]] = channel_ids[message_id]
+            if not saved:
+                continue
+            await store.save_forwarded_files(saved, dest_chat_id)
+            FORWARDS.inc(len(saved), outcome="success")
+            logger.info(f"Sent {len(saved)} audio files on from {donor} to {dest_chat_id}")
+    
+    @staticmethod
+    async def resume_outbox(bot):
+        """
+        Forward intents left pending, in flight or failed by a previous run
+        
+        Intents whose file already reached the channel (the process died
+        after forwarding but before marking them) are found by the dedup
+        check and marked done without a second forward.
+        
+        Args:
+            bot: Telegram bot instance
+            
+        Returns:
+            int: Number of messages forwarded
+        """
         try:
-            logger.info(f"Fetching recent messages from chat ID: {GROUP_CHAT_ID}")
+            await async_db.prune_outbox(datetime.now() - timedelta(hours=OUTBOX_RETENTION_HOURS))
+            intents = await async_db.get_outbox_intents(OUTBOX_MAX_ATTEMPTS)
+            # In supervisor mode each worker resumes the chats it owns
+            intents = [intent for intent in intents if local_shard.owns(intent[1]['source_chat_id'])]
+            if not intents:
+                return 0
             
-            # Get group administrators
-            administrators = await retry_telegram_operation(
-                bot.get_chat_administrators,
-                chat_id=GROUP_CHAT_ID
-            )
+            logger.info(f"Resuming {len(intents)} unfinished forwards from the outbox")
+            forwarded_count = 0
+            key = lambda intent: (intent[0], intent[1]['source_chat_id'])
+            for (dest_chat_id, chat_id), group in groupby(intents, key=key):
+                records = [record for _, record in group]
+                results = await ForwardService.forward_records(bot, chat_id, records, [dest_chat_id])
+                forwarded_count += sum(1 for success, _ in results if success)
             
-            # Attempt to get recent messages - we'll just use admin list
-            # to check connectivity, as we can't fetch message history easily
-            logger.info(f"Found {len(administrators)} admins in the group")
+            logger.info(f"Resumed {forwarded_count} forwards from the outbox")
+            return forwarded_count
             
-            # Since we can't easily get message history in newer API versions,
-            # we'll log this and rely on real-time forwarding instead
-            logger.info("Relying on real-time message forwarding instead of historical sync")
+        except Exception as e:
+            logger.error(f"Outbox resume error: {e}")
+            logger.error(traceback.format_exc())
+            return 0
+    
+    @staticmethod
+    async def fetch_recent_messages(days=JOURNAL_SYNC_DAYS):
+        """
+        Fetch journaled audio messages that never reached the channel
+        
+        Args:
+            days: Number of days to look back
             
+        Returns:
+            list: Audio records ordered by chat and message ID
+        """
+        cutoff = datetime.now() - timedelta(days=days)
+        
+        try:
+            await store.prune_group_messages(datetime.now() - timedelta(days=JOURNAL_RETENTION_DAYS))
+            records = await store.get_unforwarded_messages(cutoff)
+            records = [record for record in records if local_shard.owns(record['source_chat_id'])]
+            logger.info(f"Found {len(records)} journaled audio messages not yet forwarded")
+            return records
         except Exception as e:
             logger.error(f"Error fetching messages: {e}")
             logger.error(traceback.format_exc())
-        
-        return messages
+            return []
     
     @staticmethod
     async def sync_with_channel(bot):
         """
-        Sync recent messages with the channel
+        Forward journaled messages missed while the bot was down along their routes
         
         Args:
             bot: Telegram bot instance
@@ -125,22 +405,18 @@ class ForwardService:
                 logger.error(f"Bot connection test failed: {e}")
                 return 0
             
-            # Get historical messages
-            messages = await ForwardService.fetch_recent_messages(bot)
+            # Get the gap between the journal and the channel
+            records = await ForwardService.fetch_recent_messages()
             
-            if not messages:
+            if not records:
                 logger.info("No historical messages to forward.")
                 return 0
             
-            # Forward all audio messages
+            # Forward per source chat in rate-limited batches
             forwarded_count = 0
-            for msg in messages:
-                if msg.audio and not db.is_file_forwarded(msg.audio.file_id):
-                    success, _ = await ForwardService.forward_audio_message(msg, bot)
-                    if success:
-                        forwarded_count += 1
-                    # Add delay to avoid rate limits
-                    await asyncio.sleep(1)
+            for chat_id, chat_records in groupby(records, key=lambda record: record['source_chat_id']):
+                results = await ForwardService.forward_records(bot, chat_id, list(chat_records))
+                forwarded_count += sum(1 for success, _ in results if success)
             
             logger.info(f"Synchronized {forwarded_count} audio messages")
             return forwarded_count
@@ -218,4 +494,344 @@ class HealthService:
                 
         except Exception as e:
             logger.error(f"Watchdog error: {e}")
-            logger.error(traceback.format_exc()) 
\ No newline at end of file
+            logger.error(traceback.format_exc())
+
+class ForwardJob:
+    """A queued forward of one audio message or one album from a single chat"""
+    
+    __slots__ = ('messages', 'on_done')
+    
+    def __init__(self, messages, on_done=None):
+        """
+        Create a job
+        
+        Args:
+            messages: Message objects from the same chat
+            on_done: Optional coroutine function called with a list of
+                (success, message_key) tuples, one per message
+        """
+        self.messages = messages
+        self.on_done = on_done
+    
+    @property
+    def chat_id(self):
+        """Source chat of the job"""
+        return self.messages[0].chat_id
+
+class ForwardPipeline:
+    """
+    Pool of async workers draining queued forwards
+    
+    Each worker owns a bounded queue and jobs are routed to a worker by
+    source chat, so messages from one chat are forwarded in the order they
+    arrived while different chats proceed in parallel. When a queue is
+    full, submit waits, pushing back on the handlers. Consecutive jobs from
+    the same chat arriving within a short window are forwarded together in
+    one forwardMessages call. Completion callbacks (the acknowledgement
+    replies, paced by the source chat's rate limit) run in a task per source
+    chat, so forwarding never waits on them.
+    """
+    
+    def __init__(self, workers=FORWARD_WORKERS, queue_size=FORWARD_QUEUE_SIZE,
+                 batch_max=FORWARD_BATCH_MAX, batch_window_ms=FORWARD_BATCH_WINDOW_MS):
+        """
+        Initialize the pipeline (workers start with start())
+        
+        Args:
+            workers: Number of concurrent forwarding workers
+            queue_size: Total number of jobs that may wait across all workers
+            batch_max: Most messages forwarded in one call
+            batch_window_ms: How long a worker waits for more jobs from the same chat
+        """
+        self.worker_count = max(1, workers)
+        self.queue_size = max(self.worker_count, queue_size)
+        self.batch_max = max(1, min(batch_max, FORWARD_BATCH_MAX))
+        self.batch_window = batch_window_ms / 1000
+        self.queues = []
+        self.tasks = []
+        self.acks = {}
+        self.ack_tasks = {}
+        self.bot = None
+    
+    def start(self, bot):
+        """
+        Start the workers
+        
+        Args:
+            bot: Telegram bot instance used for forwarding
+        """
+        self.bot = bot
+        per_worker = self.queue_size // self.worker_count
+        self.queues = [asyncio.Queue(maxsize=per_worker) for _ in range(self.worker_count)]
+        self.tasks = [
+            asyncio.create_task(self._worker(queue), name=f"forward-worker-{i}")
+            for i, queue in enumerate(self.queues)
+        ]
+        logger.info(f"Forward pipeline started with {self.worker_count} workers")
+    
+    def _queue_for(self, chat_id):
+        """Return the queue owning a source chat"""
+        return self.queues[hash(chat_id) % len(self.queues)]
+    
+    async def submit(self, messages, on_done=None):
+        """
+        Queue audio messages for forwarding, waiting if the queue is full
+        
+        A durable outbox intent is written first, so the forward is resumed
+        on the next start if the process dies before it completes.
+        
+        Args:
+            messages: Message objects from the same chat, forwarded as one unit
+            on_done: Optional coroutine function called with a list of
+                (success, message_key) tuples, one per message
+        """
+        job = ForwardJob(messages, on_done)
+        by_dest = {}
+        for message in messages:
+            if message.audio:
+                record = audio_record(message)
+                for dest_chat_id in route_table.destinations(job.chat_id, record):
+                    by_dest.setdefault(dest_chat_id, []).append(record)
+        for dest_chat_id, records in by_dest.items():
+            await async_db.add_outbox_intents(records, dest_chat_id)
+        await self._queue_for(job.chat_id).put(job)
+    
+    def depth(self):
+        """Return the number of jobs waiting to be forwarded"""
+        return sum(queue.qsize() for queue in self.queues)
+    
+    @staticmethod
+    async def _get_within(queue, timeout):
+        """
+        Take the next job from a queue, waiting at most timeout seconds
+        
+        Unlike wait_for(queue.get()), a job taken just as the timeout or a
+        cancellation hits is never lost: it is returned, or put back.
+        
+        Returns:
+            ForwardJob: The job, or None if none arrived in time
+        """
+        getter = asyncio.ensure_future(queue.get())
+        try:
+            await asyncio.wait((getter,), timeout=timeout)
+        except asyncio.CancelledError:
+            getter.cancel()
+            if getter.done() and not getter.cancelled():
+                try:
+                    queue.put_nowait(getter.result())
+                    queue.task_done()
+                except asyncio.QueueFull:
+                    logger.warning("Dropped a dequeued forward on cancellation, the outbox resumes it")
+            raise
+        if not getter.done():
+            getter.cancel()
+            # The get may still complete before the cancellation lands
+            await asyncio.wait((getter,))
+            if getter.cancelled():
+                return None
+        return getter.result()
+    
+    async def _collect(self, queue, first):
+        """
+        Gather jobs from the same chat that follow the first one
+        
+        Args:
+            queue: The worker's queue
+            first: Job already taken from the queue
+            
+        Returns:
+            list: Jobs to forward together
+            ForwardJob: Job from another chat that ended the batch, or None
+        """
+        batch = [first]
+        size = len(first.messages)
+        deadline = asyncio.get_running_loop().time() + self.batch_window
+        while size < self.batch_max:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining > 0 and queue.empty():
+                job = await self._get_within(queue, remaining)
+            else:
+                try:
+                    job = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    job = None
+            if job is None:
+                break
+            if job.chat_id != first.chat_id:
+                return batch, job
+            batch.append(job)
+            size += len(job.messages)
+        return batch, None
+    
+    async def _forward_batch(self, batch):
+        """Forward a batch of jobs from one chat and report each job's results"""
+        audio_messages = [message for job in batch for message in job.messages if message.audio]
+        outcomes = {}
+        if audio_messages:
+            records = [audio_record(message) for message in audio_messages]
+            results = await ForwardService.forward_records(self.bot, batch[0].chat_id, records)
+            outcomes = {id(message): result for message, result in zip(audio_messages, results)}
+        
+        for job in batch:
+            if job.on_done:
+                self._acknowledge(job, [outcomes.get(id(message), (False, "not_audio")) for message in job.messages])
+    
+    def _acknowledge(self, job, results):
+        """Queue a job's callback behind the earlier ones of its chat, starting the chat's task if idle"""
+        chat_id = job.chat_id
+        self.acks.setdefault(chat_id, []).append((job.on_done, results))
+        if chat_id not in self.ack_tasks:
+            self.ack_tasks[chat_id] = asyncio.create_task(self._run_acks(chat_id), name=f"forward-acks-{chat_id}")
+    
+    async def _run_acks(self, chat_id):
+        """Run the queued callbacks of one chat in order, then exit"""
+        pending = self.acks[chat_id]
+        try:
+            while pending:
+                on_done, results = pending.pop(0)
+                try:
+                    await on_done(results)
+                except Exception as e:
+                    logger.error(f"Forward callback error: {e}")
+        finally:
+            del self.acks[chat_id]
+            del self.ack_tasks[chat_id]
+    
+    async def _worker(self, queue):
+        """Forward jobs from one queue in per-chat batches until cancelled"""
+        carry = None
+        while True:
+            first = carry or await queue.get()
+            carry = None
+            batch = [first]
+            try:
+                batch, carry = await self._collect(queue, first)
+                await self._forward_batch(batch)
+            except Exception as e:
+                logger.error(f"Forward worker error: {e}")
+                logger.error(traceback.format_exc())
+            finally:
+                for _ in batch:
+                    queue.task_done()
+    
+    async def drain(self, timeout):
+        """
+        Wait until every queued job has been forwarded
+        
+        Args:
+            timeout: Seconds to wait at most
+            
+        Returns:
+            int: Jobs still queued when the timeout ran out (0 when drained)
+        """
+        if not self.queues:
+            return 0
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self.queues)), max(0, timeout))
+        except asyncio.TimeoutError:
+            return self.depth()
+        
+        # Send the acknowledgements still waiting, in the time that is left
+        if self.ack_tasks:
+            await asyncio.wait(list(self.ack_tasks.values()), timeout=max(0, deadline - loop.time()))
+        return 0
+    
+    async def stop(self):
+        """
+        Cancel the workers, abandoning any jobs still queued
+        
+        Abandoned jobs keep their outbox intents and are resumed on the next
+        start; acknowledgements not sent yet are dropped.
+        """
+        tasks = self.tasks + list(self.ack_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.tasks = []
+        logger.info("Forward pipeline stopped")
+
+class MediaGroupBuffer:
+    """
+    Holds album items briefly so each album is forwarded as one job
+    
+    Telegram delivers every item of an album as its own update. Items that
+    share a media_group_id are collected until none has arrived for the
+    window, then submitted together, giving one forward call, one database
+    transaction and one acknowledgement for the whole album.
+    """
+    
+    def __init__(self, pipeline, window_ms=MEDIA_GROUP_WINDOW_MS):
+        """
+        Initialize the buffer
+        
+        Args:
+            pipeline: ForwardPipeline receiving the completed albums
+            window_ms: Quiet period after the last item before an album is submitted
+        """
+        self.pipeline = pipeline
+        self.window = window_ms / 1000
+        self.groups = {}
+        # Strong references to the timers, which would otherwise be collectable once submitting
+        self.tasks = set()
+    
+    def add(self, message, on_done=None):
+        """
+        Buffer one album item
+        
+        Args:
+            message: Message object with a media_group_id
+            on_done: Coroutine function for the album's results, taken from the first item
+        """
+        key = (message.chat_id, message.media_group_id)
+        loop = asyncio.get_running_loop()
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = {
+                'messages': [],
+                'on_done': on_done,
+                'deadline': 0,
+            }
+            group['task'] = asyncio.create_task(self._submit_when_quiet(key))
+            self.tasks.add(group['task'])
+            group['task'].add_done_callback(self.tasks.discard)
+        group['messages'].append(message)
+        group['deadline'] = loop.time() + self.window
+    
+    async def _submit_when_quiet(self, key):
+        """Wait until the album stops growing, then submit it"""
+        loop = asyncio.get_running_loop()
+        group = self.groups[key]
+        while (remaining := group['deadline'] - loop.time()) > 0:
+            await asyncio.sleep(remaining)
+        del self.groups[key]
+        await self._submit(group)
+    
+    async def _submit(self, group):
+        """Submit a collected album to the pipeline in message order, reporting a failure to its callback"""
+        messages = sorted(group['messages'], key=lambda message: message.message_id)
+        logger.debug(f"Submitting album of {len(messages)} items from {messages[0].chat_id}")
+        try:
+            await self.pipeline.submit(messages, group['on_done'])
+        except Exception as e:
+            logger.error(f"Error submitting album from {messages[0].chat_id}: {e}")
+            logger.error(traceback.format_exc())
+            if group['on_done']:
+                try:
+                    await group['on_done']([(False, "failed_forward")] * len(messages))
+                except Exception as e:
+                    logger.error(f"Forward callback error: {e}")
+    
+    async def flush(self):
+        """Submit every album still being collected without waiting for the window"""
+        groups = list(self.groups.values())
+        self.groups.clear()
+        for group in groups:
+            group['task'].cancel()
+            await self._submit(group)
+
+# Create singleton instances for use throughout the app
+forward_pipeline = ForwardPipeline()
+media_groups = MediaGroupBuffer(forward_pipeline)
+QUEUE_DEPTH.set_function(forward_pipeline.depth)
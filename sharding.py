@@ -0,0 +1,397 @@
+"""
+Sharding module for AfsanehBayebot
+Splits the work across worker processes by source chat
+
+In supervisor mode (python bot.py --workers N) one ingest process receives
+every update and hands it to the worker owning its chat over a local TCP
+connection. A chat always maps to the same worker, and each worker handles
+its updates in arrival order, so per-chat ordering is kept while chats are
+forwarded in parallel on separate cores.
+
+Frames are JSON lines. The supervisor sends {"update": {...}}, {"sync": true},
+{"control": {...}} and {"stop": true}; a worker sends {"hello": index} once
+connected, {"ack": update_id} after each update has run through its handlers
+and {"relay": {...}} to have a control change (pause, resume, route reload,
+language) applied by every other worker.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+from collections import OrderedDict
+
+from telegram import Update
+
+from config import METRICS_PORT, SHUTDOWN_TIMEOUT
+
+logger = logging.getLogger('afsaneh_bot')
+
+# Seconds before a worker that exited is started again
+RESTART_DELAY = 1.0
+
+def shard_for(chat_id, shards):
+    """
+    Return the shard owning a chat
+
+    Args:
+        chat_id: Telegram chat ID
+        shards: Number of shards
+
+    Returns:
+        int: Shard index in range(shards)
+    """
+    return chat_id % shards if shards > 1 else 0
+
+class LocalShard:
+    """The shard this process serves; a single process owns every chat"""
+
+    def __init__(self):
+        """Initialize as the only shard"""
+        self.index = 0
+        self.count = 1
+        self.relay = None
+
+    def configure(self, index, count):
+        """
+        Serve one shard out of count
+
+        Args:
+            index: Shard index of this process
+            count: Total number of shards
+        """
+        self.index = index
+        self.count = count
+
+    def owns(self, chat_id):
+        """Return True if this process handles the chat"""
+        return shard_for(chat_id, self.count) == self.index
+
+    async def announce(self, action, value=None):
+        """
+        Have the other worker processes apply a control change made here
+
+        Does nothing outside supervisor mode, where this process is the only one.
+
+        Args:
+            action: 'pause', 'resume', 'reload_routes' or 'language'
+            value: Argument of the action, e.g. the language code
+        """
+        if self.relay:
+            try:
+                await self.relay({"action": action, "value": value})
+            except ConnectionError as e:
+                logger.error(f"Could not relay {action} to the other workers: {e}")
+
+class WorkerLink:
+    """Supervisor-side state of one worker process"""
+
+    def __init__(self, index):
+        """
+        Initialize the link
+
+        Args:
+            index: Shard index of the worker
+        """
+        self.index = index
+        self.process = None
+        self.writer = None
+        self.lock = asyncio.Lock()
+        self.unacked = OrderedDict()
+
+class UpdateDistributor:
+    """
+    Supervisor side: spawns the workers and feeds them updates
+
+    Updates not yet acknowledged are kept per worker and sent again, in
+    order, when a crashed worker reconnects. The update offset only advances
+    past updates every worker has acknowledged, so a restart never skips an
+    update that was in flight.
+    """
+
+    def __init__(self, workers, store):
+        """
+        Initialize the distributor (nothing runs until start())
+
+        Args:
+            workers: Number of worker processes
+            store: StorageBackend the update offset is saved in
+        """
+        self.links = [WorkerLink(index) for index in range(workers)]
+        self.store = store
+        self.server = None
+        self.port = None
+        self.monitors = []
+        self.stopping = False
+        self.synced = False
+        self.dispatched = {}
+        self.last_dispatched = 0
+        self.saved_offset = 0
+        self.drained = asyncio.Event()
+        self.drained.set()
+        # Latest pause/resume and language changes, replayed to restarted workers
+        self.controls = {}
+
+    async def start(self, timeout=30):
+        """
+        Listen for workers, spawn them and wait until each has connected
+
+        Args:
+            timeout: Seconds to wait for the workers to come up
+        """
+        self.server = await asyncio.start_server(self._handle_worker, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.monitors = [asyncio.create_task(self._monitor(link)) for link in self.links]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while any(link.writer is None for link in self.links):
+            if loop.time() > deadline:
+                raise RuntimeError("Worker processes did not connect in time")
+            await asyncio.sleep(0.1)
+        logger.info(f"Supervisor running {len(self.links)} workers")
+
+    def _spawn_args(self, link):
+        """Command line of a worker process"""
+        return [
+            sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py"),
+            "--worker-index", str(link.index), "--workers", str(len(self.links)), "--ipc-port", str(self.port),
+        ]
+
+    async def _monitor(self, link):
+        """Run one worker process, starting it again whenever it exits unexpectedly"""
+        env = dict(os.environ)
+        # Each worker serves its own /metrics next to the supervisor's
+        env["METRICS_PORT"] = str(METRICS_PORT + 1 + link.index) if METRICS_PORT else "0"
+        while not self.stopping:
+            # A session of its own keeps Ctrl+C away from the workers; the supervisor stops them
+            link.process = await asyncio.create_subprocess_exec(*self._spawn_args(link), env=env, start_new_session=True)
+            code = await link.process.wait()
+            if self.stopping:
+                break
+            logger.error(f"Worker {link.index} exited with code {code}, restarting")
+            await asyncio.sleep(RESTART_DELAY)
+
+    async def _handle_worker(self, reader, writer):
+        """Register a worker connection, replay its unacknowledged updates and read its acks"""
+        link = None
+        try:
+            hello = json.loads(await reader.readline())
+            link = self.links[hello["hello"]]
+            async with link.lock:
+                if self.synced:
+                    # A restarted worker first resumes the forwards its predecessor left queued
+                    writer.write(b'{"sync": true}\n')
+                for control in self.controls.values():
+                    writer.write((json.dumps({"control": control}) + "\n").encode("utf-8"))
+                for payload in link.unacked.values():
+                    writer.write(payload)
+                await writer.drain()
+                link.writer = writer
+            if link.unacked:
+                logger.warning(f"Sent {len(link.unacked)} unacknowledged updates to worker {link.index} again")
+
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                frame = json.loads(line)
+                if "relay" in frame:
+                    await self._relay(link, frame["relay"])
+                else:
+                    await self._acknowledge(link, frame["ack"])
+        except (ConnectionError, ValueError, KeyError, IndexError) as e:
+            logger.error(f"Worker connection error: {e}")
+        except asyncio.CancelledError:
+            pass
+        finally:
+            if link and link.writer is writer:
+                link.writer = None
+            writer.close()
+
+    async def _relay(self, link, control):
+        """Pass a control change made in one worker on to all the others"""
+        action = control.get("action")
+        if action in ("pause", "resume"):
+            self.controls["paused"] = control
+        elif action == "language":
+            self.controls["language"] = control
+        await self.broadcast({"control": control}, skip=link.index)
+
+    async def _acknowledge(self, link, update_id):
+        """Forget an acknowledged update and save the offset every worker has reached"""
+        link.unacked.pop(update_id, None)
+        self.dispatched.pop(update_id, None)
+        # Updates are dispatched in increasing ID order, so the oldest pending one comes first
+        offset = next(iter(self.dispatched)) - 1 if self.dispatched else self.last_dispatched
+        if offset > self.saved_offset:
+            self.saved_offset = offset
+            await self.store.save_update_offset(offset)
+        if not self.dispatched:
+            self.drained.set()
+
+    async def dispatch(self, update):
+        """
+        Send an update to the worker owning its chat
+
+        Args:
+            update: Update received by the ingest application
+        """
+        chat = update.effective_chat
+        link = self.links[shard_for(chat.id if chat else 0, len(self.links))]
+        payload = (json.dumps({"update": update.to_dict()}) + "\n").encode("utf-8")
+        async with link.lock:
+            link.unacked[update.update_id] = payload
+            self.dispatched[update.update_id] = link.index
+            self.last_dispatched = max(self.last_dispatched, update.update_id)
+            self.drained.clear()
+            if link.writer is not None:
+                try:
+                    link.writer.write(payload)
+                    await link.writer.drain()
+                except ConnectionError as e:
+                    # Kept in unacked and replayed once the worker reconnects
+                    logger.error(f"Worker {link.index} unreachable: {e}")
+
+    async def sync(self):
+        """Have every worker, and any worker restarted later, run the initial sync"""
+        self.synced = True
+        await self.broadcast({"sync": True})
+
+    async def broadcast(self, frame, skip=None):
+        """
+        Send a control frame to every connected worker
+
+        Args:
+            frame: Frame to send
+            skip: Index of a worker to leave out, e.g. the one the change came from
+        """
+        payload = (json.dumps(frame) + "\n").encode("utf-8")
+        for link in self.links:
+            if link.index == skip:
+                continue
+            async with link.lock:
+                if link.writer is not None:
+                    try:
+                        link.writer.write(payload)
+                        await link.writer.drain()
+                    except ConnectionError as e:
+                        logger.error(f"Worker {link.index} unreachable: {e}")
+
+    async def drain(self, timeout):
+        """
+        Wait until every dispatched update has been acknowledged
+
+        Returns:
+            int: Updates still unacknowledged when the timeout ran out
+        """
+        try:
+            await asyncio.wait_for(self.drained.wait(), max(0, timeout))
+        except asyncio.TimeoutError:
+            pass
+        return len(self.dispatched)
+
+    async def stop(self, timeout=SHUTDOWN_TIMEOUT):
+        """
+        Ask the workers to shut down gracefully and wait for them to exit
+
+        Args:
+            timeout: Seconds each worker gets to drain before it is killed
+        """
+        self.stopping = True
+        await self.broadcast({"stop": True})
+        for link in self.links:
+            if link.process and link.process.returncode is None:
+                try:
+                    await asyncio.wait_for(link.process.wait(), timeout + 5)
+                except asyncio.TimeoutError:
+                    logger.error(f"Worker {link.index} did not stop in time, killing it")
+                    link.process.kill()
+                    await link.process.wait()
+        for task in self.monitors:
+            task.cancel()
+        await asyncio.gather(*self.monitors, return_exceptions=True)
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        logger.info("Workers stopped")
+
+class UpdateReceiver:
+    """
+    Worker side: runs updates from the supervisor through the application
+
+    Updates are processed one at a time in arrival order, which keeps the
+    order of each chat; the handlers only queue forwards, so the pipeline
+    still forwards several chats concurrently.
+    """
+
+    def __init__(self, app, index, port, on_sync, on_control):
+        """
+        Initialize the receiver
+
+        Args:
+            app: Started Application of this worker
+            index: Shard index of this worker
+            port: Supervisor's IPC port
+            on_sync: Coroutine function run when the supervisor asks for a
+                startup sync; later updates wait for it, so they are
+                forwarded after what it resumes
+            on_control: Coroutine function applying a control change made
+                in another worker (see LocalShard.announce)
+        """
+        self.app = app
+        self.index = index
+        self.port = port
+        self.on_sync = on_sync
+        self.on_control = on_control
+
+    async def run(self, stop_event):
+        """
+        Process frames until the supervisor says stop, disconnects or stop_event is set
+
+        Args:
+            stop_event: asyncio.Event set on SIGINT or SIGTERM
+        """
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        writer.write((json.dumps({"hello": self.index}) + "\n").encode("utf-8"))
+        await writer.drain()
+
+        async def relay(control):
+            writer.write((json.dumps({"relay": control}) + "\n").encode("utf-8"))
+            await writer.drain()
+
+        local_shard.relay = relay
+        stopped = asyncio.create_task(stop_event.wait())
+        try:
+            while True:
+                line = asyncio.create_task(reader.readline())
+                await asyncio.wait((line, stopped), return_when=asyncio.FIRST_COMPLETED)
+                if not line.done():
+                    line.cancel()
+                    break
+                if not line.result():
+                    logger.warning("Supervisor connection closed")
+                    break
+
+                frame = json.loads(line.result())
+                if "update" in frame:
+                    update = Update.de_json(frame["update"], self.app.bot)
+                    await self.app.process_update(update)
+                    writer.write((json.dumps({"ack": update.update_id}) + "\n").encode("utf-8"))
+                    await writer.drain()
+                elif frame.get("sync"):
+                    await self.on_sync()
+                elif "control" in frame:
+                    await self.on_control(frame["control"])
+                elif frame.get("stop"):
+                    break
+        except ConnectionError as e:
+            logger.error(f"Supervisor connection error: {e}")
+        finally:
+            local_shard.relay = None
+            stopped.cancel()
+            writer.close()
+
+# Create singleton instance for use throughout the app
+local_shard = LocalShard()
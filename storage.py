@@ -0,0 +1,892 @@
+"""
+Storage module for AfsanehBayebot
+Backends for the state bot instances must agree on: dedup, the message
+journal, forward statistics and the update offset
+
+STORAGE_BACKEND selects the backend:
+    sqlite  The local database (default); for a single instance
+    redis   Any server speaking the Redis protocol at REDIS_URL, shared by
+            every instance so scaling out never forwards a file twice
+
+The forward outbox, routes and bot state stay in the local database either way,
+and the redis backend also writes forwarded files through to it.
+
+The first instance to use an empty redis backend copies its local history
+into it; other instances' history can be copied in explicitly:
+    python storage.py import
+
+A stand-in server for trying the redis backend locally:
+    python storage.py serve --port 6379
+"""
+
+import argparse
+import asyncio
+import fnmatch
+import json
+import logging
+import time
+import uuid
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from config import STORAGE_BACKEND, REDIS_URL, REDIS_TIMEOUT, STORAGE_PREFIX, STORAGE_CLAIM_TTL
+from database import async_db
+from dedup import dedup_keys, metadata_signature, scoped_keys, ANY_DESTINATION
+from perf import perf
+
+logger = logging.getLogger('afsaneh_bot')
+
+# Deletes KEYS[i] only while it still holds ARGV[i], in one atomic step
+COMPARE_AND_DELETE = """
+local removed = 0
+for i, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[i] then
+        removed = removed + redis.call('DEL', key)
+    end
+end
+return removed
+"""
+
+# Takes KEYS[1] for owner ARGV[1] if free, or extends it if ARGV[1] holds it,
+# for ARGV[2] milliseconds; returns 1 when ARGV[1] holds it afterwards
+ACQUIRE_LEASE = """
+local holder = redis.call('GET', KEYS[1])
+if holder == false then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+if holder == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+class StorageBackend:
+    """
+    Interface of a storage backend
+
+    Checks and writes take batches, so a networked backend can answer a
+    whole forward batch in one round trip.
+    """
+
+    async def prepare(self):
+        """Get the backend ready before the first forward"""
+
+    async def claim(self, key_sets, ttl=STORAGE_CLAIM_TTL):
+        """
+        Claim files for forwarding so no other worker or instance sends them at the same time
+
+        Args:
+            key_sets: One list of (destination scoped) dedup keys per file
+            ttl: Seconds after which a claim lapses if never released
+
+        Returns:
+            list: True for each key set claimed in full, False if any of
+            its keys is held by someone else (nothing is held for it then)
+        """
+        raise NotImplementedError
+
+    async def release(self, keys):
+        """
+        Release claimed keys
+
+        Args:
+            keys: Keys returned to the pool, from any number of claims
+        """
+        raise NotImplementedError
+
+    async def files_forwarded(self, checks):
+        """
+        Check several files against the forwarded set
+
+        Args:
+            checks: (record, dest_chat_id) tuples; a dest_chat_id of None
+                asks whether the file reached any destination
+
+        Returns:
+            list: True for each file already forwarded
+        """
+        raise NotImplementedError
+
+    async def is_file_forwarded(self, dest_chat_id=None, **identity):
+        """
+        Check one file against the forwarded set
+
+        Args:
+            dest_chat_id: Destination to check, None for any
+            **identity: Audio record fields (see dedup.audio_record)
+
+        Returns:
+            bool: True if the file was forwarded
+        """
+        return (await self.files_forwarded([(identity, dest_chat_id)]))[0]
+
+    async def save_forwarded_files(self, records, dest_chat_id=None):
+        """
+        Record forwarded files and mark their outbox intents done
+
+        Args:
+            records: Audio records with the message_id in the destination
+            dest_chat_id: Destination the files reached
+        """
+        raise NotImplementedError
+
+    async def record_group_messages(self, records):
+        """Journal audio messages seen in a source chat"""
+        raise NotImplementedError
+
+    async def get_unforwarded_messages(self, since):
+        """List journaled messages received after since that were never forwarded"""
+        raise NotImplementedError
+
+    async def prune_group_messages(self, before):
+        """Delete journal entries received before a cutoff"""
+        raise NotImplementedError
+
+    async def get_forwarded_count(self):
+        """Return the number of distinct files forwarded"""
+        raise NotImplementedError
+
+    async def get_last_forwarded_date(self):
+        """Return when the last file was forwarded, or "N/A" """
+        raise NotImplementedError
+
+    async def get_update_offset(self):
+        """Return the ID of the last fully processed update, or 0"""
+        raise NotImplementedError
+
+    async def save_update_offset(self, update_id):
+        """Record the ID of the last fully processed update"""
+        raise NotImplementedError
+
+    async def refresh(self):
+        """Pick up state other instances wrote since the last call, before taking over their work"""
+
+    async def acquire_lease(self, name, owner, ttl):
+        """
+        Take or renew a named lease
+
+        Args:
+            name: Lease name
+            owner: Unique ID of the caller
+            ttl: Seconds the lease is held from now
+
+        Returns:
+            bool: True if owner holds the lease
+        """
+        raise NotImplementedError
+
+    async def release_lease(self, name, owner):
+        """Give up a lease held by owner"""
+        raise NotImplementedError
+
+    async def flush(self):
+        """Write out anything buffered"""
+
+    async def close(self):
+        """Release connections"""
+
+class SQLiteBackend(StorageBackend):
+    """
+    Backend on the local SQLite database
+
+    Claims are held in memory, which covers every worker of this process
+    but not other instances.
+    """
+
+    def __init__(self, database=async_db):
+        """
+        Initialize the backend
+
+        Args:
+            database: AsyncDatabase to use
+        """
+        self.db = database
+        self.claims = set()
+
+    async def claim(self, key_sets, ttl=STORAGE_CLAIM_TTL):
+        granted = []
+        for keys in key_sets:
+            ok = not self.claims.intersection(keys)
+            if ok:
+                self.claims.update(keys)
+            granted.append(ok)
+        return granted
+
+    async def release(self, keys):
+        self.claims.difference_update(keys)
+
+    async def files_forwarded(self, checks):
+        return [await self.db.is_file_forwarded(dest_chat_id=dest_chat_id, **record) for record, dest_chat_id in checks]
+
+    async def save_forwarded_files(self, records, dest_chat_id=None):
+        await self.db.save_forwarded_files(records, dest_chat_id)
+
+    async def record_group_messages(self, records):
+        await self.db.record_group_messages(records)
+
+    async def get_unforwarded_messages(self, since):
+        return await self.db.get_unforwarded_messages(since)
+
+    async def prune_group_messages(self, before):
+        await self.db.prune_group_messages(before)
+
+    async def get_forwarded_count(self):
+        return await self.db.get_forwarded_count()
+
+    async def get_last_forwarded_date(self):
+        return await self.db.get_last_forwarded_date()
+
+    async def get_update_offset(self):
+        return await self.db.get_update_offset()
+
+    async def save_update_offset(self, update_id):
+        await self.db.save_update_offset(update_id)
+
+    async def refresh(self):
+        await self.db.catch_up()
+
+    async def acquire_lease(self, name, owner, ttl):
+        return await self.db.acquire_lease(name, owner, ttl)
+
+    async def release_lease(self, name, owner):
+        await self.db.release_lease(name, owner)
+
+    async def flush(self):
+        await self.db.flush()
+
+    async def close(self):
+        self.db.close()
+
+class RespError(Exception):
+    """Error reply from a Redis protocol server"""
+
+def _encode_command(args):
+    """Encode one command as a RESP array of bulk strings"""
+    parts = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+        parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+    return b"".join(parts)
+
+async def _read_reply(reader):
+    """Read one RESP reply; error replies are returned as RespError instances"""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by server")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload.decode("utf-8")
+    if kind == b"-":
+        return RespError(payload.decode("utf-8"))
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        length = int(payload)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2].decode("utf-8")
+    if kind == b"*":
+        length = int(payload)
+        if length < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(length)]
+    raise ConnectionError(f"Unexpected reply from server: {line!r}")
+
+class RespClient:
+    """
+    Minimal asyncio client for the Redis protocol
+
+    One connection is shared by all callers; each pipeline writes all its
+    commands at once and then reads the replies, so a batch costs a single
+    round trip. The connection is reopened once if it dropped.
+    """
+
+    def __init__(self, url=REDIS_URL, timeout=REDIS_TIMEOUT):
+        """
+        Initialize the client (connects on first use)
+
+        Args:
+            url: redis://[:password@]host[:port][/db]
+            timeout: Seconds to wait for a reply
+        """
+        parts = urlsplit(url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 6379
+        self.password = parts.password
+        self.db = int(parts.path.strip("/") or 0)
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.lock = asyncio.Lock()
+
+    async def _connect(self):
+        """Open the connection and authenticate"""
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        if setup:
+            for reply in await self._roundtrip(setup):
+                if isinstance(reply, RespError):
+                    raise reply
+
+    async def _roundtrip(self, commands):
+        """Send commands and read their replies on the open connection"""
+        self.writer.write(b"".join(_encode_command(command) for command in commands))
+        await self.writer.drain()
+        return [await asyncio.wait_for(_read_reply(self.reader), self.timeout) for _ in commands]
+
+    async def pipeline(self, commands):
+        """
+        Run several commands in one round trip
+
+        Args:
+            commands: Sequence of argument tuples, e.g. [("GET", "k"), ("DEL", "k")]
+
+        Returns:
+            list: One reply per command
+
+        Raises:
+            RespError: If any command failed
+        """
+        if not commands:
+            return []
+        async with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.writer is None:
+                        await self._connect()
+                    replies = await self._roundtrip(commands)
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                    await self._close_connection()
+                    if attempt:
+                        raise ConnectionError(f"Storage server unreachable: {e}") from e
+                    logger.warning(f"Storage connection lost, reconnecting: {e}")
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    async def execute(self, *args):
+        """Run one command and return its reply"""
+        return (await self.pipeline([args]))[0]
+
+    async def _close_connection(self):
+        if self.writer:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+
+    async def close(self):
+        """Close the connection"""
+        async with self.lock:
+            await self._close_connection()
+
+@perf.instrument
+class RedisBackend(StorageBackend):
+    """
+    Backend on a shared Redis protocol server
+
+    Layout (all names under the configured prefix):
+        dedup:<key>     Identity keys of forwarded files, plain and scoped
+                        to each destination, as in the SQLite index
+        claim:<key>     Claims of files being forwarded, with a TTL
+        dest:<file>     Hash of destination -> message ID in that destination,
+                        per file_unique_id (file_id if unknown)
+        file_keys       Set of the file_id and file_unique_id of every
+                        forwarded file
+        forwarded_count Files forwarded, counted as in SQLite: a file is new
+                        unless its file_id or file_unique_id is in file_keys
+        last_forward    Time of the last forward
+        journal         Sorted set of journaled records scored by receive time
+        update_offset   Last processed update ID
+        lease:<name>    Owner of a lease, expiring with it
+        imported        Set once local history has been copied in
+
+    Forwarded files are also written through to the local database, so
+    switching back to SQLite keeps the history.
+    """
+
+    def __init__(self, client=None, prefix=STORAGE_PREFIX, database=async_db):
+        """
+        Initialize the backend
+
+        Args:
+            client: RespClient, a new one for REDIS_URL if None
+            prefix: Prepended to every key so deployments can share a server
+            database: AsyncDatabase holding the local outbox and history
+        """
+        self.client = client or RespClient()
+        self.prefix = prefix
+        self.db = database
+        self.owner = uuid.uuid4().hex
+        self.claims = {}
+
+    def _key(self, name):
+        return f"{self.prefix}{name}"
+
+    async def claim(self, key_sets, ttl=STORAGE_CLAIM_TTL):
+        # A token per call: a pipeline resent after a timeout finds its own
+        # claims and counts them as granted, while two workers of this
+        # process still cannot both claim a file
+        token = f"{self.owner}:{uuid.uuid4().hex[:8]}"
+        commands = []
+        for keys in key_sets:
+            for key in keys:
+                commands.append(("SET", self._key(f"claim:{key}"), token, "NX", "PX", int(ttl * 1000)))
+                commands.append(("GET", self._key(f"claim:{key}")))
+        replies = iter(await self.client.pipeline(commands))
+        granted = []
+        partial = []
+        for keys in key_sets:
+            held = []
+            for key in keys:
+                next(replies)
+                if next(replies) == token:
+                    held.append(key)
+                    self.claims[key] = token
+            granted.append(len(held) == len(keys))
+            if len(held) != len(keys):
+                partial.extend(held)
+        # Give back what was taken for files that could not be claimed in full
+        await self.release(partial)
+        return granted
+
+    async def release(self, keys):
+        held = [(key, self.claims.pop(key)) for key in keys if key in self.claims]
+        if held:
+            # Only delete claims still ours; one that lapsed may belong to someone else now
+            await self.client.execute(
+                "EVAL", COMPARE_AND_DELETE, len(held),
+                *(self._key(f"claim:{key}") for key, _ in held), *(token for _, token in held)
+            )
+
+    @staticmethod
+    def _record_keys(record):
+        signature = metadata_signature(
+            record.get('duration'), record.get('file_size'), record.get('performer', ""), record.get('title', "")
+        )
+        return dedup_keys(signature=signature, **record)
+
+    async def files_forwarded(self, checks):
+        commands = []
+        for record, dest_chat_id in checks:
+            keys = self._record_keys(record)
+            if dest_chat_id is not None:
+                keys = scoped_keys(keys, dest_chat_id) + scoped_keys(keys, ANY_DESTINATION)
+            commands.append(("EXISTS", *(self._key(f"dedup:{key}") for key in keys)))
+        return [count > 0 for count in await self.client.pipeline(commands)]
+
+    async def _store_files(self, records, dest_chat_id, last_forward=None):
+        """
+        Write forwarded files to the server
+
+        Args:
+            records: Audio records with the message_id in the destination
+            dest_chat_id: Destination the files reached, or None
+            last_forward: Time of the forward; left alone if None
+        """
+        commands = []
+        for record in records:
+            keys = self._record_keys(record)
+            keys = keys + scoped_keys(keys, ANY_DESTINATION if dest_chat_id is None else dest_chat_id)
+            commands.append(("MSET", *(item for key in keys for item in (self._key(f"dedup:{key}"), 1))))
+            # One SADD per identifier, so the replies tell whether any was known
+            commands.append(("SADD", self._key("file_keys"), f"id:{record['file_id']}"))
+            if record.get('file_unique_id'):
+                commands.append(("SADD", self._key("file_keys"), f"uid:{record['file_unique_id']}"))
+            if dest_chat_id is not None:
+                commands.append(("HSET", self._key(f"dest:{record.get('file_unique_id') or record['file_id']}"),
+                                 dest_chat_id, record.get('message_id', 0)))
+        if last_forward is not None:
+            commands.append(("SET", self._key("last_forward"), last_forward))
+        replies = iter(await self.client.pipeline(commands))
+        new_files = 0
+        for record in records:
+            next(replies)
+            added = [next(replies)]
+            if record.get('file_unique_id'):
+                added.append(next(replies))
+            new_files += all(added)
+            if dest_chat_id is not None:
+                next(replies)
+        if new_files:
+            await self.client.execute("INCRBY", self._key("forwarded_count"), new_files)
+
+    async def save_forwarded_files(self, records, dest_chat_id=None):
+        await self._store_files(records, dest_chat_id, last_forward=str(datetime.now()))
+        # Write through, which also marks the outbox intents done
+        await self.db.save_forwarded_files(records, dest_chat_id)
+
+    async def prepare(self):
+        if await self.client.execute("EXISTS", self._key("imported")):
+            return
+        await self.import_local()
+        await self.client.execute("SET", self._key("imported"), self.owner)
+
+    async def import_local(self, page_size=1000):
+        """
+        Copy the local database's forwarded files into the server
+
+        Files already on the server are not counted again, so importing
+        twice, or from several instances, is safe.
+
+        Args:
+            page_size: Files read per page
+
+        Returns:
+            int: Number of local files read
+        """
+        imported = 0
+        after = 0
+        while True:
+            rows = await self.db.get_forwarded_files(after, page_size)
+            if not rows:
+                break
+            by_destination = {}
+            for rowid, record, dest_chat_id in rows:
+                by_destination.setdefault(dest_chat_id, []).append(record)
+                if rowid != after:
+                    imported += 1
+                    after = rowid
+            for dest_chat_id, records in by_destination.items():
+                await self._store_files(records, dest_chat_id)
+        last_forward = await self.db.get_last_forwarded_date()
+        commands = [("SET", self._key("update_offset"), await self.db.get_update_offset(), "NX")]
+        if last_forward != "N/A":
+            commands.append(("SET", self._key("last_forward"), last_forward, "NX"))
+        await self.client.pipeline(commands)
+        logger.info(f"Imported {imported} forwarded files from the local database")
+        return imported
+
+    async def record_group_messages(self, records):
+        score = time.time()
+        await self.client.pipeline([
+            ("ZADD", self._key("journal"), score, json.dumps(record, sort_keys=True)) for record in records
+        ])
+
+    async def get_unforwarded_messages(self, since):
+        members = await self.client.execute("ZRANGEBYSCORE", self._key("journal"), since.timestamp(), "+inf")
+        records = {}
+        for member in members:
+            record = json.loads(member)
+            records[(record['source_chat_id'], record['source_message_id'])] = record
+        records = [records[key] for key in sorted(records)]
+        forwarded = await self.files_forwarded([(record, None) for record in records])
+        return [record for record, done in zip(records, forwarded) if not done]
+
+    async def prune_group_messages(self, before):
+        await self.client.execute("ZREMRANGEBYSCORE", self._key("journal"), "-inf", f"({before.timestamp()}")
+
+    async def get_forwarded_count(self):
+        return int(await self.client.execute("GET", self._key("forwarded_count")) or 0)
+
+    async def get_last_forwarded_date(self):
+        return await self.client.execute("GET", self._key("last_forward")) or "N/A"
+
+    async def get_update_offset(self):
+        return int(await self.client.execute("GET", self._key("update_offset")) or 0)
+
+    async def save_update_offset(self, update_id):
+        await self.client.execute("SET", self._key("update_offset"), update_id)
+
+    async def acquire_lease(self, name, owner, ttl):
+        # Check and take or extend in one step, so a lease that lapsed and
+        # went to another instance is never extended for the old owner
+        key = self._key(f"lease:{name}")
+        return await self.client.execute("EVAL", ACQUIRE_LEASE, 1, key, owner, int(ttl * 1000)) == 1
+
+    async def release_lease(self, name, owner):
+        await self.client.execute("EVAL", COMPARE_AND_DELETE, 1, self._key(f"lease:{name}"), owner)
+
+    async def flush(self):
+        await self.db.flush()
+
+    async def close(self):
+        await self.client.close()
+        self.db.close()
+
+class _HashMap(dict):
+    """Hash value in RespServer"""
+
+class _ScoreMap(dict):
+    """Sorted set value in RespServer, member -> score"""
+
+class RespServer:
+    """
+    In-memory stand-in for a Redis server, for local testing
+
+    Implements the commands RedisBackend uses, with pipelining and key
+    expiry. EVAL runs only the scripts RedisBackend sends, each mirrored by
+    a Python method. Data is lost when the server stops.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        """
+        Initialize the server (nothing listens until start())
+
+        Args:
+            host: Interface to bind
+            port: TCP port to bind, 0 picks a free one
+        """
+        self.host = host
+        self.port = port
+        self.data = {}
+        self.expires = {}
+        self.server = None
+        self.writers = set()
+
+    @property
+    def url(self):
+        """redis:// URL of the running server"""
+        return f"redis://{self.host}:{self.port}/0"
+
+    async def start(self):
+        """Start listening"""
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"Storage stand-in listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        """Stop listening and drop the connections"""
+        if self.server:
+            self.server.close()
+            for writer in list(self.writers):
+                writer.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    def _get(self, key, kind=None):
+        """Return a live value, dropping it if it expired"""
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        value = self.data.get(key)
+        if value is not None and kind is not None and not isinstance(value, kind):
+            raise RespError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _execute(self, args):
+        """Run one command and return its reply"""
+        command = args[0].upper()
+        if command == "PING":
+            return "PONG"
+        if command in ("SELECT", "AUTH"):
+            return "OK"
+        if command == "GET":
+            return self._get(args[1], str)
+        if command == "SET":
+            key, value, options = args[1], args[2], [arg.upper() for arg in args[3:]]
+            if "NX" in options and self._get(key) is not None:
+                return None
+            self.data[key] = value
+            self.expires.pop(key, None)
+            if "PX" in options:
+                self.expires[key] = time.monotonic() + int(args[3 + options.index("PX") + 1]) / 1000
+            elif "EX" in options:
+                self.expires[key] = time.monotonic() + int(args[3 + options.index("EX") + 1])
+            return "OK"
+        if command == "MSET":
+            for key, value in zip(args[1::2], args[2::2]):
+                self.data[key] = value
+                self.expires.pop(key, None)
+            return "OK"
+        if command == "INCRBY":
+            value = int(self._get(args[1], str) or 0) + int(args[2])
+            self.data[args[1]] = str(value)
+            return value
+        if command == "DEL":
+            removed = 0
+            for key in args[1:]:
+                removed += self._get(key) is not None
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+            return removed
+        if command == "EXISTS":
+            return sum(self._get(key) is not None for key in args[1:])
+        if command == "PEXPIRE":
+            if self._get(args[1]) is None:
+                return 0
+            self.expires[args[1]] = time.monotonic() + int(args[2]) / 1000
+            return 1
+        if command == "KEYS":
+            return [key for key in list(self.data) if self._get(key) is not None and fnmatch.fnmatchcase(key, args[1])]
+        if command == "SADD":
+            members = self._get(args[1], set)
+            if members is None:
+                members = self.data[args[1]] = set()
+            added = len(set(args[2:]) - members)
+            members.update(args[2:])
+            return added
+        if command == "SCARD":
+            return len(self._get(args[1], set) or ())
+        if command == "HSET":
+            fields = self._get(args[1], _HashMap)
+            if fields is None:
+                fields = self.data[args[1]] = _HashMap()
+            added = len(set(args[2::2]) - set(fields))
+            fields.update(zip(args[2::2], args[3::2]))
+            return added
+        if command == "HGETALL":
+            return [item for pair in (self._get(args[1], _HashMap) or {}).items() for item in pair]
+        if command == "ZADD":
+            scores = self._get(args[1], _ScoreMap)
+            if scores is None:
+                scores = self.data[args[1]] = _ScoreMap()
+            added = 0
+            for score, member in zip(args[2::2], args[3::2]):
+                added += member not in scores
+                scores[member] = float(score)
+            return added
+        if command in ("ZRANGEBYSCORE", "ZREMRANGEBYSCORE"):
+            scores = self._get(args[1], _ScoreMap) or {}
+            low, high = _score_bound(args[2]), _score_bound(args[3])
+            members = sorted(
+                (score, member) for member, score in scores.items()
+                if (score > low[0] if low[1] else score >= low[0]) and (score < high[0] if high[1] else score <= high[0])
+            )
+            if command == "ZRANGEBYSCORE":
+                return [member for _, member in members]
+            for _, member in members:
+                del scores[member]
+            return len(members)
+        if command == "EVAL":
+            script = self._scripts().get(args[1])
+            if script is None:
+                return RespError("NOSCRIPT Script not supported by the stand-in")
+            count = int(args[2])
+            return script(args[3:3 + count], args[3 + count:])
+        if command == "FLUSHALL":
+            self.data.clear()
+            self.expires.clear()
+            return "OK"
+        return RespError(f"ERR unknown command '{args[0]}'")
+
+    def _scripts(self):
+        """Scripts understood by EVAL, by source text"""
+        return {COMPARE_AND_DELETE: self._compare_and_delete, ACQUIRE_LEASE: self._acquire_lease}
+
+    def _compare_and_delete(self, keys, argv):
+        removed = 0
+        for key, expected in zip(keys, argv):
+            if self._get(key) == expected:
+                removed += self._execute(["DEL", key])
+        return removed
+
+    def _acquire_lease(self, keys, argv):
+        holder = self._get(keys[0])
+        if holder is None:
+            self._execute(["SET", keys[0], argv[0], "PX", argv[1]])
+            return 1
+        if holder == argv[0]:
+            return self._execute(["PEXPIRE", keys[0], argv[1]])
+        return 0
+
+    @staticmethod
+    def _encode_reply(reply):
+        if isinstance(reply, RespError):
+            return f"-{reply}\r\n".encode("utf-8")
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, bool) or isinstance(reply, int):
+            return f":{int(reply)}\r\n".encode()
+        if isinstance(reply, list):
+            return f"*{len(reply)}\r\n".encode() + b"".join(RespServer._encode_reply(item) for item in reply)
+        if reply in ("OK", "PONG"):
+            return f"+{reply}\r\n".encode()
+        data = str(reply).encode("utf-8")
+        return f"${len(data)}\r\n".encode() + data + b"\r\n"
+
+    async def _handle_connection(self, reader, writer):
+        """Serve pipelined commands on one connection until the client closes it"""
+        self.writers.add(writer)
+        try:
+            while True:
+                try:
+                    args = await _read_reply(reader)
+                except ConnectionError:
+                    break
+                if not isinstance(args, list) or not args:
+                    writer.write(self._encode_reply(RespError("ERR protocol error")))
+                    break
+                try:
+                    reply = self._execute([str(arg) for arg in args])
+                except (RespError, IndexError, ValueError) as e:
+                    reply = e if isinstance(e, RespError) else RespError(f"ERR {e}")
+                writer.write(self._encode_reply(reply))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logger.debug(f"Storage stand-in connection error: {e}")
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+def _score_bound(text):
+    """Parse a sorted set bound into (value, exclusive)"""
+    exclusive = text.startswith("(")
+    return float(text.lstrip("(")), exclusive
+
+def create_backend(kind=STORAGE_BACKEND):
+    """
+    Create the configured storage backend
+
+    Args:
+        kind: 'sqlite' or 'redis'
+
+    Returns:
+        StorageBackend: The backend
+    """
+    if kind == 'redis':
+        logger.info(f"Using shared storage at {urlsplit(REDIS_URL).hostname}")
+        return RedisBackend()
+    if kind != 'sqlite':
+        raise ValueError(f"Unknown STORAGE_BACKEND: {kind}")
+    return SQLiteBackend()
+
+# Create singleton instance for use throughout the app
+store = create_backend()
+
+async def _import():
+    """Copy the local history into the configured redis backend"""
+    if not isinstance(store, RedisBackend):
+        raise SystemExit("STORAGE_BACKEND is not redis; nothing to import into")
+    try:
+        count = await store.import_local()
+        await store.client.execute("SET", store._key("imported"), store.owner)
+        print(f"Imported {count} forwarded files")
+    finally:
+        await store.close()
+
+async def _serve(host, port):
+    """Run the stand-in server until interrupted"""
+    server = RespServer(host, port)
+    await server.start()
+    print(f"Listening on {server.url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Storage backend tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="run an in-memory Redis stand-in")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=6379)
+    commands.add_parser("import", help="copy the local database's forwarded files into the redis backend")
+    args = parser.parse_args()
+    if args.command == "import":
+        asyncio.run(_import())
+    else:
+        try:
+            asyncio.run(_serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,17 @@
+"""
+Shared setup for the AfsanehBayebot tests
+Points the database, and the logs and data directories created relative to
+the working directory, at a scratch directory before any bot module is imported
+"""
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH = tempfile.mkdtemp(prefix="afsaneh-tests-")
+
+os.environ["DATABASE_PATH"] = os.path.join(SCRATCH, "forwarded_files.db")
+os.environ.setdefault("DB_DURABILITY", "buffered")
+sys.path.insert(0, ROOT)
+os.chdir(SCRATCH)
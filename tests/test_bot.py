@@ -0,0 +1,84 @@
+"""
+Tests for the bot module's shutdown
+"""
+
+import asyncio
+
+import bot
+from lease import Lease
+from test_lease import LeaseStore
+
+class DrainingPipeline:
+    """Forward pipeline whose drain takes a while, noting whether forwarding stayed permitted"""
+
+    def __init__(self, lease, seconds, left=0):
+        self.lease = lease
+        self.seconds = seconds
+        self.left = left
+        self.permitted = []
+        self.timeout = None
+        self.stopped = False
+
+    async def drain(self, timeout):
+        self.timeout = timeout
+        deadline = asyncio.get_running_loop().time() + min(self.seconds, timeout)
+        while asyncio.get_running_loop().time() < deadline:
+            self.permitted.append(self.lease.permits_forwarding)
+            await asyncio.sleep(0.05)
+        return self.left
+
+    async def stop(self):
+        self.stopped = True
+
+class ClosingStore:
+    """Records the flush and close at the end of shutdown"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def flush(self):
+        self.calls.append("flush")
+
+    async def close(self):
+        self.calls.append("close")
+
+class Groups:
+    async def flush(self):
+        pass
+
+class Metrics:
+    async def stop(self):
+        pass
+
+def shut_down(monkeypatch, drain_seconds, timeout, left=0):
+    """Run bot.shutdown with a lease held and a pipeline taking drain_seconds to drain"""
+    backend = LeaseStore()
+    lease = Lease(backend, ttl=0.2, heartbeat=0.05)
+    pipeline = DrainingPipeline(lease, drain_seconds, left)
+    store = ClosingStore()
+    monkeypatch.setattr(bot, "forwarder_lease", lease)
+    monkeypatch.setattr(bot, "forward_pipeline", pipeline)
+    monkeypatch.setattr(bot, "media_groups", Groups())
+    monkeypatch.setattr(bot, "metrics_server", Metrics())
+    monkeypatch.setattr(bot, "store", store)
+
+    async def main():
+        assert await lease.wait(asyncio.Event())
+        await bot.shutdown(None, timeout=timeout)
+    asyncio.run(main())
+    return backend, pipeline, store
+
+def test_lease_outlives_a_drain_longer_than_its_ttl(monkeypatch):
+    backend, pipeline, store = shut_down(monkeypatch, drain_seconds=0.6, timeout=1)
+    assert len(pipeline.permitted) > 5 and all(pipeline.permitted)
+    # Released once draining ends, then the database is flushed and closed
+    assert backend.leases == {}
+    assert pipeline.stopped
+    assert store.calls == ["flush", "close"]
+
+def test_drain_stops_at_the_timeout(monkeypatch):
+    backend, pipeline, store = shut_down(monkeypatch, drain_seconds=5, timeout=0.3, left=2)
+    assert pipeline.timeout <= 0.3
+    assert len(pipeline.permitted) < 10
+    assert backend.leases == {}
+    assert store.calls == ["flush", "close"]
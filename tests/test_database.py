@@ -0,0 +1,278 @@
+"""
+Tests for the database module
+Each test opens its own Database in the scratch directory
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import dedup
+from conftest import SCRATCH
+from database import Database, MIGRATIONS, OUTBOX_PENDING, OUTBOX_IN_FLIGHT, OUTBOX_DONE, OUTBOX_FAILED
+
+def database_path():
+    """Return a fresh database path in the scratch directory"""
+    return os.path.join(tempfile.mkdtemp(dir=SCRATCH), "forwarded_files.db")
+
+def test_opens_in_wal_mode():
+    db = Database(database_path())
+    try:
+        with db.pool.reader() as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    finally:
+        db.close()
+
+def test_migrates_legacy_database():
+    path = database_path()
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE forwarded_files (file_id TEXT PRIMARY KEY, file_name TEXT, performer TEXT, "
+        "title TEXT, forward_date TIMESTAMP, message_id INTEGER)"
+    )
+    conn.execute("INSERT INTO forwarded_files VALUES ('legacy', 'a.mp3', '', '', '2024-01-01 00:00:00', 5)")
+    conn.commit()
+    conn.close()
+
+    db = Database(path)
+    try:
+        with db.pool.reader() as conn:
+            assert conn.execute("PRAGMA user_version").fetchone()[0] == len(MIGRATIONS)
+        # Rows saved before the migrations still count as forwarded
+        assert db.is_file_forwarded(file_id="legacy")
+        assert db.get_forwarded_count() == 1
+    finally:
+        db.close()
+
+    # Reopening a migrated database applies nothing again
+    db = Database(path)
+    try:
+        assert db.get_forwarded_count() == 1
+    finally:
+        db.close()
+
+def test_reader_connections_are_read_only():
+    db = Database(database_path())
+    try:
+        with db.pool.reader() as conn:
+            try:
+                conn.execute("DELETE FROM forwarded_files")
+            except sqlite3.Error:
+                pass
+            else:
+                raise AssertionError("reader connection accepted a write")
+    finally:
+        db.close()
+
+def test_dedup_index_is_warmed_from_saved_files():
+    path = database_path()
+    db = Database(path)
+    try:
+        db.save_forwarded_file("f1", file_unique_id="u1", source_chat_id=-1, source_message_id=1)
+    finally:
+        db.close()
+
+    db = Database(path)
+    try:
+        assert db.lookup_forwarded(file_id="f1", file_unique_id="u1") == (True, [])
+        # A new file is ruled out by the Bloom filter without a query
+        assert db.lookup_forwarded(file_id="f2", file_unique_id="u2") == (False, [])
+        assert db.is_file_forwarded(file_id="other", source_chat_id=-1, source_message_id=1)
+        assert not db.is_file_forwarded(file_id="f2", file_unique_id="u2")
+    finally:
+        db.close()
+
+def count_rows(pool, table):
+    """Return the number of committed rows in a table"""
+    with pool.reader() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+def test_write_behind_commits_a_lone_write_after_the_interval():
+    db = Database(database_path())
+    try:
+        db.writes.max_delay = 0.05
+        db.save_forwarded_file("f1", file_unique_id="u1")
+        time.sleep(0.5)
+        assert db.writes.pending() == 0
+        assert count_rows(db.pool, "forwarded_files") == 1
+    finally:
+        db.close()
+
+def test_write_behind_commits_a_full_batch_at_once():
+    db = Database(database_path())
+    try:
+        db.writes.max_delay = 60
+        db.writes.max_rows = 4
+        # Two statements per file, so two files fill the batch
+        db.save_forwarded_file("f1", file_unique_id="u1")
+        db.save_forwarded_file("f2", file_unique_id="u2")
+        time.sleep(0.5)
+        assert count_rows(db.pool, "forwarded_files") == 2
+    finally:
+        db.close()
+
+def test_write_behind_flushes_on_close():
+    path = database_path()
+    db = Database(path)
+    db.writes.max_delay = 60
+    db.save_forwarded_file("f1", file_unique_id="u1")
+    assert db.writes.pending() > 0
+    db.close()
+
+    db = Database(path)
+    try:
+        assert db.get_forwarded_count() == 1
+        assert db.is_file_forwarded(file_id="f1")
+    finally:
+        db.close()
+
+def test_sync_durability_commits_every_write():
+    db = Database(database_path(), durability="sync")
+    try:
+        assert db.writes is None
+        db.save_forwarded_file("f1", file_unique_id="u1")
+        assert count_rows(db.pool, "forwarded_files") == 1
+    finally:
+        db.close()
+
+def outbox_states(path):
+    """Read the committed outbox states with a separate connection"""
+    conn = sqlite3.connect(path)
+    try:
+        return dict(((chat, message, dest), (state, attempts)) for chat, message, dest, state, attempts in conn.execute(
+            "SELECT source_chat_id, source_message_id, dest_chat_id, state, attempts FROM forward_outbox"
+        ))
+    finally:
+        conn.close()
+
+def test_outbox_lists_unfinished_intents():
+    db = Database(database_path())
+    try:
+        records = [{'file_id': f"f{index}", 'source_chat_id': -1, 'source_message_id': index} for index in (1, 2, 3)]
+        db.add_outbox_intents(records, 10)
+        db.mark_outbox(records[:1], 10, OUTBOX_IN_FLIGHT)
+        db.mark_outbox(records[1:2], 10, OUTBOX_DONE)
+        db.mark_outbox(records[2:], 10, OUTBOX_FAILED)
+        intents = db.get_outbox_intents(max_attempts=5)
+        assert [(dest, record['source_message_id']) for dest, record in intents] == [(10, 1), (10, 3)]
+        # Failed intents are given up once they used their attempts
+        assert [record['source_message_id'] for _, record in db.get_outbox_intents(max_attempts=0)] == [1]
+    finally:
+        db.close()
+
+def test_outbox_done_is_final():
+    db = Database(database_path())
+    try:
+        record = {'file_id': "f1", 'source_chat_id': -1, 'source_message_id': 1}
+        db.add_outbox_intents([record], 10)
+        db.mark_outbox([record], 10, OUTBOX_DONE)
+        db.add_outbox_intents([record], 10)
+        db.mark_outbox([record], 10, OUTBOX_FAILED)
+        assert db.get_outbox_intents(max_attempts=5) == []
+        db.prune_outbox(datetime.now() + timedelta(seconds=1))
+        db.flush()
+        assert count_rows(db.pool, "forward_outbox") == 0
+    finally:
+        db.close()
+
+def test_outbox_intents_and_completions_are_committed_immediately():
+    path = database_path()
+    db = Database(path)
+    try:
+        db.writes.max_delay = 60
+        record = {'file_id': "f1", 'file_unique_id': "u1", 'source_chat_id': -1, 'source_message_id': 1}
+        db.add_outbox_intents([record], 10)
+        assert outbox_states(path) == {(-1, 1, 10): (OUTBOX_PENDING, 0)}
+        db.save_forwarded_files([dict(record, message_id=5)], dest_chat_id=10)
+        # Nothing waits in the buffer that a crash could lose
+        assert db.writes.pending() == 0
+        assert outbox_states(path) == {(-1, 1, 10): (OUTBOX_DONE, 0)}
+        assert count_rows(db.pool, "forward_destinations") == 1
+    finally:
+        db.close()
+
+def test_content_aware_dedup(monkeypatch):
+    monkeypatch.setattr(dedup, "DEDUP_MATCH_SIGNATURE", True)
+    db = Database(database_path())
+    try:
+        db.save_forwarded_file("f1", file_unique_id="u1", source_chat_id=-1, source_message_id=1,
+                               duration=180, file_size=1000, performer="Performer", title="Title")
+        db.save_forwarded_file("f2", file_unique_id="u2", source_chat_id=-1, source_message_id=2,
+                               duration=200, file_size=2000)
+        # A new file_id for the same content, or the same source message, is a duplicate
+        assert db.is_file_forwarded(file_id="new", file_unique_id="u1")
+        assert db.is_file_forwarded(file_id="new", source_chat_id=-1, source_message_id=1)
+        # Same tags, length and size
+        assert db.is_file_forwarded(file_id="new", file_unique_id="new", duration=180, file_size=1000,
+                                    performer="performer", title="title")
+        # An untagged file only matching length and size is a different track
+        assert not db.is_file_forwarded(file_id="new", file_unique_id="new", duration=200, file_size=2000)
+    finally:
+        db.close()
+
+def test_deliveries_survive_a_new_file_id_across_restarts():
+    path = database_path()
+    db = Database(path)
+    try:
+        db.save_forwarded_files([{'file_id': "f1", 'file_unique_id': "u", 'source_chat_id': -1, 'source_message_id': 1}],
+                                 dest_chat_id=111)
+        db.save_forwarded_files([{'file_id': "f2", 'file_unique_id': "u", 'source_chat_id': -1, 'source_message_id': 2}],
+                                 dest_chat_id=222)
+    finally:
+        db.close()
+
+    db = Database(path)
+    try:
+        for dest_chat_id in (111, 222):
+            assert db.is_file_forwarded(dest_chat_id=dest_chat_id, file_id="f3", file_unique_id="u")
+            # The same answer from the database when the index cannot decide
+            assert db._query_forwarded([f"{dest_chat_id}|u:u"])
+        assert not db.is_file_forwarded(dest_chat_id=333, file_id="f3", file_unique_id="u")
+    finally:
+        db.close()
+
+def test_legacy_deliveries_follow_a_file_to_its_unique_id():
+    path = database_path()
+    db = Database(path)
+    try:
+        db.save_forwarded_files([{'file_id': "f1", 'source_chat_id': -1, 'source_message_id': 1}], dest_chat_id=111)
+        db.save_forwarded_files([{'file_id': "f1", 'file_unique_id': "u", 'source_chat_id': -1, 'source_message_id': 1}],
+                                 dest_chat_id=222)
+    finally:
+        db.close()
+
+    db = Database(path)
+    try:
+        assert db.is_file_forwarded(dest_chat_id=111, file_id="f9", file_unique_id="u")
+    finally:
+        db.close()
+
+def test_destinations_migrate_to_file_keys():
+    path = database_path()
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE forwarded_files (file_id TEXT PRIMARY KEY, file_name TEXT, performer TEXT, "
+        "title TEXT, forward_date TIMESTAMP, message_id INTEGER)"
+    )
+    # Apply the migrations before the one moving forward_destinations to file keys
+    for statements in MIGRATIONS[:-1]:
+        for sql in statements:
+            conn.execute(sql)
+    conn.execute(f"PRAGMA user_version = {len(MIGRATIONS) - 1}")
+    conn.execute("INSERT INTO forwarded_files (file_id, file_unique_id) VALUES ('f1', 'u1'), ('f2', NULL)")
+    conn.execute("INSERT INTO forward_destinations VALUES ('f1', 111, 5, '2024-01-01'), ('f2', 222, 6, '2024-01-01')")
+    conn.commit()
+    conn.close()
+
+    db = Database(path)
+    try:
+        with db.pool.reader() as conn:
+            rows = conn.execute("SELECT file_key, dest_chat_id, message_id FROM forward_destinations ORDER BY 1")
+            assert rows.fetchall() == [("f2", 222, 6), ("u1", 111, 5)]
+        assert db.is_file_forwarded(dest_chat_id=111, file_id="new", file_unique_id="u1")
+        assert not db.is_file_forwarded(dest_chat_id=222, file_id="new", file_unique_id="u1")
+        assert db.is_file_forwarded(dest_chat_id=222, file_id="f2")
+    finally:
+        db.close()
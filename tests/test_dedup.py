@@ -0,0 +1,71 @@
+"""
+Tests for the dedup module
+"""
+
+import dedup
+from dedup import BloomFilter, DedupIndex, dedup_keys, metadata_signature, scoped_keys
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000, 0.01)
+    keys = [f"u:{index}" for index in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    assert bloom.count == 1000
+
+def test_bloom_filter_false_positive_rate():
+    bloom = BloomFilter(10000, 0.01)
+    for index in range(10000):
+        bloom.add(f"u:{index}")
+    false_positives = sum(f"x:{index}" in bloom for index in range(20000))
+    # Sized for 1% at capacity; allow for variance
+    assert false_positives / 20000 < 0.02
+
+def test_index_answers_from_memory():
+    index = DedupIndex(capacity=100, error_rate=0.01, cache_size=10)
+    assert index.lookup("u:a") is False
+    index.add("u:a")
+    assert index.lookup("u:a") is True
+
+def test_index_defers_evicted_keys_to_the_database():
+    index = DedupIndex(capacity=100, error_rate=0.01, cache_size=2)
+    for key in ("u:a", "u:b", "u:c"):
+        index.add(key)
+    # "u:a" left the LRU but is still in the filter, so only the database can answer
+    assert index.lookup("u:a") is None
+    index.remember("u:a")
+    assert index.lookup("u:a") is True
+
+def test_lookup_any():
+    index = DedupIndex(capacity=100, error_rate=0.01, cache_size=1)
+    assert index.lookup_any(["u:a", "m:1:2"]) == (False, [])
+    index.add("m:1:2")
+    assert index.lookup_any(["u:a", "m:1:2"]) == (True, [])
+    index.add("u:b")
+    assert index.lookup_any(["u:a", "m:1:2"]) == (False, ["m:1:2"])
+
+def test_warm_resizes_and_loads_keys():
+    index = DedupIndex(capacity=10, error_rate=0.01, cache_size=100)
+    index.add("u:stale")
+    index.warm((f"u:{number}" for number in range(50)), total=50)
+    assert index.bloom.capacity >= 100
+    assert all(index.lookup(f"u:{number}") for number in range(50))
+    assert index.lookup("u:stale") is not True
+
+def test_metadata_signature():
+    signature = metadata_signature(180, 1000, " Performer ", "Title")
+    assert signature == metadata_signature(180, 1000, "performer", "title")
+    assert metadata_signature(None, 1000, "Performer", "") is None
+    # Untagged files of the same length and size may be different tracks
+    assert metadata_signature(180, 1000, "", " ") is None
+    assert metadata_signature(180, 1000, "", "Title") is not None
+
+def test_dedup_keys(monkeypatch):
+    signature = metadata_signature(180, 1000, "Performer", "Title")
+    keys = dedup_keys(file_id="f", file_unique_id="u", source_chat_id=-1, source_message_id=2, signature=signature)
+    # Signature matching is opt-in
+    assert keys == ["u:u", "m:-1:2", "f:f"]
+    monkeypatch.setattr(dedup, "DEDUP_MATCH_SIGNATURE", True)
+    keys = dedup_keys(file_id="f", file_unique_id="u", source_chat_id=-1, source_message_id=2, signature=signature)
+    assert keys == ["u:u", "m:-1:2", f"s:{signature}", "f:f"]
+    assert scoped_keys(["u:u"], 10) == ["10|u:u"]
@@ -0,0 +1,84 @@
+"""
+Tests for the handlers module
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from telegram import Update
+
+import handlers
+from handlers import ErrorHandlers, UpdateHandlers
+
+class OffsetStore:
+    """Records the update offsets saved by the handlers"""
+
+    def __init__(self, offset=0):
+        self.offset = offset
+        self.saved = []
+
+    async def get_update_offset(self):
+        return self.offset
+
+    async def save_update_offset(self, update_id):
+        self.saved.append(update_id)
+
+def update(update_id, chat_id=-1):
+    """Build a text message update"""
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "text": "x",
+                    "chat": {"id": chat_id, "type": "supergroup", "title": "t"}},
+    }, None)
+
+def test_offset_is_saved_after_each_update(monkeypatch):
+    store = OffsetStore()
+    monkeypatch.setattr(handlers, "store", store)
+    monkeypatch.setattr(UpdateHandlers, "last_update_id", 0)
+    monkeypatch.setattr(UpdateHandlers, "failed_update_id", None)
+
+    async def main():
+        for update_id in (5, 6, 4):
+            await UpdateHandlers.track_offset(update(update_id), None)
+    asyncio.run(main())
+    assert store.saved == [5, 6]
+
+def test_offset_stays_before_a_failed_update(monkeypatch):
+    store = OffsetStore()
+    monkeypatch.setattr(handlers, "store", store)
+    monkeypatch.setattr(UpdateHandlers, "last_update_id", 0)
+    monkeypatch.setattr(UpdateHandlers, "failed_update_id", None)
+    sent = []
+
+    async def send_message(**kwargs):
+        sent.append(kwargs)
+
+    context = SimpleNamespace(error=RuntimeError("boom"), bot=SimpleNamespace(send_message=send_message))
+
+    async def main():
+        await UpdateHandlers.track_offset(update(1), None)
+        # The error handler runs before the offset handler of the same update
+        await ErrorHandlers.error_handler(update(2), context)
+        await UpdateHandlers.track_offset(update(2), None)
+        await UpdateHandlers.track_offset(update(3), None)
+        # Errors outside updates, e.g. in jobs, do not hold the offset
+        await ErrorHandlers.error_handler(None, context)
+    asyncio.run(main())
+    assert store.saved == [1]
+    assert UpdateHandlers.failed_update_id == 2
+    assert len(sent) == 1
+
+def test_polling_resumes_after_the_saved_offset(monkeypatch):
+    import bot
+    store = OffsetStore(offset=41)
+    monkeypatch.setattr(bot, "store", store)
+    monkeypatch.setattr(UpdateHandlers, "last_update_id", 0)
+    calls = []
+
+    async def get_updates(**kwargs):
+        calls.append(kwargs)
+        return []
+
+    asyncio.run(bot.resume_update_offset(SimpleNamespace(get_updates=get_updates)))
+    assert calls == [{"offset": 42, "limit": 1, "timeout": 0}]
+    assert UpdateHandlers.last_update_id == 41
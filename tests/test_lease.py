@@ -0,0 +1,67 @@
+"""
+Tests for the lease module
+"""
+
+import asyncio
+import time
+
+from lease import Lease
+
+class LeaseStore:
+    """Keeps leases in memory, expiring like the storage backends"""
+
+    def __init__(self):
+        self.leases = {}
+        self.renewals = 0
+
+    async def acquire_lease(self, name, owner, ttl):
+        holder, expires = self.leases.get(name, (None, 0))
+        if holder not in (None, owner) and expires > time.monotonic():
+            return False
+        self.leases[name] = (owner, time.monotonic() + ttl)
+        self.renewals += 1
+        return True
+
+    async def release_lease(self, name, owner):
+        if self.leases.get(name, (None, 0))[0] == owner:
+            del self.leases[name]
+
+def test_lease_lapses_without_renewal():
+    lease = Lease(LeaseStore(), ttl=0.2, heartbeat=0.05)
+
+    async def main():
+        assert await lease.wait(asyncio.Event())
+        assert lease.permits_forwarding
+        await asyncio.sleep(0.3)
+        assert not lease.permits_forwarding
+    asyncio.run(main())
+
+def test_lease_is_kept_while_draining():
+    backend = LeaseStore()
+    lease = Lease(backend, ttl=0.2, heartbeat=0.05)
+    standby = Lease(backend, ttl=0.2, heartbeat=0.05)
+
+    async def drain():
+        # Outlasts the TTL, as a drain with SHUTDOWN_TIMEOUT > LEASE_TTL can
+        await asyncio.sleep(0.5)
+        taken = await backend.acquire_lease("forwarder", standby.owner, 0.2)
+        return lease.permits_forwarding and not taken
+
+    async def main():
+        stop = asyncio.Event()
+        assert await lease.wait(stop)
+        stop.set()
+        assert not await lease.hold(stop)
+        assert await lease.keep_while(drain())
+        await lease.release()
+        assert await standby.wait(asyncio.Event())
+    asyncio.run(main())
+
+def test_keep_while_only_awaits_without_the_lease():
+    backend = LeaseStore()
+    lease = Lease(backend, ttl=0.2, heartbeat=0.05)
+
+    async def main():
+        assert await lease.keep_while(asyncio.sleep(0.15, result=3)) == 3
+    asyncio.run(main())
+    assert backend.renewals == 0
@@ -0,0 +1,59 @@
+"""
+Tests for the perf module
+"""
+
+import asyncio
+import threading
+
+from perf import PerfRecorder
+
+def test_disabled_recorder_leaves_code_unchanged():
+    recorder = PerfRecorder(enabled=False)
+
+    def work():
+        return 1
+
+    assert recorder.timed("work")(work) is work
+    with recorder.span("block"):
+        pass
+    assert recorder.summary() == []
+
+def test_spans_and_instrumented_classes_are_timed():
+    recorder = PerfRecorder(enabled=True, window=10)
+
+    @recorder.instrument
+    class Service:
+        @staticmethod
+        async def fetch():
+            await asyncio.sleep(0.01)
+            return "ok"
+
+        def _helper(self):
+            return "untimed"
+
+    assert asyncio.run(Service.fetch()) == "ok"
+    assert Service()._helper() == "untimed"
+    with recorder.span("block"):
+        pass
+    rows = recorder.summary()
+    assert [row[0] for row in rows] == ["Service.fetch", "block"]
+    name, calls, p50, p95, p99 = rows[0]
+    assert calls == 1 and 0.005 < p50 <= p95 <= p99
+    assert [row[0] for row in recorder.summary("block")] == ["block"]
+    recorder.reset()
+    assert recorder.summary() == []
+
+def test_recording_from_threads_keeps_every_count():
+    recorder = PerfRecorder(enabled=True, window=100)
+
+    def record():
+        for index in range(2000):
+            recorder.record(f"span{index % 4}", 0.001)
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(row[1] for row in recorder.summary()) == [4000] * 4
+    assert all(len(samples) == 100 for samples in recorder.samples.values())
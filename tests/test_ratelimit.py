@@ -0,0 +1,79 @@
+"""
+Tests for the ratelimit module
+"""
+
+import asyncio
+import time
+
+from ratelimit import TokenBucket, ForwardScheduler
+
+def test_bucket_allows_a_burst_then_paces():
+    bucket = TokenBucket(rate=2, capacity=3)
+    now = bucket.updated
+    for _ in range(3):
+        assert bucket.ready_at(now) == now
+        bucket.consume(now)
+    assert abs(bucket.ready_at(now) - (now + 0.5)) < 1e-9
+
+def test_bucket_reservations_queue_in_order():
+    bucket = TokenBucket(rate=10, capacity=1)
+    now = bucket.updated
+    times = []
+    for _ in range(3):
+        when = bucket.ready_at(now)
+        bucket.consume(when)
+        times.append(when - now)
+    assert [round(value, 6) for value in times] == [0, 0.1, 0.2]
+
+def test_bucket_refills_up_to_capacity():
+    bucket = TokenBucket(rate=100, capacity=2)
+    now = bucket.updated
+    bucket.consume(now, 2)
+    assert bucket._tokens_at(now + 10) == 2
+
+def test_bucket_cost_above_capacity_waits_for_a_full_bucket():
+    bucket = TokenBucket(rate=1, capacity=2)
+    now = bucket.updated
+    bucket.consume(now, 2)
+    assert abs(bucket.ready_at(now, cost=5) - (now + 2)) < 1e-9
+
+def test_batch_larger_than_capacity_costs_one_full_bucket():
+    bucket = TokenBucket(rate=20 / 60, capacity=3)
+    now = bucket.updated
+    when = bucket.ready_at(now, cost=100)
+    bucket.consume(when, cost=100)
+    assert when == now and bucket.tokens == 0
+    # The next send waits for one token, not for 97 messages' worth
+    assert abs(bucket.ready_at(now) - (now + 3)) < 1e-9
+
+def test_scheduler_paces_a_chat():
+    async def main():
+        scheduler = ForwardScheduler(global_rate=1000, global_burst=1000, chat_rate=20, chat_burst=2)
+        start = time.monotonic()
+        for _ in range(4):
+            await scheduler.acquire(1)
+        # Two from the burst, then two at 20/s
+        assert 0.08 <= time.monotonic() - start < 0.5
+    asyncio.run(main())
+
+def test_scheduler_keeps_chats_independent():
+    async def main():
+        scheduler = ForwardScheduler(global_rate=1000, global_burst=1000, chat_rate=0.1, chat_burst=1)
+        await scheduler.acquire(1)
+        start = time.monotonic()
+        await asyncio.wait_for(scheduler.acquire(2), 1)
+        assert time.monotonic() - start < 0.1
+    asyncio.run(main())
+
+def test_scheduler_flood_wait_and_chat_limit():
+    async def main():
+        scheduler = ForwardScheduler(global_rate=1000, global_burst=1000, chat_rate=1000, chat_burst=10)
+        scheduler.pause(1, 0.2)
+        start = time.monotonic()
+        await scheduler.acquire(1)
+        assert time.monotonic() - start >= 0.19
+        scheduler.set_chat_limit(2, rate=1000, burst=100)
+        start = time.monotonic()
+        await scheduler.acquire(2, cost=100)
+        assert time.monotonic() - start < 0.1
+    asyncio.run(main())
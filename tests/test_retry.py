@@ -0,0 +1,113 @@
+"""
+Tests for the retry module
+"""
+
+import asyncio
+from datetime import timedelta
+
+import pytest
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+from retry import CircuitBreaker, CircuitOpenError, RetryPolicy, FATAL, FLOOD, TRANSIENT
+
+def failing(errors, result="ok", name="get_me"):
+    """Build an operation that raises the given errors in turn, then returns result"""
+    calls = []
+
+    async def operation(**kwargs):
+        calls.append(kwargs)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    operation.__name__ = name
+    return operation, calls
+
+def test_classify():
+    assert RetryPolicy.classify(RetryAfter(timedelta(seconds=1))) == FLOOD
+    assert RetryPolicy.classify(BadRequest("bad")) == FATAL
+    assert RetryPolicy.classify(TimedOut()) == TRANSIENT
+    assert RetryPolicy.classify(NetworkError("down")) == TRANSIENT
+    assert RetryPolicy.classify(ValueError()) == FATAL
+
+def test_transient_errors_are_retried():
+    policy = RetryPolicy(max_retries=3, base_delay=0.01, max_delay=0.01)
+    operation, calls = failing([NetworkError("down"), TimedOut()])
+    assert asyncio.run(policy.run(operation)) == "ok"
+    assert len(calls) == 3
+
+def test_fatal_errors_are_not_retried():
+    policy = RetryPolicy(max_retries=3, base_delay=0.01, max_delay=0.01)
+    operation, calls = failing([BadRequest("bad")])
+    with pytest.raises(BadRequest):
+        asyncio.run(policy.run(operation))
+    assert len(calls) == 1
+
+def test_flood_wait_is_honoured():
+    policy = RetryPolicy(max_retries=2, base_delay=10, max_delay=10)
+    operation, calls = failing([RetryAfter(timedelta(0))])
+    assert asyncio.run(policy.run(operation, chat_id=1)) == "ok"
+    assert len(calls) == 2
+
+def test_timed_out_sends_are_not_retried():
+    policy = RetryPolicy(max_retries=3, base_delay=0.01, max_delay=0.01)
+    operation, calls = failing([TimedOut()], name="forward_messages")
+    with pytest.raises(TimedOut):
+        asyncio.run(policy.run(operation))
+    assert len(calls) == 1
+
+def test_sends_are_not_retried_after_a_dropped_connection():
+    policy = RetryPolicy(max_retries=3, base_delay=0.01, max_delay=0.01)
+    operation, calls = failing([NetworkError("Connection reset by peer")], name="copy_messages")
+    with pytest.raises(NetworkError):
+        asyncio.run(policy.run(operation))
+    assert len(calls) == 1
+    # A send Telegram asked to slow down never went through, so it is retried
+    operation, calls = failing([RetryAfter(timedelta(0))], name="forward_messages")
+    assert asyncio.run(policy.run(operation)) == "ok"
+    assert len(calls) == 2
+
+def test_gives_up_after_max_retries():
+    policy = RetryPolicy(max_retries=2, base_delay=0.01, max_delay=0.01)
+    operation, calls = failing([NetworkError("down")] * 5)
+    with pytest.raises(NetworkError):
+        asyncio.run(policy.run(operation))
+    assert len(calls) == 2
+
+def test_breaker_opens_and_lets_one_trial_through():
+    breaker = CircuitBreaker(threshold=2, reset_timeout=0)
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert breaker.allow()
+    # Only one trial at a time
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+
+def test_open_circuit_fails_fast():
+    policy = RetryPolicy(max_retries=1, base_delay=0.01, max_delay=0.01)
+    policy.breakers["get_me"] = CircuitBreaker(threshold=1, reset_timeout=60)
+    operation, calls = failing([NetworkError("down")] * 5)
+    with pytest.raises(NetworkError):
+        asyncio.run(policy.run(operation))
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(policy.run(operation))
+    assert len(calls) == 1
+
+def test_cancelled_trial_frees_the_breaker():
+    async def main():
+        policy = RetryPolicy(max_retries=1)
+        breaker = policy.breakers["get_me"] = CircuitBreaker(threshold=1, reset_timeout=0)
+        breaker.record_failure()
+
+        async def get_me():
+            await asyncio.sleep(60)
+
+        task = asyncio.create_task(policy.run(get_me))
+        await asyncio.sleep(0.01)
+        assert breaker.trial_running
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert breaker.allow()
+    asyncio.run(main())
@@ -0,0 +1,60 @@
+"""
+Tests for the routing module
+"""
+
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+import routing
+from conftest import ROOT, SCRATCH
+from database import Database
+from routing import Route, RouteTable
+
+def test_route_filters():
+    route = Route(-1, 10, {"min_duration": 60, "max_file_size": 5000, "performers": ["Artist"],
+                           "keywords": ["live"]})
+    record = {'duration': 120, 'file_size': 4000, 'performer': "artist", 'title': "Live at home", 'file_name': ""}
+    assert route.matches(record)
+    assert not route.matches(dict(record, duration=30))
+    assert not route.matches(dict(record, file_size=6000))
+    assert not route.matches(dict(record, performer="Someone else"))
+    assert not route.matches(dict(record, title="Studio"))
+    assert Route(-1, 10).matches({})
+
+def test_table_lookups():
+    table = RouteTable()
+    table.load([(-1, 10, None), (-1, 20, {"min_duration": 60}), (-2, 10, None)])
+    assert table.is_source(-1) and not table.is_source(-3)
+    assert table.destinations(-1, {'duration': 120}) == [10, 20]
+    assert table.destinations(-1, {'duration': 30}) == [10]
+    assert table.destinations(-3, {}) == []
+    assert len(table.all_routes()) == 3
+
+def test_seed_creates_the_default_route_once(monkeypatch):
+    monkeypatch.setattr(routing, "GROUP_CHAT_ID", -1)
+    monkeypatch.setattr(routing, "CHANNEL_CHAT_ID", 10)
+    db = Database(os.path.join(tempfile.mkdtemp(dir=SCRATCH), "forwarded_files.db"))
+    try:
+        table = RouteTable()
+        table.seed(db)
+        assert table.destinations(-1, {}) == [10]
+        # A removed default route is not brought back on the next start
+        db.remove_route(-1, 10)
+        table.seed(db)
+        assert table.all_routes() == []
+    finally:
+        db.close()
+
+def test_importing_the_module_does_not_seed():
+    path = os.path.join(tempfile.mkdtemp(dir=SCRATCH), "forwarded_files.db")
+    env = dict(os.environ, PYTHONPATH=ROOT, DATABASE_PATH=path, GROUP_CHAT_ID="-1", CHANNEL_CHAT_ID="10")
+    subprocess.run([sys.executable, "-c", "import routing"], cwd=SCRATCH, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    conn = sqlite3.connect(path)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM routes").fetchone()[0] == 0
+    finally:
+        conn.close()
@@ -0,0 +1,189 @@
+"""
+Tests for the services module
+Telegram is replaced by fakes; the database lives in the scratch directory
+"""
+
+import asyncio
+import random
+from types import SimpleNamespace
+
+import services
+from services import ForwardPipeline, MediaGroupBuffer
+from storage import SQLiteBackend
+from test_storage import local_database, record
+
+def audio_message(chat_id, message_id, media_group_id=None):
+    """Build a stand-in for an audio Message"""
+    audio = SimpleNamespace(
+        file_id=f"file-{chat_id}-{message_id}", file_unique_id=f"unique-{chat_id}-{message_id}",
+        file_name=f"{message_id}.mp3", performer="Performer", title=f"Track {message_id}",
+        duration=180, file_size=1000 + message_id,
+    )
+    return SimpleNamespace(chat_id=chat_id, message_id=message_id, audio=audio, media_group_id=media_group_id)
+
+def test_get_within_never_loses_a_job():
+    async def main():
+        queue = asyncio.Queue()
+        received = []
+        for number in range(200):
+            # Let the put land before, at or after the timeout
+            asyncio.get_running_loop().call_later(random.uniform(0, 0.002), queue.put_nowait, number)
+            job = await ForwardPipeline._get_within(queue, 0.001)
+            if job is not None:
+                received.append(job)
+        await asyncio.sleep(0.01)
+        while not queue.empty():
+            received.append(queue.get_nowait())
+        assert sorted(received) == list(range(200))
+    asyncio.run(main())
+
+def test_get_within_puts_back_a_job_taken_on_cancellation():
+    async def main():
+        queue = asyncio.Queue()
+        task = asyncio.create_task(ForwardPipeline._get_within(queue, 10))
+        await asyncio.sleep(0)
+        queue.put_nowait("job")
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        else:
+            assert task.result() == "job"
+            return
+        assert queue.get_nowait() == "job"
+    asyncio.run(main())
+
+def test_pipeline_batches_by_chat_and_acknowledges(monkeypatch):
+    calls = []
+
+    async def forward_records(bot, chat_id, records):
+        calls.append((chat_id, [record['source_message_id'] for record in records]))
+        return [(True, "success_forward")] * len(records)
+
+    monkeypatch.setattr(services.ForwardService, "forward_records", staticmethod(forward_records))
+
+    async def main():
+        pipeline = ForwardPipeline(workers=1, queue_size=100, batch_max=100, batch_window_ms=50)
+        pipeline.start(bot=None)
+        acks = []
+
+        async def acknowledge(results):
+            acks.append(results)
+
+        for message_id in (1, 2, 3):
+            await pipeline.submit([audio_message(-1, message_id)], acknowledge)
+        await pipeline.submit([audio_message(-2, 1)], acknowledge)
+        assert await pipeline.drain(5) == 0
+        await pipeline.stop()
+        assert calls == [(-1, [1, 2, 3]), (-2, [1])]
+        assert acks == [[(True, "success_forward")]] * 4
+    asyncio.run(main())
+
+class RecordingPipeline:
+    """Stands in for ForwardPipeline, recording submissions or failing them"""
+
+    def __init__(self, error=None):
+        self.submitted = []
+        self.error = error
+
+    async def submit(self, messages, on_done=None):
+        if self.error:
+            raise self.error
+        self.submitted.append([message.message_id for message in messages])
+
+def test_album_items_are_submitted_together():
+    async def main():
+        pipeline = RecordingPipeline()
+        buffer = MediaGroupBuffer(pipeline, window_ms=50)
+        for message_id in (3, 1, 2):
+            buffer.add(audio_message(-1, message_id, media_group_id="a"))
+            await asyncio.sleep(0.02)
+        buffer.add(audio_message(-1, 9, media_group_id="b"))
+        await asyncio.sleep(0.2)
+        assert sorted(pipeline.submitted) == [[1, 2, 3], [9]]
+        assert not buffer.groups and not buffer.tasks
+    asyncio.run(main())
+
+def test_failed_album_submit_is_reported():
+    async def main():
+        buffer = MediaGroupBuffer(RecordingPipeline(error=RuntimeError("disk full")), window_ms=10)
+        results = []
+
+        async def acknowledge(album_results):
+            results.append(album_results)
+
+        buffer.add(audio_message(-1, 1, media_group_id="a"), acknowledge)
+        buffer.add(audio_message(-1, 2, media_group_id="a"))
+        await asyncio.sleep(0.1)
+        assert results == [[(False, "failed_forward")] * 2]
+    asyncio.run(main())
+
+class ForwardingBot:
+    """Bot stand-in that forwards every message it is asked to"""
+
+    def __init__(self):
+        self.forwarded = []
+        self.next_id = 1000
+
+    async def get_me(self):
+        return SimpleNamespace(username="afsaneh_test_bot")
+
+    async def forward_messages(self, chat_id, from_chat_id, message_ids):
+        self.forwarded.append((chat_id, from_chat_id, list(message_ids)))
+        self.next_id += len(message_ids)
+        return [SimpleNamespace(message_id=self.next_id - len(message_ids) + i) for i in range(len(message_ids))]
+
+class Unlimited:
+    async def acquire(self, chat_id, cost=1):
+        pass
+
+class OneRoute:
+    def destinations(self, chat_id, record):
+        return [10]
+
+def replay_setup(monkeypatch):
+    """Point the services at a fresh local database, with pacing lifted and every chat routed to 10"""
+    database = local_database()
+    monkeypatch.setattr(services, "async_db", database)
+    monkeypatch.setattr(services, "store", SQLiteBackend(database))
+    monkeypatch.setattr(services, "scheduler", Unlimited())
+    monkeypatch.setattr(services, "route_table", OneRoute())
+    return database
+
+def test_outbox_resume_forwards_only_unfinished_intents(monkeypatch):
+    database = replay_setup(monkeypatch)
+    bot = ForwardingBot()
+    records = [record(1), record(2), record(3)]
+
+    async def main():
+        await database.add_outbox_intents(records, 10)
+        # The previous run forwarded record 2 but died before closing its intent
+        await database.save_forwarded_files([dict(record(2), message_id=5)])
+        assert await services.ForwardService.resume_outbox(bot) == 2
+        assert bot.forwarded == [(10, -100, [1, 3])]
+        assert await database.get_outbox_intents(5) == []
+        # Nothing is left to replay on the next start
+        assert await services.ForwardService.resume_outbox(bot) == 0
+        assert len(bot.forwarded) == 1
+    try:
+        asyncio.run(main())
+    finally:
+        database.close()
+
+def test_sync_forwards_the_journal_gap_once(monkeypatch):
+    database = replay_setup(monkeypatch)
+    bot = ForwardingBot()
+
+    async def main():
+        await database.record_group_messages([record(3), record(1), record(2)])
+        await database.save_forwarded_files([dict(record(2), message_id=5)], 10)
+        assert await services.ForwardService.sync_with_channel(bot) == 2
+        assert bot.forwarded == [(10, -100, [1, 3])]
+        assert await database.is_file_forwarded(dest_chat_id=10, **record(3))
+        assert await services.ForwardService.sync_with_channel(bot) == 0
+        assert len(bot.forwarded) == 1
+    try:
+        asyncio.run(main())
+    finally:
+        database.close()
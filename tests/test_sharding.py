@@ -0,0 +1,170 @@
+"""
+Tests for the sharding module
+The supervisor side runs without spawning workers; tests connect as workers over its socket
+"""
+
+import asyncio
+import json
+
+from telegram import Update
+
+from sharding import UpdateDistributor, UpdateReceiver, local_shard, shard_for
+
+class OffsetStore:
+    """Records the update offsets the distributor saves"""
+
+    def __init__(self):
+        self.offsets = []
+
+    async def save_update_offset(self, update_id):
+        self.offsets.append(update_id)
+
+class FakeWorker:
+    """A worker connection speaking the frame protocol by hand"""
+
+    def __init__(self, index, port):
+        self.index = index
+        self.port = port
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", self.port)
+        await self.send({"hello": self.index})
+
+    async def send(self, frame):
+        self.writer.write((json.dumps(frame) + "\n").encode("utf-8"))
+        await self.writer.drain()
+
+    async def receive(self):
+        return json.loads(await asyncio.wait_for(self.reader.readline(), 2))
+
+    def close(self):
+        self.writer.close()
+
+async def start_distributor(workers):
+    """Start a distributor's socket without spawning worker processes"""
+    distributor = UpdateDistributor(workers, OffsetStore())
+    distributor.server = await asyncio.start_server(distributor._handle_worker, "127.0.0.1", 0)
+    distributor.port = distributor.server.sockets[0].getsockname()[1]
+    return distributor
+
+async def connected(distributor, index):
+    """Connect a fake worker and wait until the distributor registered it"""
+    worker = FakeWorker(index, distributor.port)
+    await worker.connect()
+    while distributor.links[index].writer is None:
+        await asyncio.sleep(0.01)
+    return worker
+
+def update(update_id, chat_id):
+    """Build a text message update from a chat"""
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "text": "x",
+                    "chat": {"id": chat_id, "type": "supergroup", "title": "t"}},
+    }, None)
+
+def test_shard_for():
+    assert shard_for(-1001, 1) == 0
+    assert {shard_for(chat_id, 4) for chat_id in range(-8, 0)} == {0, 1, 2, 3}
+    assert shard_for(-1003, 4) == shard_for(-1003, 4)
+
+def test_updates_go_to_the_owning_worker_and_acks_advance_the_offset():
+    async def main():
+        distributor = await start_distributor(2)
+        workers = [await connected(distributor, index) for index in range(2)]
+        await distributor.dispatch(update(1, -2))
+        await distributor.dispatch(update(2, -1))
+        await distributor.dispatch(update(3, -2))
+        assert [(await workers[0].receive())["update"]["update_id"] for _ in range(2)] == [1, 3]
+        assert (await workers[1].receive())["update"]["update_id"] == 2
+
+        # The offset only passes updates every worker has acknowledged
+        await workers[1].send({"ack": 2})
+        await workers[0].send({"ack": 3})
+        await asyncio.sleep(0.1)
+        assert distributor.store.offsets == []
+        await workers[0].send({"ack": 1})
+        await asyncio.wait_for(distributor.drained.wait(), 2)
+        assert distributor.store.offsets == [3]
+        for worker in workers:
+            worker.close()
+        distributor.server.close()
+    asyncio.run(main())
+
+def test_restarted_worker_gets_sync_controls_and_unacked_updates():
+    async def main():
+        distributor = await start_distributor(2)
+        workers = [await connected(distributor, index) for index in range(2)]
+        await distributor.sync()
+        assert await workers[0].receive() == {"sync": True}
+        await workers[1].send({"relay": {"action": "pause", "value": None}})
+        assert await workers[0].receive() == {"control": {"action": "pause", "value": None}}
+        await distributor.dispatch(update(7, -2))
+        assert (await workers[0].receive())["update"]["update_id"] == 7
+
+        workers[0].close()
+        while distributor.links[0].writer is not None:
+            await asyncio.sleep(0.01)
+        worker = await connected(distributor, 0)
+        assert await worker.receive() == {"sync": True}
+        assert await worker.receive() == {"control": {"action": "pause", "value": None}}
+        assert (await worker.receive())["update"]["update_id"] == 7
+        worker.close()
+        workers[1].close()
+        distributor.server.close()
+    asyncio.run(main())
+
+def test_receiver_processes_frames_and_relays_controls():
+    class FakeApp:
+        bot = None
+
+        def __init__(self):
+            self.processed = []
+
+        async def process_update(self, update):
+            self.processed.append(update.update_id)
+
+    async def main():
+        server_frames = asyncio.Queue()
+        connection = asyncio.get_running_loop().create_future()
+
+        async def handle(reader, writer):
+            connection.set_result(writer)
+            while line := await reader.readline():
+                await server_frames.put(json.loads(line))
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        app = FakeApp()
+        synced = []
+        controls = []
+
+        async def on_sync():
+            synced.append(True)
+
+        async def on_control(control):
+            controls.append(control)
+
+        receiver = UpdateReceiver(app, 1, port, on_sync, on_control)
+        task = asyncio.create_task(receiver.run(asyncio.Event()))
+        writer = await connection
+        assert await server_frames.get() == {"hello": 1}
+
+        for frame in ({"sync": True}, {"update": update(5, -1).to_dict()},
+                      {"control": {"action": "resume", "value": None}}):
+            writer.write((json.dumps(frame) + "\n").encode("utf-8"))
+        await writer.drain()
+        assert await asyncio.wait_for(server_frames.get(), 2) == {"ack": 5}
+        await local_shard.announce("reload_routes")
+        assert await asyncio.wait_for(server_frames.get(), 2) == {"relay": {"action": "reload_routes", "value": None}}
+
+        writer.write(b'{"stop": true}\n')
+        await writer.drain()
+        await asyncio.wait_for(task, 2)
+        assert synced == [True] and app.processed == [5]
+        assert controls == [{"action": "resume", "value": None}]
+        # Outside supervisor mode announcing is a no-op
+        assert local_shard.relay is None
+        await local_shard.announce("pause")
+        server.close()
+    asyncio.run(main())
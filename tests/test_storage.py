@@ -0,0 +1,248 @@
+"""
+Tests for the storage module
+RedisBackend runs against the RespServer stand-in
+"""
+
+import asyncio
+import os
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+
+import dedup
+from conftest import SCRATCH
+from database import AsyncDatabase, Database
+from storage import RedisBackend, RespClient, RespServer, RespError, _encode_command, _read_reply
+
+def record(index, **fields):
+    """Build an audio record the way dedup.audio_record does"""
+    values = {
+        'file_id': f"file-{index}",
+        'file_name': f"track-{index}.mp3",
+        'performer': "Performer",
+        'title': f"Track {index}",
+        'file_unique_id': f"unique-{index}",
+        'source_chat_id': -100,
+        'source_message_id': index,
+        'duration': 180 + index,
+        'file_size': 1000 + index,
+    }
+    values.update(fields)
+    return values
+
+def local_database():
+    """Open a fresh local database in the scratch directory"""
+    return AsyncDatabase(Database(os.path.join(tempfile.mkdtemp(dir=SCRATCH), "forwarded_files.db")))
+
+def with_backends(test, count=1, database=None):
+    """Run test(server, *backends) against a fresh server, with backends sharing one prefix"""
+    async def main():
+        server = RespServer()
+        await server.start()
+        prefix = f"test-{uuid.uuid4().hex[:8]}:"
+        backends = [
+            RedisBackend(RespClient(server.url), prefix=prefix, **({'database': database} if database else {}))
+            for _ in range(count)
+        ]
+        try:
+            await test(server, *backends)
+        finally:
+            for backend in backends:
+                await backend.client.close()
+            await server.stop()
+    asyncio.run(main())
+
+def test_encode_command():
+    assert _encode_command(("SET", "k", 5)) == b"*3\r\n$3\r\nSET\r\n$1\r\nk\r\n$1\r\n5\r\n"
+    assert _encode_command(("GET", "ключ")) == b"*2\r\n$3\r\nGET\r\n$8\r\n" + "ключ".encode() + b"\r\n"
+
+def test_read_reply():
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"+OK\r\n-ERR bad\r\n:42\r\n$5\r\nhello\r\n$-1\r\n*2\r\n:1\r\n$1\r\nx\r\n*-1\r\n")
+        reader.feed_eof()
+        assert await _read_reply(reader) == "OK"
+        error = await _read_reply(reader)
+        assert isinstance(error, RespError) and str(error) == "ERR bad"
+        assert await _read_reply(reader) == 42
+        assert await _read_reply(reader) == "hello"
+        assert await _read_reply(reader) is None
+        assert await _read_reply(reader) == [1, "x"]
+        assert await _read_reply(reader) is None
+        try:
+            await _read_reply(reader)
+        except ConnectionError:
+            pass
+        else:
+            raise AssertionError("expected ConnectionError at end of stream")
+    asyncio.run(main())
+
+def test_error_reply_raises():
+    async def test(server, backend):
+        try:
+            await backend.client.execute("EVAL", "return 1", 0)
+        except RespError as e:
+            assert str(e).startswith("NOSCRIPT")
+        else:
+            raise AssertionError("expected NOSCRIPT")
+    with_backends(test)
+
+def test_claim_and_release():
+    async def test(server, first, second):
+        assert await first.claim([["a", "b"], ["c"]]) == [True, True]
+        # Overlapping on "b" refuses the whole file and leaves nothing of it held
+        assert await second.claim([["b", "d"], ["e"]]) == [False, True]
+        assert await first.claim([["d"]]) == [True]
+        await first.release(["a", "b", "c", "d"])
+        assert await second.claim([["a", "b", "c", "d"]]) == [True]
+    with_backends(test, count=2)
+
+def test_claim_resent_after_timeout_counts_as_granted():
+    async def test(server, backend):
+        original = backend.client._roundtrip
+        calls = []
+
+        async def lose_first_reply(commands):
+            replies = await original(commands)
+            calls.append(commands)
+            if len(calls) == 1:
+                raise asyncio.TimeoutError()
+            return replies
+
+        backend.client._roundtrip = lose_first_reply
+        assert await backend.claim([["x"]]) == [True]
+        assert len(calls) == 2
+    with_backends(test)
+
+def test_claims_are_exclusive_within_one_backend():
+    async def test(server, backend):
+        assert await backend.claim([["x"]]) == [True]
+        assert await backend.claim([["x"]]) == [False]
+    with_backends(test)
+
+def test_release_keeps_claims_taken_over_after_expiry():
+    async def test(server, first, second):
+        assert await first.claim([["x"]], ttl=0.05) == [True]
+        await asyncio.sleep(0.1)
+        assert await second.claim([["x"]]) == [True]
+        await first.release(["x"])
+        assert await first.claim([["x"]]) == [False]
+    with_backends(test, count=2)
+
+def test_files_forwarded_per_destination():
+    async def test(server, backend):
+        files = [record(1), record(2)]
+        assert await backend.files_forwarded([(files[0], None), (files[1], 10)]) == [False, False]
+        await backend.save_forwarded_files([dict(files[0], message_id=7)], dest_chat_id=10)
+        assert await backend.files_forwarded([(files[0], None), (files[0], 10), (files[0], 20)]) == [True, True, False]
+        # The same content under a new file_id matches on its file_unique_id
+        copy = record(1, file_id="other", source_message_id=99)
+        assert await backend.is_file_forwarded(dest_chat_id=10, **copy)
+        assert await backend.get_forwarded_count() == 1
+        assert server.data[f"{backend.prefix}dest:unique-1"] == {"10": "7"}
+    with_backends(test)
+
+def test_signature_match_is_opt_in(monkeypatch):
+    async def test(server, backend):
+        reupload = record(1, file_id="other", file_unique_id="other", source_message_id=99)
+        monkeypatch.setattr(dedup, "DEDUP_MATCH_SIGNATURE", True)
+        await backend.save_forwarded_files([record(1)], dest_chat_id=10)
+        assert await backend.is_file_forwarded(dest_chat_id=10, **reupload)
+        monkeypatch.setattr(dedup, "DEDUP_MATCH_SIGNATURE", False)
+        assert not await backend.is_file_forwarded(dest_chat_id=10, **reupload)
+    with_backends(test)
+
+def test_files_saved_without_destination_count_everywhere():
+    async def test(server, backend):
+        await backend.save_forwarded_files([record(3)])
+        assert await backend.files_forwarded([(record(3), 10), (record(3), 20)]) == [True, True]
+        assert await backend.get_last_forwarded_date() != "N/A"
+    with_backends(test)
+
+def test_forwarded_count_matches_sqlite():
+    local = local_database()
+    reference = local_database()
+    async def test(server, backend):
+        saves = [
+            ([record(1)], 10),
+            # The same content under a new file_id, and the same file_id for another destination
+            ([record(1, file_id="other", source_message_id=99)], 20),
+            ([record(1)], 30),
+            ([record(2), record(3, file_unique_id=None)], 10),
+            ([record(3, file_unique_id=None)], None),
+        ]
+        for records, dest_chat_id in saves:
+            await backend.save_forwarded_files(records, dest_chat_id)
+            await reference.save_forwarded_files(records, dest_chat_id)
+        assert await backend.get_forwarded_count() == await reference.get_forwarded_count() == 3
+        # Saves are written through to the local database
+        assert await local.get_forwarded_count() == 3
+        assert await local.is_file_forwarded(dest_chat_id=20, **record(1))
+    try:
+        with_backends(test, database=local)
+    finally:
+        local.close()
+        reference.close()
+
+def test_first_start_imports_local_history():
+    local = local_database()
+    async def test(server, first, second):
+        await local.save_forwarded_files([dict(record(1), message_id=7)], 10)
+        await local.save_forwarded_files([dict(record(1), message_id=8), record(2)], 20)
+        await local.save_forwarded_files([record(3, file_unique_id=None)])
+        await local.save_update_offset(55)
+        await first.prepare()
+        assert await first.files_forwarded([(record(1), 10), (record(1), 30), (record(2), 10), (record(3), 30)]) == [
+            True, False, False, True
+        ]
+        assert server.data[f"{first.prefix}dest:unique-1"] == {"10": "7", "20": "8"}
+        assert await first.get_forwarded_count() == await local.get_forwarded_count() == 3
+        assert await first.get_update_offset() == 55
+        assert await first.get_last_forwarded_date() == await local.get_last_forwarded_date()
+        # Only the first start imports, and importing again counts nothing twice
+        await first.save_update_offset(60)
+        await second.prepare()
+        assert await second.get_update_offset() == 60
+        assert await second.import_local(page_size=1) == 3
+        assert await second.get_forwarded_count() == 3
+    try:
+        with_backends(test, count=2, database=local)
+    finally:
+        local.close()
+
+def test_journal_lists_unforwarded_messages():
+    async def test(server, backend):
+        since = datetime.now() - timedelta(minutes=1)
+        await backend.record_group_messages([record(2), record(1), record(3)])
+        # Journaling a message again keeps a single entry
+        await backend.record_group_messages([record(1)])
+        await backend.save_forwarded_files([record(2)])
+        pending = await backend.get_unforwarded_messages(since)
+        assert [item['source_message_id'] for item in pending] == [1, 3]
+        await backend.prune_group_messages(datetime.now() + timedelta(seconds=1))
+        assert await backend.get_unforwarded_messages(since) == []
+    with_backends(test)
+
+def test_update_offset():
+    async def test(server, backend):
+        assert await backend.get_update_offset() == 0
+        await backend.save_update_offset(1234)
+        assert await backend.get_update_offset() == 1234
+    with_backends(test)
+
+def test_lease():
+    async def test(server, first, second):
+        assert await first.acquire_lease("forwarder", "a", 0.2)
+        assert not await second.acquire_lease("forwarder", "b", 0.2)
+        # Renewing extends the holder's lease
+        assert await first.acquire_lease("forwarder", "a", 0.2)
+        # Releasing someone else's lease does nothing
+        await second.release_lease("forwarder", "b")
+        assert not await second.acquire_lease("forwarder", "b", 0.2)
+        await asyncio.sleep(0.3)
+        assert await second.acquire_lease("forwarder", "b", 0.2)
+        # The old holder can no longer extend a lease that went to another owner
+        assert not await first.acquire_lease("forwarder", "a", 0.2)
+        await second.release_lease("forwarder", "b")
+        assert await first.acquire_lease("forwarder", "a", 0.2)
+    with_backends(test, count=2)
@@ -0,0 +1,97 @@
+"""
+Tests for the webhook module
+Requests go over a real socket to a WebhookServer on a free port
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from webhook import FakeSender, WebhookServer, MAX_BODY_SIZE
+
+SECRET = "s3cret"
+
+def update(update_id):
+    """Build a text message update in Bot API JSON form"""
+    return {
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "text": "x",
+                    "chat": {"id": -1, "type": "supergroup", "title": "t"}},
+    }
+
+def with_server(test):
+    """Run test(server, url) against a started server whose updates land in server.app.update_queue"""
+    async def main():
+        app = SimpleNamespace(bot=None, update_queue=asyncio.Queue())
+        server = WebhookServer(app, listen="127.0.0.1", port=0, path="/telegram", secret=SECRET, url=None)
+        await server.start()
+        try:
+            await test(server, f"http://127.0.0.1:{server.port}/telegram")
+        finally:
+            await server.stop()
+    asyncio.run(main())
+
+async def raw_request(port, head, body=b""):
+    """Send one request and return the status and the reply's Connection header"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        connection = None
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.lower() == "connection":
+                connection = value.strip()
+        return status, connection
+    finally:
+        writer.close()
+
+def test_requires_a_secret():
+    with pytest.raises(ValueError):
+        WebhookServer(SimpleNamespace(), secret="")
+
+def test_queues_updates_with_the_secret():
+    async def test(server, url):
+        sender = FakeSender(url, SECRET)
+        try:
+            assert [await sender.send(update(i)) for i in (1, 2)] == [200, 200]
+        finally:
+            await sender.close()
+        assert [server.app.update_queue.get_nowait().update_id for _ in range(2)] == [1, 2]
+    with_server(test)
+
+def test_rejects_a_wrong_or_missing_secret():
+    async def test(server, url):
+        sender = FakeSender(url, "wrong")
+        try:
+            assert await sender.send(update(1)) == 403
+        finally:
+            await sender.close()
+        body = b'{"update_id": 2}'
+        head = f"POST /telegram HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n"
+        assert (await raw_request(server.port, head, body))[0] == 403
+        assert server.app.update_queue.empty()
+    with_server(test)
+
+def test_rejects_an_oversized_body_without_reading_it():
+    async def test(server, url):
+        head = (f"POST /telegram HTTP/1.1\r\nContent-Length: {MAX_BODY_SIZE + 1}\r\n"
+                f"X-Telegram-Bot-Api-Secret-Token: {SECRET}\r\n\r\n")
+        assert await raw_request(server.port, head) == (413, "close")
+        assert server.app.update_queue.empty()
+    with_server(test)
+
+def test_rejects_other_paths_methods_and_bad_json():
+    async def test(server, url):
+        secret = f"X-Telegram-Bot-Api-Secret-Token: {SECRET}\r\n"
+        assert (await raw_request(server.port, f"POST /other HTTP/1.1\r\n{secret}Content-Length: 0\r\n\r\n"))[0] == 404
+        assert (await raw_request(server.port, f"GET /telegram HTTP/1.1\r\n{secret}\r\n"))[0] == 405
+        head = f"POST /telegram HTTP/1.1\r\n{secret}Content-Length: 3\r\n\r\n"
+        assert (await raw_request(server.port, head, b"{x}"))[0] == 400
+        assert server.app.update_queue.empty()
+    with_server(test)
@@ -5,12 +5,18 @@ Contains helper functions and utilities
 
 import asyncio
 import logging
+import time
 import traceback
 from datetime import datetime
 from telegram import Update
+from telegram.constants import ChatMemberStatus, ChatType
 from telegram.ext import ContextTypes
 
-from config import runtime, MAX_RETRIES, RETRY_DELAY, GROUP_CHAT_ID
+from config import runtime, ADMIN_CACHE_TTL
+from perf import perf
+from ratelimit import scheduler
+from routing import route_table
+from retry import retry_policy
 
 logger = logging.getLogger('afsaneh_bot')
 
@@ -20,7 +26,11 @@ def update_last_activity():
 
 async def retry_telegram_operation(operation, *args, **kwargs):
     """
-    Retry a Telegram API operation with exponential backoff
+    Call a Telegram API operation through the retry policy
+    
+    Flood waits are honoured exactly, network errors are retried with
+    jittered backoff, requests Telegram rejects are not retried, and each
+    endpoint has a circuit breaker (see retry.RetryPolicy).
     
     Args:
         operation: The async function to call
@@ -29,23 +39,86 @@ async def retry_telegram_operation(operation, *args, **kwargs):
     Returns:
         The result of the operation, or raises the last exception after retries
     """
-    retry_count = 0
-    while retry_count < MAX_RETRIES:
-        try:
-            result = await operation(*args, **kwargs)
-            update_last_activity()
-            return result
-        except Exception as e:
-            retry_count += 1
-            error_type = type(e).__name__
-            if retry_count >= MAX_RETRIES:
-                logger.error(f"Failed after {MAX_RETRIES} retries: {error_type} - {str(e)}")
-                raise
+    with perf.span(f"telegram.{getattr(operation, '__name__', 'call')}"):
+        result = await retry_policy.run(operation, *args, **kwargs)
+    update_last_activity()
+    return result
+
+class AdminCache:
+    """
+    Per-chat admin rosters cached for a TTL
+    
+    A roster is loaded in one get_chat_administrators call and then answers
+    every admin check in that chat until it expires. chat_member updates
+    patch cached rosters in place, so promotions and demotions take effect
+    without another API call.
+    """
+    
+    ADMIN_STATUSES = (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+    
+    def __init__(self, ttl=ADMIN_CACHE_TTL):
+        """
+        Initialize an empty cache
+        
+        Args:
+            ttl: Seconds a roster stays valid
+        """
+        self.ttl = ttl
+        self.rosters = {}
+        self.locks = {}
+    
+    async def get_admins(self, bot, chat_id):
+        """
+        Return the IDs of a chat's admins, loading the roster if needed
+        
+        Args:
+            bot: Telegram bot instance
+            chat_id: Chat to look up
             
-            wait_time = RETRY_DELAY * (2 ** (retry_count - 1))  # exponential backoff
-            logger.warning(f"Retry {retry_count}/{MAX_RETRIES} after {wait_time}s due to {error_type}: {str(e)}")
-            await asyncio.sleep(wait_time)
+        Returns:
+            set: User IDs of the chat's admins
+        """
+        cached = self.rosters.get(chat_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        
+        # One refresh per chat at a time; concurrent checks wait for it
+        lock = self.locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            cached = self.rosters.get(chat_id)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+            
+            members = await retry_telegram_operation(bot.get_chat_administrators, chat_id=chat_id)
+            admins = {member.user.id for member in members}
+            self.rosters[chat_id] = (time.monotonic() + self.ttl, admins)
+            return admins
+    
+    def apply_member_update(self, chat_member_updated):
+        """
+        Patch a cached roster from a chat_member update
+        
+        Args:
+            chat_member_updated: ChatMemberUpdated object from Telegram
+        """
+        cached = self.rosters.get(chat_member_updated.chat.id)
+        if not cached:
+            return
+        
+        member = chat_member_updated.new_chat_member
+        if member.status in self.ADMIN_STATUSES:
+            cached[1].add(member.user.id)
+        else:
+            cached[1].discard(member.user.id)
+    
+    def invalidate(self, chat_id):
+        """Drop a chat's cached roster"""
+        self.rosters.pop(chat_id, None)
+
+# Create a singleton instance for use throughout the app
+admin_cache = AdminCache()
 
+@perf.timed("utils.is_admin")
 async def is_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     """
     Check if the user is an admin
@@ -57,20 +130,20 @@ async def is_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     Returns:
         bool: True if user is admin, False otherwise
     """
+    chat = update.effective_chat
+    if chat.type == ChatType.PRIVATE:
+        return False
+    
     try:
-        user = await retry_telegram_operation(
-            context.bot.get_chat_member,
-            chat_id=update.effective_chat.id,
-            user_id=update.effective_user.id
-        )
-        return user.status in ["administrator", "creator"]
+        admins = await admin_cache.get_admins(context.bot, chat.id)
+        return update.effective_user.id in admins
     except Exception as e:
         logger.error(f"Admin check error: {e}")
         return False
 
 async def check_admin_and_group(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     """
-    Check if the user is an admin and the command is used in the proper group
+    Check if the user is an admin and the command is used in a routed source group
     
     Args:
         update: Update object from Telegram
@@ -84,21 +157,22 @@ async def check_admin_and_group(update: Update, context: ContextTypes.DEFAULT_TY
     # Check if user is admin
     if not await is_admin(update, context):
         await retry_telegram_operation(
-            update.reply_text,
+            update.effective_message.reply_text,
             get_text("admin_only")
         )
         return False
     
-    # Check if in the right group
-    if str(update.effective_chat.id) != str(GROUP_CHAT_ID):
+    # Check if in a routed group
+    if not route_table.is_source(update.effective_chat.id):
         await retry_telegram_operation(
-            update.reply_text,
+            update.effective_message.reply_text,
             get_text("group_only")
         )
         return False
     
     return True
 
+@perf.timed("utils.reply_to_message")
 async def reply_to_message(update: Update, text: str):
     """
     Helper to reply to a message with error handling
@@ -108,8 +182,9 @@ async def reply_to_message(update: Update, text: str):
         text: Text to send in reply
     """
     try:
+        await scheduler.acquire(update.effective_chat.id)
         await retry_telegram_operation(
-            update.reply_text,
+            update.effective_message.reply_text,
             text
         )
     except Exception as e:
@@ -0,0 +1,247 @@
+"""
+Webhook module for AfsanehBayebot
+Receives updates pushed by Telegram and hands them straight to the application
+
+Usage of the fake sender (posts one JSON update per input line):
+    python webhook.py --url http://127.0.0.1:8443/telegram --secret SECRET < updates.jsonl
+"""
+
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import sys
+from urllib.parse import urlsplit
+
+from telegram import Update
+
+from config import WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS
+
+logger = logging.getLogger('afsaneh_bot')
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+MAX_BODY_SIZE = 1024 * 1024  # updates are small; anything larger is not from Telegram
+
+REASONS = {
+    200: "OK", 400: "Bad Request", 403: "Forbidden", 404: "Not Found",
+    405: "Method Not Allowed", 413: "Payload Too Large",
+}
+
+class WebhookServer:
+    """
+    Embedded HTTP server for Telegram webhooks
+
+    Each POST to the webhook path is checked against the secret token,
+    decoded into an Update and put on the application's update queue, so it
+    reaches the same handlers as a polled update. Connections are kept alive
+    because Telegram reuses them.
+    """
+
+    def __init__(self, app, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, path=WEBHOOK_PATH,
+                 secret=WEBHOOK_SECRET, url=WEBHOOK_URL):
+        """
+        Initialize the server (nothing listens until start())
+
+        Args:
+            app: Started Application that receives the updates
+            listen: Interface to bind
+            port: TCP port to bind
+            path: URL path Telegram posts to
+            secret: Expected X-Telegram-Bot-Api-Secret-Token value
+            url: Public URL registered with Telegram; None skips registration
+        """
+        if not secret:
+            raise ValueError("WEBHOOK_SECRET must be set to run in webhook mode")
+        self.app = app
+        self.listen = listen
+        self.port = port
+        self.path = "/" + path.strip("/")
+        self.secret = secret.encode("utf-8")
+        self.url = url
+        self.server = None
+        self.writers = set()
+
+    async def start(self, allowed_updates=None):
+        """
+        Start listening and register the webhook with Telegram
+
+        Args:
+            allowed_updates: Update types Telegram should push
+        """
+        self.server = await asyncio.start_server(self._handle_connection, self.listen, self.port)
+        if not self.port:
+            self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"Webhook listening on {self.listen}:{self.port}{self.path}")
+
+        if self.url:
+            await self.app.bot.set_webhook(
+                url=self.url,
+                secret_token=self.secret.decode("utf-8"),
+                allowed_updates=allowed_updates,
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+                drop_pending_updates=False
+            )
+            logger.info(f"Webhook registered at {self.url}")
+
+    async def stop(self):
+        """
+        Stop accepting updates
+
+        The webhook stays registered, so Telegram queues updates until the
+        bot is back.
+        """
+        if self.server:
+            self.server.close()
+            for writer in list(self.writers):
+                writer.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _handle_update(self, method, path, headers, body):
+        """Validate one request and queue its update; return the HTTP status"""
+        if path.split("?")[0].rstrip("/") != self.path.rstrip("/"):
+            return 404
+        if method != "POST":
+            return 405
+        token = headers.get(SECRET_HEADER, "").encode("utf-8")
+        if not hmac.compare_digest(token, self.secret):
+            logger.warning("Webhook request with a wrong secret token rejected")
+            return 403
+
+        try:
+            update = Update.de_json(json.loads(body), self.app.bot)
+        except Exception as e:
+            logger.error(f"Undecodable webhook update: {e}")
+            return 400
+
+        await self.app.update_queue.put(update)
+        return 200
+
+    async def _handle_connection(self, reader, writer):
+        """Serve requests on one connection until the client closes it"""
+        self.writers.add(writer)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length") or 0)
+                parts = request_line.decode("latin-1").split()
+                if len(parts) < 2:
+                    break
+                if length > MAX_BODY_SIZE:
+                    status = 413
+                else:
+                    body = await reader.readexactly(length)
+                    status = await self._handle_update(parts[0], parts[1], headers, body)
+
+                keep_alive = status != 413 and headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Length: 0\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            logger.debug(f"Webhook connection error: {e}")
+        except asyncio.CancelledError:
+            # Shutting down with the connection idle
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+class FakeSender:
+    """
+    Posts updates to a webhook the way Telegram does, for local testing
+
+    Keeps one connection open and sends updates in order, each with the
+    secret token header.
+    """
+
+    def __init__(self, url, secret):
+        """
+        Initialize the sender (connects on first send)
+
+        Args:
+            url: Webhook URL, e.g. http://127.0.0.1:8443/telegram
+            secret: Secret token to send
+        """
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = parts.path or "/"
+        self.secret = secret
+        self.reader = None
+        self.writer = None
+
+    async def send(self, update):
+        """
+        Post one update
+
+        Args:
+            update: Update as a dict in Bot API JSON form
+
+        Returns:
+            int: HTTP status of the response
+        """
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        body = json.dumps(update).encode("utf-8")
+        self.writer.write(
+            f"POST {self.path} HTTP/1.1\r\nHost: {self.host}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"X-Telegram-Bot-Api-Secret-Token: {self.secret}\r\n\r\n".encode("latin-1") + body
+        )
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        await self.reader.readexactly(int(headers.get("content-length") or 0))
+
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return int(status_line.split()[1])
+
+    async def close(self):
+        """Close the connection"""
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+            self.reader = None
+
+async def _send_lines(url, secret, lines):
+    """Post every non-empty JSON line and report the statuses"""
+    sender = FakeSender(url, secret)
+    try:
+        for line in lines:
+            if line.strip():
+                status = await sender.send(json.loads(line))
+                print(status)
+    finally:
+        await sender.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Post JSON updates from stdin to a local webhook")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument("--secret", default=WEBHOOK_SECRET)
+    args = parser.parse_args()
+    asyncio.run(_send_lines(args.url, args.secret, sys.stdin))